@@ -41,6 +41,14 @@ class TestClassConfig(unittest.TestCase):
             ('allowed_x_host', 0),
             ('allowed_x_port', 0),
             ('allowed_x_prefix', 0),
+            ('archive_append', False),
+            ('gzip_level', 6),
+            ('gzip_min_size', 1024),
+            ('gzip_cache_size', 104857600),
+            ('token_backend', 'file'),
+            ('markdown_cache_size', 16777216),
+            ('markdown_disk_cache_size', 0),
+            ('server_timing', False),
             ]))
         self.assertDictEqual(conf['server'], OrderedDict([
             ('port', 9999),
@@ -50,6 +58,11 @@ class TestClassConfig(unittest.TestCase):
             ('ssl_cert', './wsb/wsb.crt'),
             ('ssl_pw', ''),
             ('browse', True),
+            ('engine', 'werkzeug'),
+            ('threads', 16),
+            ('processes', 1),
+            ('backlog', 128),
+            ('keep_alive', 5),
             ]))
         self.assertDictEqual(conf['browser'], OrderedDict([
             ('command', ''),
@@ -108,6 +121,14 @@ class TestClassConfig(unittest.TestCase):
             ('allowed_x_host', 0),
             ('allowed_x_port', 0),
             ('allowed_x_prefix', 0),
+            ('archive_append', False),
+            ('gzip_level', 6),
+            ('gzip_min_size', 1024),
+            ('gzip_cache_size', 104857600),
+            ('token_backend', 'file'),
+            ('markdown_cache_size', 16777216),
+            ('markdown_disk_cache_size', 0),
+            ('server_timing', False),
             ]))
         with self.assertRaises(KeyError):
             conf['book']['book2']
@@ -202,6 +223,14 @@ allowed_x_proto = 1
 allowed_x_host = 0
 allowed_x_port = 0
 allowed_x_prefix = 0
+archive_append = false
+gzip_level = 6
+gzip_min_size = 1024
+gzip_cache_size = 104857600
+token_backend = file
+markdown_cache_size = 16777216
+markdown_disk_cache_size = 0
+server_timing = false
 
 [server]
 port = 9999
@@ -211,6 +240,11 @@ ssl_key = ./wsb/wsb.key
 ssl_cert = ./wsb/wsb.crt
 ssl_pw = 
 browse = yes
+engine = werkzeug
+threads = 16
+processes = 1
+backlog = 128
+keep_alive = 5
 
 [browser]
 command = 
@@ -270,6 +304,14 @@ permission = all
                     ('allowed_x_host', 0),
                     ('allowed_x_port', 0),
                     ('allowed_x_prefix', 0),
+                    ('archive_append', False),
+                    ('gzip_level', 6),
+                    ('gzip_min_size', 1024),
+                    ('gzip_cache_size', 104857600),
+                    ('token_backend', 'file'),
+                    ('markdown_cache_size', 16777216),
+                    ('markdown_disk_cache_size', 0),
+                    ('server_timing', False),
                     ])),
                 ('server', OrderedDict([
                     ('port', 9999),
@@ -279,6 +321,11 @@ permission = all
                     ('ssl_cert', './wsb/wsb.crt'),
                     ('ssl_pw', ''),
                     ('browse', True),
+                    ('engine', 'werkzeug'),
+                    ('threads', 16),
+                    ('processes', 1),
+                    ('backlog', 128),
+                    ('keep_alive', 5),
                     ])),
                 ('browser', OrderedDict([
                     ('command', ''),
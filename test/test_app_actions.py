@@ -10,10 +10,14 @@ import subprocess
 import io
 import shutil
 import zipfile
+import gzip
 import json
+import hashlib
 import time
 from functools import partial
 from flask import request, abort
+from werkzeug.http import http_date
+import commonmark
 import webscrapbook
 from webscrapbook import WSB_DIR, WSB_CONFIG, WSB_EXTENSION_MIN_VERSION
 from webscrapbook.app import make_app
@@ -44,6 +48,10 @@ def tearDownModule():
         shutil.rmtree(os.path.join(server_root, WSB_DIR, 'server'))
     except FileNotFoundError:
         pass
+    try:
+        shutil.rmtree(os.path.join(server_root, WSB_DIR, 'cache'))
+    except FileNotFoundError:
+        pass
 
     # stop mock
     for mocking in mockings:
@@ -227,7 +235,7 @@ class TestView(unittest.TestCase):
         try:
             with zipfile.ZipFile(zip_filename, 'w') as zh:
                 pass
-            with app.test_client() as c, mock.patch('zipfile.ZipFile', side_effect=PermissionError('Forbidden')):
+            with app.test_client() as c, mock.patch('webscrapbook.util.CachedZipFile', side_effect=PermissionError('Forbidden')):
                 r = c.get('/archive.zip!/')
                 mock_abort.assert_called_once_with(403)
         finally:
@@ -246,7 +254,8 @@ class TestView(unittest.TestCase):
             r = c.get('/subdir/')
             self.assertEqual(r.status_code, 200)
             self.assertEqual(r.headers['Content-Type'], 'text/html; charset=utf-8')
-            self.assertEqual(r.headers['Cache-Control'], 'no-store')
+            self.assertEqual(r.headers['Cache-Control'], 'no-cache')
+            self.assertIsNotNone(r.headers['ETag'])
             self.assertEqual(r.headers['Content-Security-Policy'], "frame-ancestors 'none';")
             self.assertEqual(r.headers['X-Frame-Options'], 'deny')
             mock_template.call_args[1]['subentries'] = set(mock_template.call_args[1]['subentries'])
@@ -262,6 +271,111 @@ class TestView(unittest.TestCase):
                     },
                 )
 
+    def test_directory_etag_paged(self):
+        """Paged, streamed, or recursive listings are not fingerprinted."""
+        with app.test_client() as c:
+            for query in (
+                    {'a': 'list', 'f': 'json', 'limit': '1'},
+                    {'a': 'list', 'f': 'json', 'recursive': 1},
+                    {'a': 'list', 'f': 'sse'},
+                    ):
+                with self.subTest(query=query), \
+                        mock.patch('webscrapbook.app.ListingCache.fingerprint') as mock_fingerprint:
+                    r = c.get('/subdir/', query_string=query)
+                    self.assertEqual(r.status_code, 200)
+                    self.assertEqual(r.headers['Cache-Control'], 'no-store')
+                    self.assertIsNone(r.headers.get('ETag'))
+                    mock_fingerprint.assert_not_called()
+
+    def test_directory_etag(self):
+        test_file = os.path.join(server_root, 'subdir', 'temp.txt')
+        try:
+            with app.test_client() as c:
+                r = c.get('/subdir/', query_string={'a': 'list', 'f': 'json'})
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(r.headers['Cache-Control'], 'no-cache')
+                etag = r.headers['ETag']
+
+                r = c.get('/subdir/', query_string={'a': 'list', 'f': 'json'},
+                    headers={'If-None-Match': etag})
+                self.assertEqual(r.status_code, 304)
+
+                # a changed directory invalidates the cached fingerprint
+                with open(test_file, 'w', encoding='UTF-8') as f:
+                    f.write('abc')
+
+                r = c.get('/subdir/', query_string={'a': 'list', 'f': 'json'},
+                    headers={'If-None-Match': etag})
+                self.assertEqual(r.status_code, 200)
+                self.assertNotEqual(r.headers['ETag'], etag)
+                self.assertIn('temp.txt', {d['name'] for d in r.json['data']})
+        finally:
+            try:
+                os.remove(test_file)
+            except FileNotFoundError:
+                pass
+
+    def test_file_gzip(self):
+        test_file = os.path.join(server_root, 'temp.html')
+        content = 'Hello World! 你好\n' * 1000
+        try:
+            with open(test_file, 'w', encoding='UTF-8') as f:
+                f.write(content)
+
+            with app.test_client() as c:
+                r = c.get('/temp.html', headers={
+                    'Accept-Encoding': 'gzip, deflate',
+                    }, buffered=True)
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(r.headers['Content-Type'], 'text/html')
+                self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+                self.assertEqual(r.headers['Vary'], 'Accept-Encoding')
+                self.assertEqual(r.headers['Content-Length'], str(len(r.data)))
+                self.assertEqual(r.headers['Last-Modified'], http_date(os.stat(test_file).st_mtime))
+                self.assertEqual(gzip.decompress(r.data).decode('UTF-8'), content)
+                etag = r.headers['ETag']
+
+                # reuse the cached variant
+                with mock.patch('gzip.GzipFile', side_effect=AssertionError) as mock_gzip:
+                    r = c.get('/temp.html', headers={
+                        'Accept-Encoding': 'gzip',
+                        }, buffered=True)
+                    self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+                    self.assertEqual(r.headers['ETag'], etag)
+                    mock_gzip.assert_not_called()
+
+                # 304 for etag
+                r = c.get('/temp.html', headers={
+                    'Accept-Encoding': 'gzip',
+                    'If-None-Match': etag,
+                    }, buffered=True)
+                self.assertEqual(r.status_code, 304)
+
+                # identity
+                r = c.get('/temp.html', buffered=True)
+                self.assertIsNone(r.headers.get('Content-Encoding'))
+                self.assertEqual(r.headers['Vary'], 'Accept-Encoding')
+                self.assertNotEqual(r.headers['ETag'], etag)
+                self.assertEqual(r.data.decode('UTF-8'), content)
+
+                # identity for a ranged request
+                r = c.get('/temp.html', headers={
+                    'Accept-Encoding': 'gzip',
+                    'Range': 'bytes=0-11',
+                    }, buffered=True)
+                self.assertEqual(r.status_code, 206)
+                self.assertIsNone(r.headers.get('Content-Encoding'))
+                self.assertEqual(r.data.decode('UTF-8'), 'Hello World!')
+        finally:
+            try:
+                os.remove(test_file)
+            except FileNotFoundError:
+                pass
+            try:
+                shutil.rmtree(os.path.join(server_root, WSB_DIR, 'cache'))
+            except FileNotFoundError:
+                pass
+
     def test_file(self):
         with app.test_client() as c:
             r = c.get('/index.html', buffered=True)
@@ -432,6 +546,19 @@ class TestView(unittest.TestCase):
                 }, buffered=True)
             self.assertEqual(r.status_code, 304)
 
+    def test_markdown_cache(self):
+        app.config['WEBSCRAPBOOK_HOST'].markdown_cache = webscrapbook.util.TextCache()
+        with app.test_client() as c:
+            with mock.patch('webscrapbook.app.commonmark.commonmark', wraps=commonmark.commonmark) as mock_render, \
+                    mock.patch('webscrapbook.app.render_template', return_value='') as mock_template:
+                r = c.get('/index.md')
+                self.assertEqual(r.status_code, 200)
+                r = c.get('/index.md')
+                self.assertEqual(r.status_code, 200)
+
+                mock_render.assert_called_once()
+                self.assertEqual(mock_template.call_args[1]['content'], '<h2>Header</h2>\n<p>Hello 你好</p>\n')
+
     def test_meta_refresh(self):
         with app.test_client() as c:
             r = c.get('/refresh.htm')
@@ -556,6 +683,115 @@ class TestView(unittest.TestCase):
             except FileNotFoundError:
                 pass
 
+    def test_zip_subfile_range(self):
+        zip_filename = os.path.join(server_root, 'archive.zip')
+        try:
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr(zipfile.ZipInfo('stored.txt', (1987, 1, 1, 0, 0, 0)), '0123456789',
+                    compress_type=zipfile.ZIP_STORED)
+                zh.writestr(zipfile.ZipInfo('deflated.txt', (1987, 1, 1, 0, 0, 0)), '0123456789',
+                    compress_type=zipfile.ZIP_DEFLATED)
+
+            with app.test_client() as c:
+                for name in ('stored.txt', 'deflated.txt'):
+                    with self.subTest(name=name):
+                        r = c.get(f'/archive.zip!/{name}', buffered=True)
+                        self.assertEqual(r.status_code, 200)
+                        self.assertEqual(r.headers['Content-Length'], '10')
+                        self.assertEqual(r.data, b'0123456789')
+
+                        r = c.get(f'/archive.zip!/{name}', headers={
+                            'Range': 'bytes=3-6',
+                            }, buffered=True)
+                        self.assertEqual(r.status_code, 206)
+                        self.assertEqual(r.headers['Content-Length'], '4')
+                        self.assertEqual(r.headers['Content-Range'], 'bytes 3-6/10')
+                        self.assertEqual(r.data, b'3456')
+
+                        r = c.get(f'/archive.zip!/{name}', headers={
+                            'Range': 'bytes=-2',
+                            }, buffered=True)
+                        self.assertEqual(r.status_code, 206)
+                        self.assertEqual(r.data, b'89')
+
+                # resume decompression from a checkpoint for a large DEFLATED member
+                with mock.patch('webscrapbook.util.ZipDeflateIndex.MIN_SIZE', 0), \
+                     mock.patch('webscrapbook.util.zip_open_deflated', wraps=webscrapbook.util.zip_open_deflated) as mocker:
+                    r = c.get('/archive.zip!/deflated.txt', headers={
+                        'Range': 'bytes=3-6',
+                        }, buffered=True)
+                    self.assertEqual(r.status_code, 206)
+                    self.assertEqual(r.headers['Content-Length'], '4')
+                    self.assertEqual(r.headers['Content-Range'], 'bytes 3-6/10')
+                    self.assertEqual(r.data, b'3456')
+                    mocker.assert_called_once()
+        finally:
+            try:
+                os.remove(zip_filename)
+            except FileNotFoundError:
+                pass
+
+    def test_zip_subfile_gzip(self):
+        zip_filename = os.path.join(server_root, 'archive.zip')
+        try:
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr(zipfile.ZipInfo('index.html', (1987, 1, 1, 0, 0, 0)), 'Hello World! 你好' * 100,
+                    compress_type=zipfile.ZIP_DEFLATED)
+                zh.writestr(zipfile.ZipInfo('stored.txt', (1987, 1, 1, 0, 0, 0)), 'Hello World!',
+                    compress_type=zipfile.ZIP_STORED)
+            with zipfile.ZipFile(zip_filename) as zh:
+                compress_size = zh.getinfo('index.html').compress_size
+
+            with app.test_client() as c:
+                r = c.get('/archive.zip!/index.html', headers={
+                    'Accept-Encoding': 'gzip, deflate',
+                    }, buffered=True)
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(r.headers['Content-Type'], 'text/html')
+                self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+                self.assertEqual(r.headers['Vary'], 'Accept-Encoding')
+                self.assertEqual(r.headers['Content-Length'], str(compress_size + 18))
+                self.assertEqual(gzip.decompress(r.data).decode('UTF-8'), 'Hello World! 你好' * 100)
+                etag = r.headers['ETag']
+
+                # 304 for the gzip variant
+                r = c.get('/archive.zip!/index.html', headers={
+                    'Accept-Encoding': 'gzip',
+                    'If-None-Match': etag,
+                    }, buffered=True)
+                self.assertEqual(r.status_code, 304)
+
+                # identity
+                r = c.get('/archive.zip!/index.html', buffered=True)
+                self.assertEqual(r.status_code, 200)
+                self.assertIsNone(r.headers.get('Content-Encoding'))
+                self.assertEqual(r.headers['Vary'], 'Accept-Encoding')
+                self.assertNotEqual(r.headers['ETag'], etag)
+                self.assertEqual(r.data.decode('UTF-8'), 'Hello World! 你好' * 100)
+
+                # identity for a ranged request
+                r = c.get('/archive.zip!/index.html', headers={
+                    'Accept-Encoding': 'gzip',
+                    'Range': 'bytes=0-11',
+                    }, buffered=True)
+                self.assertEqual(r.status_code, 206)
+                self.assertIsNone(r.headers.get('Content-Encoding'))
+                self.assertEqual(r.data.decode('UTF-8'), 'Hello World!')
+
+                # identity for a STORED member
+                r = c.get('/archive.zip!/stored.txt', headers={
+                    'Accept-Encoding': 'gzip',
+                    }, buffered=True)
+                self.assertEqual(r.status_code, 200)
+                self.assertIsNone(r.headers.get('Content-Encoding'))
+                self.assertIsNone(r.headers.get('Vary'))
+                self.assertEqual(r.data.decode('UTF-8'), 'Hello World!')
+        finally:
+            try:
+                os.remove(zip_filename)
+            except FileNotFoundError:
+                pass
+
     def test_zip_subfile_nested(self):
         zip_filename = os.path.join(server_root, 'archive.htz')
         try:
@@ -943,7 +1179,7 @@ class TestList(TestActions):
         try:
             with zipfile.ZipFile(zip_filename, 'w') as zh:
                 pass
-            with app.test_client() as c, mock.patch('zipfile.ZipFile', side_effect=PermissionError('Forbidden')):
+            with app.test_client() as c, mock.patch('webscrapbook.util.CachedZipFile', side_effect=PermissionError('Forbidden')):
                 r = c.get('/archive.zip!/', query_string={'a': 'list', 'f': 'json'})
                 mock_abort.assert_called_once_with(403)
         finally:
@@ -1055,6 +1291,72 @@ class TestList(TestActions):
                     }),
                 })
 
+    def test_directory_paged(self):
+        with app.test_client() as c:
+            names = []
+            cursor = None
+            while True:
+                query = {'a': 'list', 'f': 'json', 'recursive': 1, 'limit': 2}
+                if cursor is not None:
+                    query['cursor'] = cursor
+                r = c.get('/subdir/', query_string=query)
+                self.assertEqual(r.status_code, 200)
+                data = r.json
+                self.assertTrue(data['success'])
+                names.extend(d['name'] for d in data['data'])
+                cursor = data['meta']['next_cursor']
+                if cursor is None:
+                    break
+            self.assertEqual(names, ['file.txt', 'sub', 'sub/subfile.txt'])
+
+            r = c.get('/subdir/', query_string={'a': 'list', 'f': 'json', 'cursor': 'file.txt'})
+            data = r.json
+            self.assertEqual([d['name'] for d in data['data']], ['sub'])
+            self.assertIsNone(data['meta']['next_cursor'])
+
+    @mock.patch('webscrapbook.app.abort', side_effect=abort)
+    def test_directory_paged_bad_limit(self, mock_abort):
+        with app.test_client() as c:
+            r = c.get('/subdir/', query_string={'a': 'list', 'f': 'json', 'limit': 0})
+            mock_abort.assert_called_once_with(400, 'Limit must be a positive integer.')
+
+        mock_abort.reset_mock()
+        with app.test_client() as c:
+            r = c.get('/subdir/', query_string={'a': 'list', 'f': 'json', 'limit': 'abc'})
+            mock_abort.assert_called_once_with(400, 'Limit must be a positive integer.')
+
+    def test_directory_ndjson(self):
+        with app.test_client() as c:
+            r = c.get('/subdir/', query_string={'a': 'list', 'f': 'ndjson', 'recursive': 1, 'cursor': 'sub'})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.headers['Content-Type'], 'application/x-ndjson')
+            lines = r.data.decode('UTF-8').splitlines()
+            self.assertEqual([json.loads(line) for line in lines], [{
+                'name': 'sub/subfile.txt',
+                'type': 'file',
+                'size': 6,
+                'last_modified': os.stat(os.path.join(server_root, 'subdir', 'sub', 'subfile.txt')).st_mtime,
+                }, {
+                'meta': {'next_cursor': None},
+                }])
+
+    def test_directory_ndjson_paged(self):
+        with app.test_client() as c:
+            names = []
+            cursor = None
+            while True:
+                query = {'a': 'list', 'f': 'ndjson', 'recursive': 1, 'limit': 2}
+                if cursor is not None:
+                    query['cursor'] = cursor
+                r = c.get('/subdir/', query_string=query)
+                self.assertEqual(r.status_code, 200)
+                lines = [json.loads(line) for line in r.data.decode('UTF-8').splitlines()]
+                names.extend(d['name'] for d in lines[:-1])
+                cursor = lines[-1]['meta']['next_cursor']
+                if cursor is None:
+                    break
+            self.assertEqual(names, ['file.txt', 'sub', 'sub/subfile.txt'])
+
     @mock.patch('webscrapbook.app.abort', side_effect=abort)
     def test_file(self, mock_abort):
         with app.test_client() as c:
@@ -1067,6 +1369,32 @@ class TestList(TestActions):
             r = c.get('/nonexist', query_string={'a': 'list', 'f': 'json'})
             mock_abort.assert_called_once_with(404, 'Directory does not exist.')
 
+    def test_zip_paged(self):
+        zip_filename = os.path.join(server_root, 'archive.zip')
+        try:
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr('dir/b.txt', 'b')
+                zh.writestr('dir/a/2.txt', '2')
+                zh.writestr('dir/a/1.txt', '1')
+                zh.writestr('dir/c.txt', 'c')
+
+            with app.test_client() as c:
+                r = c.get('/archive.zip!/dir/', query_string={'a': 'list', 'f': 'json', 'recursive': 1, 'limit': 3})
+                data = r.json
+                self.assertEqual([d['name'] for d in data['data']], ['a', 'a/1.txt', 'a/2.txt'])
+                self.assertEqual(data['meta']['next_cursor'], 'a/2.txt')
+
+                r = c.get('/archive.zip!/dir/', query_string={'a': 'list', 'f': 'json', 'recursive': 1, 'limit': 3,
+                    'cursor': 'a/2.txt'})
+                data = r.json
+                self.assertEqual([d['name'] for d in data['data']], ['b.txt', 'c.txt'])
+                self.assertIsNone(data['meta']['next_cursor'])
+        finally:
+            try:
+                os.remove(zip_filename)
+            except FileNotFoundError:
+                pass
+
     def test_zip(self):
         zip_filename = os.path.join(server_root, 'archive.zip')
         try:
@@ -1514,7 +1842,7 @@ class TestSource(unittest.TestCase):
         try:
             with zipfile.ZipFile(zip_filename, 'w') as zh:
                 pass
-            with app.test_client() as c, mock.patch('zipfile.ZipFile', side_effect=PermissionError('Forbidden')):
+            with app.test_client() as c, mock.patch('webscrapbook.util.CachedZipFile', side_effect=PermissionError('Forbidden')):
                 r = c.get('/archive.zip!/', query_string={'a': 'source'})
                 mock_abort.assert_called_once_with(403)
         finally:
@@ -1780,7 +2108,7 @@ class TestDownload(unittest.TestCase):
         try:
             with zipfile.ZipFile(zip_filename, 'w') as zh:
                 pass
-            with app.test_client() as c, mock.patch('zipfile.ZipFile', side_effect=PermissionError('Forbidden')):
+            with app.test_client() as c, mock.patch('webscrapbook.util.CachedZipFile', side_effect=PermissionError('Forbidden')):
                 r = c.get('/archive.zip!/', query_string={'a': 'download'})
                 mock_abort.assert_called_once_with(403)
         finally:
@@ -1936,12 +2264,60 @@ class TestStatic(unittest.TestCase):
             css = r.data.decode('UTF-8').replace('\r\n', '\n')
             self.assertIn('#data-table', css)
 
+    def test_file_versioned(self):
+        """A URL with the current content hash is immutable."""
+        host = app.config['WEBSCRAPBOOK_HOST']
+        with open(host.get_static_file('index.css'), 'rb') as fh:
+            digest = hashlib.sha1(fh.read()).hexdigest()[:16]
+        self.assertEqual(host.static_hashes['index.css'], digest)
+
+        with app.test_client() as c:
+            r = c.get('/index.css', query_string={'a': 'static', 'v': digest}, buffered=True)
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    def test_file_versioned_stale(self):
+        """A URL with an outdated content hash should be revalidated."""
+        with app.test_client() as c:
+            r = c.get('/index.css', query_string={'a': 'static', 'v': '0123456789abcdef'}, buffered=True)
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.headers['Cache-Control'], 'no-cache')
+
     @mock.patch('webscrapbook.app.abort', side_effect=abort)
     def test_nonexist(self, mock_abort):
         with app.test_client() as c:
             r = c.get('/nonexist', query_string={'a': 'static'})
             mock_abort.assert_called_once_with(404)
 
+class TestMetrics(unittest.TestCase):
+    @mock.patch('webscrapbook.app.abort', side_effect=abort)
+    def test_format_check(self, mock_abort):
+        """No format."""
+        with app.test_client() as c:
+            r = c.get('/', query_string={'a': 'metrics', 'f': 'json'})
+            mock_abort.assert_called_once_with(400, 'Action not supported.')
+
+    def test_metrics(self):
+        with app.test_client() as c:
+            c.get('/index.css', query_string={'a': 'static'}, buffered=True)
+            c.post('/', data={'a': 'token'})
+            c.get('/', query_string={'a': 'nonexist'})
+
+            r = c.get('/', query_string={'a': 'metrics'})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.headers['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+            self.assertEqual(r.headers['Cache-Control'], 'no-store')
+            text = r.data.decode('UTF-8')
+            self.assertIn('# TYPE webscrapbook_requests_total counter\n', text)
+            self.assertRegex(text, r'\nwebscrapbook_requests_total\{action="static",status="200"\} \d+\n')
+            self.assertRegex(text, r'\nwebscrapbook_request_duration_seconds_bucket\{action="static",le="\+Inf"\} \d+\n')
+            self.assertRegex(text, r'\nwebscrapbook_requests_total\{action="unknown",status="400"\} \d+\n')
+            self.assertNotIn('nonexist', text)
+            self.assertRegex(text, r'\nwebscrapbook_tokens_total\{event="acquire"\} \d+\n')
+            self.assertRegex(text, r'\nwebscrapbook_cache_hits_total\{cache="zip_dir"\} \d+\n')
+            self.assertRegex(text, r'\nwebscrapbook_lock_acquisitions_total\{result="acquired"\} \d+\n')
+            self.assertRegex(text, r'\nwebscrapbook_zip_open_handles -?\d+\n')
+
 class TestConfig(unittest.TestCase):
     @mock.patch('webscrapbook.app.abort', side_effect=abort)
     def test_format_check(self, mock_abort):
@@ -2015,7 +2391,7 @@ class TestEdit(unittest.TestCase):
     def test_permission_check2(self, mock_abort):
         with zipfile.ZipFile(self.test_zip, 'w') as zh:
             pass
-        with app.test_client() as c, mock.patch('zipfile.ZipFile', side_effect=PermissionError('Forbidden')):
+        with app.test_client() as c, mock.patch('webscrapbook.util.CachedZipFile', side_effect=PermissionError('Forbidden')):
             r = c.get('/temp.maff!/index.html', query_string={'a': 'edit'})
             mock_abort.assert_called_once_with(403)
 
@@ -2146,7 +2522,7 @@ class TestEditx(unittest.TestCase):
         try:
             with zipfile.ZipFile(zip_filename, 'w') as zh:
                 pass
-            with app.test_client() as c, mock.patch('zipfile.ZipFile', side_effect=PermissionError('Forbidden')):
+            with app.test_client() as c, mock.patch('webscrapbook.util.CachedZipFile', side_effect=PermissionError('Forbidden')):
                 r = c.get('/archive.zip!/index.html', query_string={'a': 'editx'})
                 mock_abort.assert_called_once_with(403)
         finally:
@@ -3133,6 +3509,61 @@ class TestSave(unittest.TestCase):
             with zipfile.ZipFile(self.test_zip, 'r') as zh:
                 self.assertEqual(zh.read('subdir/index.html').decode('UTF-8'), 'ABC 你好')
 
+    def test_save_zip_file_existed_append(self):
+        with zipfile.ZipFile(self.test_zip, 'w') as zh:
+            zh.writestr('subdir/index.html', 'dummy')
+            zh.writestr('other.txt', 'other' * 1000, compress_type=zipfile.ZIP_STORED)
+        size = os.stat(self.test_zip).st_size
+
+        config = app.config['WEBSCRAPBOOK_HOST'].config['app']
+        with app.test_client() as c, mock.patch.dict(config, {'archive_append': True}), \
+             mock.patch('webscrapbook.util.zip_compact', wraps=webscrapbook.util.zip_compact) as mock_compact:
+            r = c.post('/temp.maff!/subdir/index.html', data={
+                'token': token(c),
+                'a': 'save',
+                'f': 'json',
+                'text': 'ABC 你好'.encode('UTF-8').decode('ISO-8859-1'),
+                })
+
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.json, {
+                'success': True,
+                'data': 'Command run successfully.',
+                })
+            mock_compact.assert_called_once_with(self.test_zip)
+
+            # the old version is left as dead space
+            self.assertGreater(os.stat(self.test_zip).st_size, size)
+            with zipfile.ZipFile(self.test_zip, 'r') as zh:
+                self.assertEqual(zh.namelist(), ['other.txt', 'subdir/index.html'])
+                self.assertEqual(zh.read('subdir/index.html').decode('UTF-8'), 'ABC 你好')
+                self.assertEqual(zh.read('other.txt').decode('UTF-8'), 'other' * 1000)
+                self.assertGreater(webscrapbook.util.zip_garbage_ratio(zh), 0)
+
+    def test_save_zip_file_existed_append_error(self):
+        with zipfile.ZipFile(self.test_zip, 'w') as zh:
+            zh.writestr('subdir/index.html', 'dummy')
+            zh.writestr('other.txt', 'other')
+
+        config = app.config['WEBSCRAPBOOK_HOST'].config['app']
+        with app.test_client() as c, mock.patch.dict(config, {'archive_append': True}), \
+             mock.patch('traceback.print_exc'):
+            # text not encodable as ISO-8859-1
+            r = c.post('/temp.maff!/subdir/index.html', data={
+                'token': token(c),
+                'a': 'save',
+                'f': 'json',
+                'text': '中文',
+                })
+
+            self.assertEqual(r.status_code, 500)
+
+            # the old version is kept
+            with zipfile.ZipFile(self.test_zip, 'r') as zh:
+                self.assertIsNone(zh.testzip())
+                self.assertEqual(zh.namelist(), ['subdir/index.html', 'other.txt'])
+                self.assertEqual(zh.read('subdir/index.html').decode('UTF-8'), 'dummy')
+
     def test_save_zip_file_nested(self):
         with zipfile.ZipFile(self.test_zip, 'w') as zh:
             buf1 = io.BytesIO()
@@ -160,10 +160,10 @@ base =
             r = get('/')
             html = r.data.decode('UTF-8')
 
-            self.assertIn('href="/common.css?a=static"', html)
-            self.assertIn('href="/index.css?a=static"', html)
-            self.assertIn('src="/common.js?a=static"', html)
-            self.assertIn('src="/index.js?a=static"', html)
+            self.assertIn('href="/common.css?a=static&amp;v=', html)
+            self.assertIn('href="/index.css?a=static&amp;v=', html)
+            self.assertIn('src="/common.js?a=static&amp;v=', html)
+            self.assertIn('src="/index.js?a=static&amp;v=', html)
 
             self.assertIn('<h1 id="header" class="breadcrumbs"><a>WebScrapBook</a>/</h1>', html)
             self.assertIn('data-base="" data-path="/"', html)
@@ -178,10 +178,10 @@ base =
             r = get('/subdir/')
             html = r.data.decode('UTF-8')
 
-            self.assertIn('href="/common.css?a=static"', html)
-            self.assertIn('href="/index.css?a=static"', html)
-            self.assertIn('src="/common.js?a=static"', html)
-            self.assertIn('src="/index.js?a=static"', html)
+            self.assertIn('href="/common.css?a=static&amp;v=', html)
+            self.assertIn('href="/index.css?a=static&amp;v=', html)
+            self.assertIn('src="/common.js?a=static&amp;v=', html)
+            self.assertIn('src="/index.js?a=static&amp;v=', html)
 
             self.assertIn('<h1 id="header" class="breadcrumbs"><a href="/">WebScrapBook</a>/<a>subdir</a>/</h1>', html)
             self.assertIn('data-base="" data-path="/subdir/"', html)
@@ -201,10 +201,10 @@ base = /scrap%20%E6%9B%B8
             r = get('/')
             html = r.data.decode('UTF-8')
 
-            self.assertIn('href="/scrap%20%E6%9B%B8/common.css?a=static"', html)
-            self.assertIn('href="/scrap%20%E6%9B%B8/index.css?a=static"', html)
-            self.assertIn('src="/scrap%20%E6%9B%B8/common.js?a=static"', html)
-            self.assertIn('src="/scrap%20%E6%9B%B8/index.js?a=static"', html)
+            self.assertIn('href="/scrap%20%E6%9B%B8/common.css?a=static&amp;v=', html)
+            self.assertIn('href="/scrap%20%E6%9B%B8/index.css?a=static&amp;v=', html)
+            self.assertIn('src="/scrap%20%E6%9B%B8/common.js?a=static&amp;v=', html)
+            self.assertIn('src="/scrap%20%E6%9B%B8/index.js?a=static&amp;v=', html)
 
             self.assertIn('<h1 id="header" class="breadcrumbs"><a>WebScrapBook</a>/</h1>', html)
             self.assertIn('data-base="/scrap 書" data-path="/"', html)
@@ -218,10 +218,10 @@ base = /scrap%20%E6%9B%B8
             r = get('/subdir/')
             html = r.data.decode('UTF-8')
 
-            self.assertIn('href="/scrap%20%E6%9B%B8/common.css?a=static"', html)
-            self.assertIn('href="/scrap%20%E6%9B%B8/index.css?a=static"', html)
-            self.assertIn('src="/scrap%20%E6%9B%B8/common.js?a=static"', html)
-            self.assertIn('src="/scrap%20%E6%9B%B8/index.js?a=static"', html)
+            self.assertIn('href="/scrap%20%E6%9B%B8/common.css?a=static&amp;v=', html)
+            self.assertIn('href="/scrap%20%E6%9B%B8/index.css?a=static&amp;v=', html)
+            self.assertIn('src="/scrap%20%E6%9B%B8/common.js?a=static&amp;v=', html)
+            self.assertIn('src="/scrap%20%E6%9B%B8/index.js?a=static&amp;v=', html)
 
             self.assertIn('<h1 id="header" class="breadcrumbs"><a href="/scrap%20%E6%9B%B8/">WebScrapBook</a>/<a>subdir</a>/</h1>', html)
             self.assertIn('data-base="/scrap 書" data-path="/subdir/"', html)
@@ -244,10 +244,10 @@ allowed_x_prefix = 0
             r = get('/')
             html = r.data.decode('UTF-8')
 
-            self.assertIn('href="/common.css?a=static"', html)
-            self.assertIn('href="/index.css?a=static"', html)
-            self.assertIn('src="/common.js?a=static"', html)
-            self.assertIn('src="/index.js?a=static"', html)
+            self.assertIn('href="/common.css?a=static&amp;v=', html)
+            self.assertIn('href="/index.css?a=static&amp;v=', html)
+            self.assertIn('src="/common.js?a=static&amp;v=', html)
+            self.assertIn('src="/index.js?a=static&amp;v=', html)
 
             self.assertIn('<h1 id="header" class="breadcrumbs"><a>WebScrapBook</a>/</h1>', html)
             self.assertIn('data-base="" data-path="/"', html)
@@ -261,10 +261,10 @@ allowed_x_prefix = 0
             r = get('/subdir/')
             html = r.data.decode('UTF-8')
 
-            self.assertIn('href="/common.css?a=static"', html)
-            self.assertIn('href="/index.css?a=static"', html)
-            self.assertIn('src="/common.js?a=static"', html)
-            self.assertIn('src="/index.js?a=static"', html)
+            self.assertIn('href="/common.css?a=static&amp;v=', html)
+            self.assertIn('href="/index.css?a=static&amp;v=', html)
+            self.assertIn('src="/common.js?a=static&amp;v=', html)
+            self.assertIn('src="/index.js?a=static&amp;v=', html)
 
             self.assertIn('<h1 id="header" class="breadcrumbs"><a href="/">WebScrapBook</a>/<a>subdir</a>/</h1>', html)
             self.assertIn('data-base="" data-path="/subdir/"', html)
@@ -286,10 +286,10 @@ allowed_x_prefix = 1
             r = get('/')
             html = r.data.decode('UTF-8')
 
-            self.assertIn('href="/scrap%20%E6%9B%B8/common.css?a=static"', html)
-            self.assertIn('href="/scrap%20%E6%9B%B8/index.css?a=static"', html)
-            self.assertIn('src="/scrap%20%E6%9B%B8/common.js?a=static"', html)
-            self.assertIn('src="/scrap%20%E6%9B%B8/index.js?a=static"', html)
+            self.assertIn('href="/scrap%20%E6%9B%B8/common.css?a=static&amp;v=', html)
+            self.assertIn('href="/scrap%20%E6%9B%B8/index.css?a=static&amp;v=', html)
+            self.assertIn('src="/scrap%20%E6%9B%B8/common.js?a=static&amp;v=', html)
+            self.assertIn('src="/scrap%20%E6%9B%B8/index.js?a=static&amp;v=', html)
 
             self.assertIn('<h1 id="header" class="breadcrumbs"><a>WebScrapBook</a>/</h1>', html)
             self.assertIn('data-base="/scrap 書" data-path="/"', html)
@@ -303,10 +303,10 @@ allowed_x_prefix = 1
             r = get('/subdir/')
             html = r.data.decode('UTF-8')
 
-            self.assertIn('href="/scrap%20%E6%9B%B8/common.css?a=static"', html)
-            self.assertIn('href="/scrap%20%E6%9B%B8/index.css?a=static"', html)
-            self.assertIn('src="/scrap%20%E6%9B%B8/common.js?a=static"', html)
-            self.assertIn('src="/scrap%20%E6%9B%B8/index.js?a=static"', html)
+            self.assertIn('href="/scrap%20%E6%9B%B8/common.css?a=static&amp;v=', html)
+            self.assertIn('href="/scrap%20%E6%9B%B8/index.css?a=static&amp;v=', html)
+            self.assertIn('src="/scrap%20%E6%9B%B8/common.js?a=static&amp;v=', html)
+            self.assertIn('src="/scrap%20%E6%9B%B8/index.js?a=static&amp;v=', html)
 
             self.assertIn('<h1 id="header" class="breadcrumbs"><a href="/scrap%20%E6%9B%B8/">WebScrapBook</a>/<a>subdir</a>/</h1>', html)
             self.assertIn('data-base="/scrap 書" data-path="/subdir/"', html)
@@ -506,6 +506,67 @@ content_security_policy =
             r = c.get('/index.md')
             self.assertIsNone(r.headers.get('Content-Security-Policy'))
 
+    def test_server_timing(self):
+        # server_timing == true
+        with open(server_config, 'w', encoding='UTF-8') as f:
+            f.write("""[app]
+server_timing = true
+""")
+
+        app = make_app(server_root)
+        app.testing = True
+        with app.test_client() as c:
+            r = c.get('/index.md')
+            self.assertRegex(r.headers['Server-Timing'], r'\brender;dur=\d+\.\d{3}\b')
+            self.assertRegex(r.headers['Server-Timing'], r'\btotal;dur=\d+\.\d{3}$')
+            c.get('/', query_string={'a': 'nonexist1'})
+            c.get('/', query_string={'a': 'nonexist2'})
+
+        stats = app.config['WEBSCRAPBOOK_HOST'].timing_stats.snapshot()
+        counts, count, total = stats[('view', 'total')]
+        self.assertEqual(count, 1)
+        self.assertEqual(sum(counts), 1)
+        self.assertEqual(len(counts), len(wsbapp.TimingStats.BUCKETS) + 1)
+        self.assertGreater(total, 0)
+        self.assertIn(('view', 'render'), stats)
+        self.assertEqual(stats[('unknown', 'total')][1], 2)
+        self.assertNotIn(('nonexist1', 'total'), stats)
+
+        # server_timing == true, with auth
+        with open(server_config, 'w', encoding='UTF-8') as f:
+            f.write("""[app]
+server_timing = true
+
+[auth "anony"]
+user =
+pw =
+pw_salt =
+pw_type = plain
+permission = all
+""")
+
+        app = make_app(server_root)
+        app.testing = True
+        with app.test_client() as c:
+            r = c.get('/index.md')
+            self.assertRegex(r.headers['Server-Timing'], r'\bauth;dur=\d+\.\d{3}\b')
+
+        self.assertIn(('view', 'auth'), app.config['WEBSCRAPBOOK_HOST'].timing_stats.snapshot())
+
+        # server_timing == false
+        with open(server_config, 'w', encoding='UTF-8') as f:
+            f.write("""[app]
+server_timing = false
+""")
+
+        app = make_app(server_root)
+        app.testing = True
+        with app.test_client() as c:
+            r = c.get('/index.md')
+            self.assertIsNone(r.headers.get('Server-Timing'))
+
+        self.assertIsNone(app.config['WEBSCRAPBOOK_HOST'].timing_stats)
+
 
 class TestAuth(unittest.TestCase):
     def simple_auth_headers(self, user, password):
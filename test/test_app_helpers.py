@@ -602,6 +602,105 @@ class TestFunctions(unittest.TestCase):
                 except FileNotFoundError:
                     pass
 
+    def test_open_archive_path_write_copy(self):
+        root = os.path.join(root_dir, 'test_app_helpers', 'general')
+        tempfile = os.path.join(root, 'entry.zip')
+        app = wsbapp.make_app(root)
+        with app.app_context():
+            try:
+                data = 'Hello World! 你好' * 1000
+                with zipfile.ZipFile(tempfile, 'w') as zip:
+                    zip.writestr('deflated.txt', data, compress_type=zipfile.ZIP_DEFLATED, compresslevel=1)
+                    zip.writestr('stored.txt', data, compress_type=zipfile.ZIP_STORED)
+                with zipfile.ZipFile(tempfile) as zip:
+                    infos = {i.filename: i for i in zip.infolist()}
+
+                with wsbapp.open_archive_path([tempfile, 'new.txt'], 'w') as zip:
+                    zip.writestr('new.txt', 'new file 測試')
+
+                # untouched members are copied verbatim without recompressing
+                with zipfile.ZipFile(tempfile) as zip:
+                    self.assertIsNone(zip.testzip())
+                    self.assertEqual(zip.namelist(), ['new.txt', 'deflated.txt', 'stored.txt'])
+                    for name in ('deflated.txt', 'stored.txt'):
+                        info = zip.getinfo(name)
+                        self.assertEqual(info.compress_type, infos[name].compress_type)
+                        self.assertEqual(info.compress_size, infos[name].compress_size)
+                        self.assertEqual(info.CRC, infos[name].CRC)
+                        self.assertEqual(zip.read(name).decode('UTF-8'), data)
+
+                # no temp file is left
+                self.assertEqual(
+                    [f for f in os.listdir(root) if f.startswith('.entry.zip.')],
+                    [],
+                    )
+            finally:
+                try:
+                    os.remove(tempfile)
+                except FileNotFoundError:
+                    pass
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'requires os.symlink')
+    def test_open_archive_path_write_symlink(self):
+        """A symlinked archive should be written through the link."""
+        root = os.path.join(root_dir, 'test_app_helpers', 'general')
+        tempfile = os.path.join(root, 'entry.zip')
+        linkfile = os.path.join(root, 'link.zip')
+        app = wsbapp.make_app(root)
+        with app.app_context():
+            try:
+                with zipfile.ZipFile(tempfile, 'w') as zip:
+                    zip.writestr('index.html', 'Hello World!')
+                try:
+                    os.symlink(tempfile, linkfile)
+                except OSError:
+                    self.skipTest('unable to create a symlink')
+
+                with wsbapp.open_archive_path([linkfile, 'new.txt'], 'w') as zip:
+                    zip.writestr('new.txt', 'new file')
+
+                self.assertTrue(os.path.islink(linkfile))
+                with zipfile.ZipFile(tempfile) as zip:
+                    self.assertEqual(zip.read('new.txt'), b'new file')
+                    self.assertEqual(zip.read('index.html'), b'Hello World!')
+            finally:
+                for file in (linkfile, tempfile):
+                    try:
+                        os.remove(file)
+                    except FileNotFoundError:
+                        pass
+
+    @mock.patch('os.chown', side_effect=PermissionError('Forbidden'), create=True)
+    def test_open_archive_path_write_owner(self, mock_chown):
+        """Overwrite in place if the owner cannot be preserved."""
+        root = os.path.join(root_dir, 'test_app_helpers', 'general')
+        tempfile = os.path.join(root, 'entry.zip')
+        app = wsbapp.make_app(root)
+        with app.app_context():
+            try:
+                with zipfile.ZipFile(tempfile, 'w') as zip:
+                    zip.writestr('index.html', 'Hello World!')
+                ino = os.stat(tempfile).st_ino
+
+                st = os.stat(tempfile)
+                st_other = os.stat_result((st.st_mode, st.st_ino, st.st_dev, st.st_nlink,
+                    st.st_uid + 1, st.st_gid, st.st_size, st.st_atime, st.st_mtime, st.st_ctime))
+                stat = os.stat
+                with mock.patch('os.stat', side_effect=lambda f, *a, **kw:
+                        st_other if f == tempfile else stat(f, *a, **kw)):
+                    with wsbapp.open_archive_path([tempfile, 'new.txt'], 'w') as zip:
+                        zip.writestr('new.txt', 'new file')
+
+                mock_chown.assert_called_once()
+                self.assertEqual(os.stat(tempfile).st_ino, ino)
+                with zipfile.ZipFile(tempfile) as zip:
+                    self.assertEqual(zip.read('new.txt'), b'new file')
+            finally:
+                try:
+                    os.remove(tempfile)
+                except FileNotFoundError:
+                    pass
+
     def test_open_archive_path_delete(self):
         root = os.path.join(root_dir, 'test_app_helpers', 'general')
         tempfile = os.path.join(root, 'entry.zip')
@@ -777,6 +876,35 @@ class TestFunctions(unittest.TestCase):
             self.assertEqual(mock_encrypt.call_args_list[0][0], ('pass1', 'salt', 'plain'))
             self.assertEqual(mock_encrypt.call_args_list[1][0], ('pass1', 'salt', 'plain'))
 
+    @mock.patch('webscrapbook.util.encrypt', side_effect=webscrapbook.util.encrypt)
+    def test_get_permission_cache(self, mock_encrypt):
+        """Cache a successful verification for a while."""
+        root = os.path.join(root_dir, 'test_app_helpers', 'get_permission1')
+        app = wsbapp.make_app(root)
+        auth_table = app.config['WEBSCRAPBOOK_HOST'].auth
+        self.assertIsInstance(auth_table, wsbapp.AuthTable)
+        with app.app_context():
+            mock_encrypt.reset_mock()
+            self.assertEqual(wsbapp.get_permission({'username': 'user4', 'password': 'pass4'}, auth_table), 'all')
+            self.assertEqual(wsbapp.get_permission({'username': 'user4', 'password': 'pass4'}, auth_table), 'all')
+            mock_encrypt.assert_called_once_with('pass4', 'salt4', 'sha256')
+
+            # not cached for a failed verification
+            mock_encrypt.reset_mock()
+            self.assertEqual(wsbapp.get_permission({'username': 'user4', 'password': 'pass5'}, auth_table), '')
+            self.assertEqual(wsbapp.get_permission({'username': 'user4', 'password': 'pass5'}, auth_table), '')
+            self.assertEqual(mock_encrypt.call_count, 2)
+
+            # verify again after expired
+            mock_encrypt.reset_mock()
+            now = time.time() + auth_table.CACHE_TTL + 1
+            self.assertEqual(auth_table.get_permission('user4', 'pass4', now=now), 'all')
+            mock_encrypt.assert_called_once_with('pass4', 'salt4', 'sha256')
+
+        # no auth table if auth is not configured
+        app = wsbapp.make_app(os.path.join(root_dir, 'test_app_helpers', 'general'))
+        self.assertIsNone(app.config['WEBSCRAPBOOK_HOST'].auth)
+
     def test_verify_authorization(self):
         for action in {'view', 'info', 'source', 'download', 'static'}:
             with self.subTest(action=action):
@@ -1077,5 +1205,87 @@ class TestWebHost(unittest.TestCase):
         mock_delete.assert_not_called()
         self.assertEqual(handler.token_last_purge, now - 900)
 
+class TestTimingStats(unittest.TestCase):
+    @mock.patch('webscrapbook.app.TimingStats.BUCKETS', (0.01, 0.1, 1))
+    def test_observe(self):
+        stats = wsbapp.TimingStats()
+        stats.observe('view', 'total', 0.005)
+        stats.observe('view', 'total', 0.01)
+        stats.observe('view', 'total', 0.5)
+        stats.observe('view', 'total', 3)
+        stats.observe('list', 'auth', 0.05)
+
+        self.assertEqual(stats.snapshot(), {
+            ('view', 'total'): ([2, 0, 1, 1], 4, 3.515),
+            ('list', 'auth'): ([0, 1, 0, 0], 1, 0.05),
+            })
+
+class TestTokenStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = os.path.join(root_dir, 'test_app_helpers', 'general')
+        self.store_dir = os.path.join(root_dir, 'test_app_helpers', 'token_store')
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.store_dir)
+        except FileNotFoundError:
+            pass
+
+    def _test_store(self, store):
+        handler = wsbapp.WebHost(self.test_dir)
+        handler.token_store = store
+
+        token1 = handler.token_acquire(30000)
+        token2 = handler.token_acquire(30100)
+        self.assertNotEqual(token1, token2)
+        self.assertEqual(store.get(token1), 30000 + handler.TOKEN_DEFAULT_EXPIRY)
+
+        self.assertTrue(handler.token_validate(token1, 30001))
+        self.assertFalse(handler.token_validate('nonexist', 30001))
+
+        handler.token_delete(token1)
+        self.assertFalse(handler.token_validate(token1, 30001))
+
+        handler.token_delete_expire(30000 + handler.TOKEN_DEFAULT_EXPIRY + 100)
+        self.assertIsNone(store.get(token2))
+
+        token3 = handler.token_acquire(40000)
+        self.assertFalse(handler.token_validate(token3, 40000 + handler.TOKEN_DEFAULT_EXPIRY))
+        self.assertIsNone(store.get(token3))
+
+    def test_file(self):
+        self._test_store(wsbapp.FileTokenStore(self.store_dir))
+
+    def test_memory(self):
+        self._test_store(wsbapp.MemoryTokenStore())
+
+    def test_sqlite(self):
+        store = wsbapp.SqliteTokenStore(os.path.join(self.store_dir, 'tokens.sqlite'))
+        self._test_store(store)
+
+        # tokens are shared among connections
+        token = store.add(50000)
+        store2 = wsbapp.SqliteTokenStore(os.path.join(self.store_dir, 'tokens.sqlite'))
+        self.assertEqual(store2.get(token), 50000)
+
+    def test_backend(self):
+        handler = wsbapp.WebHost(self.test_dir)
+        self.assertIsInstance(handler.token_store, wsbapp.FileTokenStore)
+
+        config = webscrapbook.Config()
+        config.load(self.test_dir)
+        config['app']['token_backend'] = 'memory'
+        handler = wsbapp.WebHost(self.test_dir, config=config)
+        self.assertIsInstance(handler.token_store, wsbapp.MemoryTokenStore)
+
+        config['app']['token_backend'] = 'sqlite'
+        handler = wsbapp.WebHost(self.test_dir, config=config)
+        self.assertIsInstance(handler.token_store, wsbapp.SqliteTokenStore)
+        self.assertEqual(handler.token_store.file, handler.tokens + '.sqlite')
+
+        config['app']['token_backend'] = 'unknown'
+        with self.assertRaises(ValueError):
+            wsbapp.WebHost(self.test_dir, config=config)
+
 if __name__ == '__main__':
     unittest.main()
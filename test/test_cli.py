@@ -11,6 +11,7 @@ from tempfile import gettempdir
 from webscrapbook import WSB_DIR, WSB_CONFIG
 from webscrapbook import Config
 from webscrapbook import cli
+from webscrapbook import util
 
 root_dir = os.path.abspath(os.path.dirname(__file__))
 test_dir = os.path.join(root_dir, 'test_cli')
@@ -346,6 +347,7 @@ class TestCache(unittest.TestCase):
             'rss_root': 'http://example.com:8000/wsb/',
             'locale': 'zh_TW',
             'no_backup': True,
+            'jobs': 4,
             'debug': True,
             })
 
@@ -359,6 +361,7 @@ class TestCache(unittest.TestCase):
             rss_root='http://example.com:8000/wsb/',
             locale='zh_TW',
             no_backup=True,
+            jobs=4,
             )
 
 class TestEncrypt(unittest.TestCase):
@@ -374,6 +377,83 @@ class TestEncrypt(unittest.TestCase):
         mock_encrypt.assert_called_once_with('1234', salt='mysalt', method='sha256')
         self.assertEqual(mock_stdout.getvalue(), 'dummy_hash\n')
 
+class TestCompact(unittest.TestCase):
+    def tearDown(self):
+        try:
+            shutil.rmtree(os.path.join(test_dir, 'temp'))
+        except NotADirectoryError:
+            os.remove(os.path.join(test_dir, 'temp'))
+        except FileNotFoundError:
+            pass
+
+    @mock.patch('webscrapbook.util.zip_compact')
+    def test_call(self, mock_compact):
+        testfile1 = os.path.join(test_dir, 'temp', 'test1.htz')
+        testfile2 = os.path.join(test_dir, 'temp', 'subdir', 'test2.maff')
+        testfile3 = os.path.join(test_dir, 'temp', 'subdir', 'test3.txt')
+        os.makedirs(os.path.dirname(testfile2), exist_ok=True)
+        for file in (testfile1, testfile2):
+            with zipfile.ZipFile(file, 'w') as zh:
+                zh.writestr('index.html', 'ABC')
+        with open(testfile3, 'w') as fh:
+            fh.write('ABC')
+
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            cli.cmd_compact({
+                'paths': [testfile1, os.path.join(test_dir, 'temp', 'subdir')],
+                'threshold': 0.3,
+                'debug': False,
+                })
+
+        self.assertEqual(mock_compact.call_args_list, [
+            mock.call(testfile1, 0.3),
+            mock.call(testfile2, 0.3),
+            ])
+
+    def test_call_log(self):
+        testfile = os.path.join(test_dir, 'temp', 'test.htz')
+        os.makedirs(os.path.dirname(testfile), exist_ok=True)
+        with zipfile.ZipFile(testfile, 'w') as zh:
+            zh.writestr('index.html', '1' * 1000, compress_type=zipfile.ZIP_STORED)
+        with zipfile.ZipFile(testfile, 'a') as zh:
+            with util.zip_tombstone(zh, 'index.html'):
+                zh.writestr('index.html', 'new')
+        size = os.stat(testfile).st_size
+
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            cli.cmd_compact({
+                'paths': [testfile],
+                'threshold': 0.2,
+                'debug': False,
+                })
+
+        # report the actually reclaimed size
+        reclaimed = util.format_filesize(size - os.stat(testfile).st_size)
+        self.assertEqual(mock_stdout.getvalue(), f'INFO: Compacted "{testfile}" (reclaimed {reclaimed})\n')
+
+class TestPrecompile(unittest.TestCase):
+    def tearDown(self):
+        try:
+            shutil.rmtree(os.path.join(test_dir, 'temp'))
+        except NotADirectoryError:
+            os.remove(os.path.join(test_dir, 'temp'))
+        except FileNotFoundError:
+            pass
+
+    def test_call(self):
+        root = os.path.join(test_dir, 'temp')
+        os.makedirs(root)
+
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            cli.cmd_precompile({
+                'root': root,
+                'debug': True,
+                })
+
+        self.assertIn('DEBUG: Compiled "index.html"', mock_stdout.getvalue())
+        self.assertNotIn('ERROR:', mock_stdout.getvalue())
+        self.assertTrue(os.listdir(os.path.join(root, WSB_DIR, 'cache', 'jinja')))
+
 class TestHelp(unittest.TestCase):
     @mock.patch('sys.stdout', new_callable=io.StringIO)
     def test_call(self, mock_stdout):
@@ -72,7 +72,15 @@ class TestFuncGenerate(TestCache):
         for info in wsb_cache.generate(self.test_root, no_lock=False):
             pass
 
-        mock_func.assert_called_once_with()
+        mock_func.assert_called_once_with(shared=False)
+
+    @mock.patch('webscrapbook.scrapbook.host.Book.get_tree_lock')
+    def test_param_no_lock03(self, mock_func):
+        """Shared lock if the tree is not modified"""
+        for info in wsb_cache.generate(self.test_root, no_lock=False, fulltext=False):
+            pass
+
+        mock_func.assert_called_once_with(shared=True)
 
     @mock.patch('webscrapbook.scrapbook.host.Book.get_tree_lock')
     def test_param_no_lock02(self, mock_func):
@@ -166,6 +174,13 @@ no_tree = true
 
         self.assertFalse(mock_cls.call_args[1]['inclusive_frames'])
 
+    @mock.patch('webscrapbook.scrapbook.cache.FulltextCacheGenerator')
+    def test_param_jobs(self, mock_cls):
+        for info in wsb_cache.generate(self.test_root, jobs=4):
+            pass
+
+        self.assertEqual(mock_cls.call_args[1]['jobs'], 4)
+
     @mock.patch('webscrapbook.scrapbook.cache.StaticSiteGenerator')
     def test_param_static_site01(self, mock_cls):
         for info in wsb_cache.generate(self.test_root, static_site=True):
@@ -466,6 +481,57 @@ Page content 2.
                 },
             })
 
+    @mock.patch('webscrapbook.scrapbook.book.Book.save_fulltext_files')
+    def test_jobs(self, mock_save):
+        """Generate in worker processes with the same result and messages"""
+        with open(self.test_meta, 'w', encoding='UTF-8') as f:
+            f.write("""\
+scrapbook.meta({
+  "20200101000000001": {
+    "index": "20200101000000001/index.html"
+  },
+  "20200101000000002": {
+    "index": "20200101000000002/index.html"
+  },
+  "20200101000000003": {
+    "index": "20200101000000003/index.html"
+  }
+})""")
+        with open(self.test_fulltext, 'w', encoding='UTF-8') as f:
+            f.write("""\
+scrapbook.fulltext({
+ "20200101000000002": {
+  "index.html": {
+   "content": "dummy2"
+  }
+ },
+ "20200101000000004": {
+  "index.html": {
+   "content": "dummy4"
+  }
+ }
+})""")
+        for i in (1, 2):
+            test_file = os.path.join(self.test_root, f'2020010100000000{i}', 'index.html')
+            os.makedirs(os.path.dirname(test_file), exist_ok=True)
+            with open(test_file, 'w', encoding='UTF-8') as f:
+                f.write(f'<p>Page content {i}.</p>')
+            os.utime(test_file, (2000, 2000))
+        os.utime(self.test_fulltext, (1000, 1000))
+
+        results = []
+        for jobs in (1, 2):
+            book = Host(self.test_root).books['']
+            generator = wsb_cache.FulltextCacheGenerator(book, jobs=jobs)
+            infos = [(info.type, info.msg) for info in generator.run()]
+            results.append((infos, book.fulltext))
+
+        self.assertEqual(results[1], results[0])
+        self.assertEqual(list(results[1][1].items()), [
+            ('20200101000000002', {'index.html': {'content': 'Page content 2.'}}),
+            ('20200101000000001', {'index.html': {'content': 'Page content 1.'}}),
+            ])
+
     def test_update01(self):
         """Update if no cache"""
         self.create_meta()
@@ -3,6 +3,7 @@ import unittest
 import os
 import shutil
 import time
+import threading
 from webscrapbook import WSB_DIR, Config
 from webscrapbook.scrapbook import host as wsb_host
 from webscrapbook.scrapbook.host import Host
@@ -169,6 +170,34 @@ name = mybook2
         host = Host(self.test_root)
         self.assertEqual(host.get_static_file('test.txt'), other_static)
 
+    def test_get_template_env01(self):
+        """Compiled templates are stored in the bytecode cache"""
+        host = Host(self.test_root)
+        env = host.get_template_env()
+        self.assertIs(host.get_template_env(), env)
+
+        template = env.get_template('index.html')
+        cache_dir = os.path.join(self.test_wsbdir, 'cache', 'jinja')
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        # another host loads the template from the bytecode cache
+        host2 = Host(self.test_root)
+        with mock.patch.object(host2.get_template_env(), 'compile', side_effect=AssertionError):
+            template2 = host2.get_template_env().get_template('index.html')
+        self.assertIsNot(template2, template)
+
+    def test_get_template_env02(self):
+        """A broken bytecode file is treated as a cache miss"""
+        host = Host(self.test_root)
+        host.get_template_env().get_template('index.html')
+        cache_dir = os.path.join(self.test_wsbdir, 'cache', 'jinja')
+        for name in os.listdir(cache_dir):
+            with open(os.path.join(cache_dir, name), 'wb') as fh:
+                fh.write(b'broken')
+
+        host2 = Host(self.test_root)
+        host2.get_template_env().get_template('index.html')
+
     @mock.patch('webscrapbook.scrapbook.host.FileLock')
     def test_get_lock01(self, mock_filelock):
         host = Host(self.test_root)
@@ -326,6 +355,122 @@ class TestFileLock(TestBase):
         self.assertFalse(os.path.exists(lock.file))
         self.assertFalse(lock.locked)
 
+    def test_acquire_wait(self):
+        """Waiter should be woken once the lock is released in the process."""
+        host = Host(self.test_root)
+        lock = host.get_lock('test')
+        lock.acquire()
+
+        def release():
+            time.sleep(0.05)
+            lock.release()
+
+        thread = threading.Thread(target=release)
+        thread.start()
+        try:
+            lock2 = host.get_lock('test')
+            t = time.time()
+            lock2.acquire(timeout=5, poll_interval=5)
+            self.assertLess(time.time() - t, 2)
+            self.assertTrue(lock2.locked)
+            lock2.release()
+        finally:
+            thread.join()
+
+    @mock.patch('webscrapbook.scrapbook.host.file_lock_stats', new_callable=wsb_host.FileLockStats)
+    def test_acquire_stats(self, mock_stats):
+        host = Host(self.test_root)
+        lock = host.get_lock('test')
+        lock.acquire()
+        try:
+            with self.assertRaises(wsb_host.LockTimeoutError):
+                host.get_lock('test').acquire(timeout=0.1)
+        finally:
+            lock.release()
+
+        self.assertEqual(mock_stats.acquired, 1)
+        self.assertEqual(mock_stats.timeouts, 1)
+        self.assertEqual(mock_stats.errors, 0)
+        self.assertGreaterEqual(mock_stats.wait_seconds, 0.1)
+
+    def test_acquire_shared01(self):
+        """Shared locks should coexist and block an exclusive lock."""
+        host = Host(self.test_root)
+        lock1 = host.get_lock('test', shared=True)
+        lock2 = host.get_lock('test', shared=True)
+
+        lock1.acquire(timeout=0)
+        lock2.acquire(timeout=0)
+        self.assertTrue(lock1.locked)
+        self.assertTrue(lock2.locked)
+        self.assertNotEqual(lock1.file, lock2.file)
+
+        lock3 = host.get_lock('test')
+        with self.assertRaises(wsb_host.LockTimeoutError):
+            lock3.acquire(timeout=0)
+        self.assertFalse(os.path.lexists(lock3.file))
+
+        lock1.release()
+        lock2.release()
+        lock3.acquire(timeout=0)
+        self.assertTrue(lock3.locked)
+
+        lock4 = host.get_lock('test', shared=True)
+        with self.assertRaises(wsb_host.LockTimeoutError):
+            lock4.acquire(timeout=0)
+
+        lock3.release()
+        lock4.acquire(timeout=0)
+        self.assertTrue(lock4.locked)
+
+    def test_acquire_shared02(self):
+        """A waiting exclusive lock should block new shared locks."""
+        host = Host(self.test_root)
+        lock1 = host.get_lock('test', shared=True)
+        lock1.acquire()
+
+        lock2 = host.get_lock('test')
+        thread = threading.Thread(target=lock2.acquire)
+        thread.start()
+        try:
+            for _ in range(100):
+                if os.path.lexists(lock2.file):
+                    break
+                time.sleep(0.01)
+
+            lock3 = host.get_lock('test', shared=True)
+            with self.assertRaises(wsb_host.LockTimeoutError):
+                lock3.acquire(timeout=0)
+
+            lock1.release()
+        finally:
+            thread.join()
+
+        self.assertTrue(lock2.locked)
+        lock2.release()
+
+    def test_acquire_shared03(self):
+        """Stale shared locks should be ignored."""
+        host = Host(self.test_root)
+        lock1 = host.get_lock('test', shared=True, stale=0)
+        lock1.acquire()
+
+        lock2 = host.get_lock('test', stale=0)
+        lock2.acquire(timeout=1)
+        self.assertTrue(lock2.locked)
+        self.assertFalse(os.path.lexists(lock1.file))
+
+    def test_persist_shared(self):
+        host = Host(self.test_root)
+        lock = host.get_lock('test', shared=True)
+        lock.acquire()
+
+        lock2 = host.get_lock('test', shared=True, persist=lock.id)
+        self.assertEqual(lock2.file, lock.file)
+        self.assertTrue(lock2.locked)
+        lock2.release()
+        self.assertFalse(os.path.lexists(lock.file))
+
     def test_extend01(self):
         """Nnormal case"""
         lock = Host(self.test_root).get_lock('test')
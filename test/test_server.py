@@ -2,6 +2,11 @@ from unittest import mock
 import unittest
 import sys
 import os
+import time
+import threading
+import socket
+import http.client
+from concurrent.futures import ThreadPoolExecutor
 import webscrapbook
 from webscrapbook import WSB_DIR, WSB_CONFIG
 from webscrapbook import server
@@ -175,6 +180,153 @@ browse = false
             os.path.join(server_root, WSB_DIR, 'test.key'),
             ))
 
+    @mock.patch('webscrapbook.server.serve_prefork')
+    @mock.patch('webscrapbook.server.PoolWSGIServer')
+    def test_engine_production(self, mock_server, mock_serve):
+        with open(server_config, 'w', encoding='UTF-8') as f:
+            f.write("""[server]
+host = 127.0.0.1
+port = 7357
+browse = false
+engine = production
+threads = 4
+processes = 2
+backlog = 64
+keep_alive = 10
+""")
+
+        server.serve(server_root)
+        self.assertEqual(mock_server.call_args[1]['host'], '127.0.0.1')
+        self.assertEqual(mock_server.call_args[1]['port'], 7357)
+        self.assertEqual(mock_server.call_args[1]['threads'], 4)
+        self.assertEqual(mock_server.call_args[1]['backlog'], 64)
+        self.assertEqual(mock_server.call_args[1]['keep_alive'], 10)
+        self.assertIs(mock_server.call_args[1]['ssl_context'], None)
+        mock_serve.assert_called_once_with(mock_server.return_value, 2)
+
+    def test_engine_invalid(self):
+        with open(server_config, 'w', encoding='UTF-8') as f:
+            f.write("""[server]
+host = 127.0.0.1
+port = 7357
+browse = false
+engine = unknown
+""")
+
+        with self.assertRaises(ValueError):
+            server.serve(server_root)
+
+class TestPoolWSGIServer(unittest.TestCase):
+    def test_serve(self):
+        def app(environ, start_response):
+            time.sleep(0.1)
+            start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '2')])
+            return [b'OK']
+
+        srv = server.PoolWSGIServer('127.0.0.1', 0, app, threads=2, keep_alive=1,
+            handler=server.RequestHandler)
+        thread = threading.Thread(target=srv.serve_forever)
+        thread.start()
+        try:
+            def request(_):
+                conn = http.client.HTTPConnection('127.0.0.1', srv.port, timeout=10)
+                try:
+                    rv = []
+                    # 2 requests through a persistent connection
+                    for _ in range(2):
+                        conn.request('GET', '/')
+                        r = conn.getresponse()
+                        rv.append((r.status, r.read()))
+                    return rv
+                finally:
+                    conn.close()
+
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(request, range(4)))
+        finally:
+            srv.shutdown()
+            thread.join()
+
+        self.assertEqual(results, [[(200, b'OK'), (200, b'OK')]] * 4)
+
+    def test_keep_alive(self):
+        """keep_alive should time out an idle connection but not a slow request."""
+        def app(environ, start_response):
+            body = environ['wsgi.input'].read(int(environ['CONTENT_LENGTH']))
+            start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+            return [body]
+
+        srv = server.PoolWSGIServer('127.0.0.1', 0, app, threads=1, keep_alive=0.5,
+            handler=server.RequestHandler)
+        thread = threading.Thread(target=srv.serve_forever)
+        thread.start()
+        try:
+            with socket.create_connection(('127.0.0.1', srv.port), timeout=10) as sock:
+                # a slow upload
+                sock.sendall(b'POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: 4\r\n\r\nAB')
+                time.sleep(1)
+                sock.sendall(b'CD')
+                data = b''
+                while not data.endswith(b'ABCD'):
+                    chunk = sock.recv(4096)
+                    if not chunk:
+                        break
+                    data += chunk
+                self.assertTrue(data.startswith(b'HTTP/1.1 200'))
+                self.assertTrue(data.endswith(b'ABCD'))
+
+                # an idle connection
+                t = time.time()
+                self.assertEqual(sock.recv(4096), b'')
+                self.assertLess(time.time() - t, 5)
+        finally:
+            srv.shutdown()
+            thread.join()
+            srv.server_close()
+
+    def test_shutdown_busy(self):
+        """shutdown() should not be blocked when all workers are busy."""
+        event = threading.Event()
+
+        def app(environ, start_response):
+            event.wait(10)
+            start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '2')])
+            return [b'OK']
+
+        srv = server.PoolWSGIServer('127.0.0.1', 0, app, threads=1, keep_alive=1,
+            handler=server.RequestHandler)
+        thread = threading.Thread(target=srv.serve_forever)
+        thread.start()
+        conns = []
+        try:
+            # one connection occupies the worker and another one waits
+            for _ in range(2):
+                conn = http.client.HTTPConnection('127.0.0.1', srv.port, timeout=10)
+                conn.request('GET', '/')
+                conns.append(conn)
+            time.sleep(0.2)
+
+            t = time.time()
+            srv.shutdown()
+            self.assertLess(time.time() - t, 5)
+            self.assertFalse(event.is_set())
+        finally:
+            event.set()
+            srv.shutdown()
+            thread.join()
+            srv.server_close()
+            for conn in conns:
+                conn.close()
+
+class TestServePrefork(unittest.TestCase):
+    @mock.patch('signal.signal')
+    def test_close(self, mock_signal):
+        """The server should be closed, waiting for handling connections."""
+        srv = mock.Mock()
+        server.serve_prefork(srv, 1)
+        srv.serve_forever.assert_called_once_with()
+        srv.server_close.assert_called_once_with()
+
 class TestConfigBrowser(unittest.TestCase):
     @mock.patch('webbrowser.get')
     @mock.patch('webscrapbook.server.make_server')
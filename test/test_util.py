@@ -5,10 +5,15 @@ import os
 import platform
 import subprocess
 import shutil
+import tempfile
 import io
 import time
 import zipfile
+import gzip
+import struct
 import collections
+import random
+import mimetypes
 from datetime import datetime, timezone, timedelta
 from webscrapbook import util
 from webscrapbook.util import frozendict, zip_tuple_timestamp
@@ -541,6 +546,70 @@ class TestUtils(unittest.TestCase):
             ('folder/.gitkeep', 'file', 0, os.stat(os.path.join(entry, 'folder', '.gitkeep')).st_mtime),
             })
 
+    def test_listdir_symlink(self):
+        """Symlinked directories should be listed but not walked into."""
+        entry = os.path.join(root_dir, 'test_util', 'listdir')
+        link = os.path.join(root_dir, 'test_util', 'listdir', 'folder-link')
+
+        try:
+            os.symlink(os.path.join(entry, 'folder'), link)
+        except OSError:
+            if platform.system() == 'Windows':
+                self.skipTest('requires administrator or Developer Mode on Windows')
+            else:
+                raise
+
+        try:
+            self.assertEqual(set(util.listdir(entry, recursive=True)), {
+                ('file.txt', 'file', 3, os.stat(os.path.join(entry, 'file.txt')).st_mtime),
+                ('folder', 'dir', None, os.stat(os.path.join(entry, 'folder')).st_mtime),
+                ('folder/.gitkeep', 'file', 0, os.stat(os.path.join(entry, 'folder', '.gitkeep')).st_mtime),
+                ('folder-link', 'link', None, os.lstat(link).st_mtime),
+                })
+        finally:
+            try:
+                os.remove(link)
+            except FileNotFoundError:
+                pass
+
+    def test_listdir_paged(self):
+        root = tempfile.mkdtemp()
+        try:
+            for path in ('a/x/1', 'a/x/2', 'a/z', 'a b', 'b', 'c/q'):
+                os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+                with open(os.path.join(root, path), 'w'):
+                    pass
+            expected = ['a', 'a/x', 'a/x/1', 'a/x/2', 'a/z', 'a b', 'b', 'c', 'c/q']
+
+            self.assertEqual([i.name for i in util.listdir_paged(root, recursive=True)], expected)
+            self.assertEqual([i.name for i in util.listdir_paged(root)], ['a', 'a b', 'b', 'c'])
+            self.assertEqual([i.name for i in util.listdir_paged(root, cursor='a', limit=2)], ['a b', 'b'])
+
+            for limit in (1, 2, 4):
+                names = []
+                cursor = None
+                while True:
+                    page = [i.name for i in util.listdir_paged(root, True, cursor, limit)]
+                    names.extend(page)
+                    if len(page) < limit:
+                        break
+                    cursor = page[-1]
+                self.assertEqual(names, expected)
+
+            # an unreadable subdirectory is skipped
+            scandir = os.scandir
+
+            def mock_scandir(path):
+                if path == os.path.join(root, 'a'):
+                    raise PermissionError('Forbidden')
+                return scandir(path)
+
+            with mock.patch('os.scandir', side_effect=mock_scandir):
+                self.assertEqual([i.name for i in util.listdir_paged(root, True, limit=4)],
+                    ['a', 'a b', 'b', 'c'])
+        finally:
+            shutil.rmtree(root)
+
     def test_format_filesize(self):
         self.assertEqual(util.format_filesize(0), '0 B')
         self.assertEqual(util.format_filesize(3), '3 B')
@@ -663,6 +732,27 @@ class TestUtils(unittest.TestCase):
         self.assertFalse(util.mime_is_markdown('image/svg+xml'))
         self.assertFalse(util.mime_is_markdown('application/octet-stream'))
 
+    def test_mime_info(self):
+        self.assertEqual(util.mime_info('index.html'),
+            ('text/html', True, False, False, False, False, True))
+        self.assertEqual(util.mime_info('PATH/TO/INDEX.HTML'),
+            ('text/html', True, False, False, False, False, True))
+        self.assertEqual(util.mime_info('page.htz'),
+            ('application/html+zip', False, True, True, False, False, False))
+        self.assertEqual(util.mime_info('page.maff'),
+            ('application/x-maff', False, True, False, True, False, False))
+        self.assertEqual(util.mime_info('note.md'),
+            ('text/markdown', False, False, False, False, True, True))
+        self.assertEqual(util.mime_info('file.unknown-ext'),
+            (None, False, False, False, False, False, False))
+        self.assertEqual(util.mime_info('noext'),
+            (None, False, False, False, False, False, False))
+
+        # fallback to mimetypes for multi-extension ones
+        for file in ('archive.tar.gz', 'archive.tgz', 'data:text/plain,abc'):
+            with self.subTest(file=file):
+                self.assertEqual(util.guess_mimetype(file), mimetypes.guess_type(file)[0])
+
     def test_is_html(self):
         self.assertTrue(util.is_html('index.html'))
         self.assertTrue(util.is_html('index.xhtml'))
@@ -898,6 +988,661 @@ class TestUtils(unittest.TestCase):
             except FileNotFoundError:
                 pass
 
+    def test_zip_dir_trie(self):
+        trie = util.ZipDirTrie([
+            'file.txt',
+            'explicit_dir/',
+            'explicit_dir/index.html',
+            'implicit_dir/sub/index.html',
+            'implicit_dir/file.txt',
+            ])
+        self.assertTrue(trie.is_dir(''))
+        self.assertTrue(trie.is_dir('explicit_dir'))
+        self.assertTrue(trie.is_dir('implicit_dir/'))
+        self.assertTrue(trie.is_dir('implicit_dir/sub'))
+        self.assertFalse(trie.is_dir('file.txt'))
+        self.assertFalse(trie.is_dir('nonexist'))
+        self.assertEqual(trie.children(''), ['file.txt', 'explicit_dir', 'implicit_dir'])
+        self.assertEqual(trie.children('implicit_dir'), ['sub', 'file.txt'])
+        self.assertEqual(trie.children('explicit_dir/index.html'), None)
+        self.assertEqual(list(trie.walk('implicit_dir')), ['sub', 'file.txt', 'sub/index.html'])
+        self.assertEqual(list(trie.walk('')), [
+            'file.txt', 'explicit_dir', 'implicit_dir',
+            'explicit_dir/index.html', 'implicit_dir/sub', 'implicit_dir/file.txt',
+            'implicit_dir/sub/index.html',
+            ])
+
+    def test_zip_dir_trie_cache(self):
+        zip_filename = os.path.join(root_dir, 'test_util', 'zipfile.zip')
+        try:
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr('folder/.gitkeep', '123')
+
+            util.zip_dir_trie_cache.clear()
+            with util.CachedZipFile(zip_filename) as zh:
+                trie = util.zip_dir_trie(zh)
+                self.assertTrue(trie.is_dir('folder'))
+            with util.CachedZipFile(zip_filename) as zh:
+                self.assertIs(util.zip_dir_trie(zh), trie)
+
+            # not cached for writing
+            with zipfile.ZipFile(zip_filename, 'a') as zh:
+                zh.writestr('folder2/.gitkeep', '123')
+                self.assertTrue(util.zip_dir_trie(zh).is_dir('folder2'))
+        finally:
+            util.zip_dir_trie_cache.clear()
+            try:
+                os.remove(zip_filename)
+            except FileNotFoundError:
+                pass
+
+    def test_lru_cache(self):
+        # LRU eviction by entry count and bytes
+        cache = util.LRUCache(max_entries=2, max_bytes=100)
+        cache.set('a', 'A', 10)
+        cache.set('b', 'B', 10)
+        self.assertEqual(cache.get('a'), 'A')
+        cache.set('c', 'C', 10)
+        self.assertIsNone(cache.get('b'))
+        cache.set('d', 'D', 85)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 'C')
+        self.assertEqual(cache.get('d'), 'D')
+        self.assertEqual(cache.bytes, 95)
+
+        # skip an entry larger than the budget
+        cache.set('e', 'E', 101)
+        self.assertEqual(cache.get('e', 'default'), 'default')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+
+        # expiration
+        cache = util.LRUCache()
+        cache.set('a', 'A', expire=100)
+        self.assertEqual(cache.get('a', now=99), 'A')
+        self.assertIsNone(cache.get('a', now=100))
+        self.assertEqual(len(cache), 0)
+
+        # discard by key
+        cache = util.LRUCache()
+        cache.set(('x', 1), 'A', 10)
+        cache.set(('x', 2), 'B', 10)
+        cache.set(('y', 1), 'C', 10)
+        cache.discard(lambda key: key[0] == 'x')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get(('y', 1)), 'C')
+        self.assertEqual(cache.bytes, 10)
+
+    def test_zip_dir_cache(self):
+        # LRU eviction by entry count
+        cache = util.ZipDirCache(max_entries=2, max_bytes=1000)
+        cache.set(('a', 1, 1, 1), 'A', 10)
+        cache.set(('b', 1, 1, 1), 'B', 10)
+        self.assertEqual(cache.get(('a', 1, 1, 1)), 'A')
+        cache.set(('c', 1, 1, 1), 'C', 10)
+        self.assertIsNone(cache.get(('b', 1, 1, 1)))
+        self.assertEqual(cache.get(('a', 1, 1, 1)), 'A')
+        self.assertEqual(cache.get(('c', 1, 1, 1)), 'C')
+        self.assertEqual(cache.hits, 3)
+        self.assertEqual(cache.misses, 1)
+
+        # LRU eviction by bytes
+        cache = util.ZipDirCache(max_entries=10, max_bytes=100)
+        cache.set(('a', 1, 1, 1), 'A', 60)
+        cache.set(('b', 1, 1, 1), 'B', 30)
+        cache.set(('c', 1, 1, 1), 'C', 30)
+        self.assertIsNone(cache.get(('a', 1, 1, 1)))
+        self.assertEqual(cache.get(('b', 1, 1, 1)), 'B')
+        self.assertEqual(cache.get(('c', 1, 1, 1)), 'C')
+        self.assertEqual(cache.bytes, 60)
+
+        # skip an entry larger than the budget
+        cache.set(('d', 1, 1, 1), 'D', 101)
+        self.assertIsNone(cache.get(('d', 1, 1, 1)))
+        self.assertEqual(len(cache), 2)
+
+        # invalidate by path
+        cache = util.ZipDirCache()
+        path = os.path.join(root_dir, 'test_util', 'zipfile.zip')
+        key1 = (os.path.normcase(path), 1, 1, 1)
+        key2 = (os.path.normcase(path), 1, 2, 1)
+        cache.set(key1, 'A', 10)
+        cache.set(key2, 'B', 10)
+        cache.set(('other', 1, 1, 1), 'C', 10)
+        cache.invalidate(path)
+        self.assertIsNone(cache.get(key1))
+        self.assertIsNone(cache.get(key2))
+        self.assertEqual(cache.get(('other', 1, 1, 1)), 'C')
+        self.assertEqual(cache.bytes, 10)
+
+    def test_zip_cache_invalidate(self):
+        path = os.path.join(root_dir, 'test_util', 'zipfile.zip')
+        key = (os.path.normcase(path), 1, 1, 1)
+        caches = (util.zip_dir_cache, util.zip_dir_trie_cache, util.zip_deflate_index_cache)
+        try:
+            for cache in caches:
+                cache.set(key, 'A', 10)
+            util.zip_cache_invalidate(path)
+            for cache in caches:
+                self.assertIsNone(cache.get(key))
+        finally:
+            for cache in caches:
+                cache.clear()
+
+    def test_cached_zip_file(self):
+        zip_filename = os.path.join(root_dir, 'test_util', 'zipfile.zip')
+        try:
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr('file.txt', '123456')
+                zh.writestr('folder/.gitkeep', '123')
+
+            cache = util.ZipDirCache()
+
+            # first access parses and caches
+            with util.CachedZipFile(zip_filename, cache) as zh:
+                self.assertEqual(zh.namelist(), ['file.txt', 'folder/.gitkeep'])
+                self.assertEqual(zh.read('file.txt'), b'123456')
+            self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 1, 1))
+
+            # second access reuses the central directory
+            with mock.patch('zipfile.ZipFile._RealGetContents') as mock_parse:
+                with util.CachedZipFile(zip_filename, cache) as zh:
+                    self.assertEqual(zh.namelist(), ['file.txt', 'folder/.gitkeep'])
+                    self.assertEqual(zh.read('folder/.gitkeep'), b'123')
+                mock_parse.assert_not_called()
+            self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 1, 1))
+
+            # a modified file gets a new key
+            with zipfile.ZipFile(zip_filename, 'a') as zh:
+                zh.writestr('new.txt', 'abc')
+
+            with util.CachedZipFile(zip_filename, cache) as zh:
+                self.assertEqual(zh.namelist(), ['file.txt', 'folder/.gitkeep', 'new.txt'])
+                self.assertEqual(zh.read('new.txt'), b'abc')
+            self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 2, 2))
+
+            # a file-like object is not cached
+            with open(zip_filename, 'rb') as fh:
+                with util.CachedZipFile(fh, cache) as zh:
+                    self.assertEqual(zh.read('file.txt'), b'123456')
+            self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 2, 2))
+
+            # opened instances are counted
+            count = util.CachedZipFile.open_count
+            zh = util.CachedZipFile(zip_filename, cache)
+            self.assertEqual(util.CachedZipFile.open_count, count + 1)
+            zh.close()
+            zh.close()
+            self.assertEqual(util.CachedZipFile.open_count, count)
+        finally:
+            try:
+                os.remove(zip_filename)
+            except FileNotFoundError:
+                pass
+
+    def test_nested_zip_cache(self):
+        zip_filename = os.path.join(root_dir, 'test_util', 'zipfile.zip')
+        try:
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                for name, content in (('inner1.zip', 'abc'), ('inner2.zip', 'defg')):
+                    buf = io.BytesIO()
+                    with zipfile.ZipFile(buf, 'w') as zh1:
+                        zh1.writestr('file.txt', content)
+                    zh.writestr(name, buf.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+                zh.writestr('file.txt', '123456')
+
+            dir_cache = util.ZipDirCache()
+
+            # in memory
+            cache = util.NestedZipCache(dir_cache)
+            with util.CachedZipFile(zip_filename, dir_cache) as zh:
+                with cache.open(zh, 'inner1.zip') as zh1:
+                    self.assertEqual(zh1.read('file.txt'), b'abc')
+                with mock.patch('zipfile.ZipFile.read') as mock_read:
+                    with cache.open(zh, 'inner1.zip') as zh1:
+                        self.assertEqual(zh1.namelist(), ['file.txt'])
+                    mock_read.assert_not_called()
+            self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 1, 1))
+            self.assertGreater(cache.memory_bytes, 0)
+            self.assertEqual(cache.disk_bytes, 0)
+
+            # spill to disk
+            cache = util.NestedZipCache(dir_cache, max_memory_size=0)
+            with util.CachedZipFile(zip_filename, dir_cache) as zh:
+                with cache.open(zh, 'inner1.zip') as zh1:
+                    self.assertEqual(zh1.read('file.txt'), b'abc')
+                    self.assertTrue(os.path.isfile(zh1.filename))
+                with cache.open(zh, 'inner1.zip') as zh1:
+                    self.assertEqual(zh1.read('file.txt'), b'abc')
+            self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 1, 1))
+            self.assertEqual(cache.memory_bytes, 0)
+            self.assertGreater(cache.disk_bytes, 0)
+
+            # evict least recently used
+            cache = util.NestedZipCache(dir_cache, max_memory_size=0, max_disk_bytes=1)
+            with util.CachedZipFile(zip_filename, dir_cache) as zh:
+                with cache.open(zh, 'inner1.zip') as zh1:
+                    file1 = zh1.filename
+                with cache.open(zh, 'inner2.zip') as zh1:
+                    self.assertEqual(zh1.read('file.txt'), b'defg')
+            self.assertEqual(len(cache), 0)
+            self.assertFalse(os.path.lexists(file1))
+
+            # member is not a ZIP file
+            cache = util.NestedZipCache(dir_cache)
+            with util.CachedZipFile(zip_filename, dir_cache) as zh:
+                with self.assertRaises(zipfile.BadZipFile):
+                    cache.open(zh, 'file.txt')
+                with self.assertRaises(KeyError):
+                    cache.open(zh, 'nonexist.zip')
+            self.assertEqual(len(cache), 0)
+
+            # not cached for an unidentified outer ZIP file
+            with zipfile.ZipFile(zip_filename) as zh:
+                with cache.open(zh, 'inner1.zip') as zh1:
+                    self.assertEqual(zh1.read('file.txt'), b'abc')
+            self.assertEqual(len(cache), 0)
+        finally:
+            try:
+                os.remove(zip_filename)
+            except FileNotFoundError:
+                pass
+
+    def test_zip_open_stored(self):
+        zip_filename = os.path.join(root_dir, 'test_util', 'zipfile.zip')
+        try:
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr('stored.txt', '0123456789', compress_type=zipfile.ZIP_STORED)
+                zh.writestr('deflated.txt', '0123456789', compress_type=zipfile.ZIP_DEFLATED)
+
+            with zipfile.ZipFile(zip_filename) as zh:
+                with util.zip_open_stored(zh, zh.getinfo('stored.txt')) as fh:
+                    self.assertTrue(fh.seekable())
+                    self.assertEqual(fh.read(), b'0123456789')
+                    self.assertEqual(fh.seek(3), 3)
+                    self.assertEqual(fh.read(4), b'3456')
+                    self.assertEqual(fh.tell(), 7)
+                    self.assertEqual(fh.seek(-2, io.SEEK_END), 8)
+                    self.assertEqual(fh.read(10), b'89')
+                    self.assertEqual(fh.read(), b'')
+
+                self.assertIsNone(util.zip_open_stored(zh, zh.getinfo('deflated.txt')))
+
+            # not backed by a file on disk
+            with open(zip_filename, 'rb') as f:
+                buf = io.BytesIO(f.read())
+            with zipfile.ZipFile(buf) as zh:
+                self.assertIsNone(util.zip_open_stored(zh, zh.getinfo('stored.txt')))
+        finally:
+            try:
+                os.remove(zip_filename)
+            except FileNotFoundError:
+                pass
+
+    def test_zip_open_deflated(self):
+        zip_filename = os.path.join(root_dir, 'test_util', 'zipfile.zip')
+        rng = random.Random(0)
+        data = bytes(rng.choice(b'abcd') for _ in range(100000))
+        try:
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr('stored.txt', data, compress_type=zipfile.ZIP_STORED)
+                zh.writestr('deflated.txt', data, compress_type=zipfile.ZIP_DEFLATED)
+
+            cache = util.ZipDirCache()
+            with util.CachedZipFile(zip_filename) as zh:
+                info = zh.getinfo('deflated.txt')
+                with util.zip_open_deflated(zh, info, cache) as fh:
+                    self.assertTrue(fh.seekable())
+                    self.assertEqual(fh.read(), data)
+                    fh.seek(54321)
+                    self.assertEqual(fh.read(1000), data[54321:55321])
+                    self.assertEqual(fh.tell(), 55321)
+                    fh.seek(-10, io.SEEK_END)
+                    self.assertEqual(fh.read(), data[-10:])
+                self.assertEqual(len(cache), 1)
+
+                self.assertIsNone(util.zip_open_deflated(zh, zh.getinfo('stored.txt'), cache))
+
+            # resume from checkpoints
+            with util.CachedZipFile(zip_filename) as zh:
+                info = zh.getinfo('deflated.txt')
+                index = util.ZipDeflateIndex(span=1000)
+                with util.ZipDeflateFile(util.zip_open_raw(zh, info), info.file_size, index) as fh, \
+                     mock.patch.object(fh, 'CHUNK_SIZE', 100):
+                    fh.seek(90000)
+                    self.assertEqual(fh.read(5000), data[90000:95000])
+                self.assertGreater(len(index), 1)
+                self.assertLessEqual(index.nearest(50000), 50000)
+                self.assertGreater(index.nearest(50000), 0)
+
+                with util.ZipDeflateFile(util.zip_open_raw(zh, info), info.file_size, index) as fh:
+                    for pos in (50000, 3, 99990, 20000):
+                        fh.seek(pos)
+                        self.assertEqual(fh.read(10), data[pos:pos + 10])
+
+            # not cached for an unidentified ZIP file
+            with zipfile.ZipFile(zip_filename) as zh:
+                self.assertIsNone(util.zip_open_deflated(zh, zh.getinfo('deflated.txt'), cache))
+        finally:
+            try:
+                os.remove(zip_filename)
+            except FileNotFoundError:
+                pass
+
+    def test_zip_copy_member(self):
+        zip_filename = os.path.join(root_dir, 'test_util', 'zipfile.zip')
+        data = b'Hello World! ' * 1000
+        try:
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr('deflated.txt', data, compress_type=zipfile.ZIP_DEFLATED, compresslevel=1)
+                zh.writestr('stored.txt', data, compress_type=zipfile.ZIP_STORED)
+
+            buf = io.BytesIO()
+            with zipfile.ZipFile(zip_filename) as zsrc:
+                with zipfile.ZipFile(buf, 'w') as zdest:
+                    zdest.writestr('new.txt', 'abc')
+                    for info in zsrc.infolist():
+                        util.zip_copy_member(zsrc, info, zdest)
+
+                    # source ZipInfo is not modified
+                    self.assertEqual(zsrc.getinfo('deflated.txt').header_offset, 0)
+
+                with zipfile.ZipFile(buf) as zh:
+                    self.assertIsNone(zh.testzip())
+                    self.assertEqual(zh.namelist(), ['new.txt', 'deflated.txt', 'stored.txt'])
+                    for info in zsrc.infolist():
+                        info2 = zh.getinfo(info.filename)
+                        self.assertEqual(info2.compress_size, info.compress_size)
+                        self.assertEqual(zh.read(info2), data)
+        finally:
+            try:
+                os.remove(zip_filename)
+            except FileNotFoundError:
+                pass
+
+    def test_zip_copy_member_fallback(self):
+        """Recompress if the zipfile internals are unavailable."""
+        data = b'Hello World! ' * 1000
+        src = io.BytesIO()
+        with zipfile.ZipFile(src, 'w') as zh:
+            zh.writestr('deflated.txt', data, compress_type=zipfile.ZIP_DEFLATED)
+            zh.writestr('stored.txt', data, compress_type=zipfile.ZIP_STORED)
+
+        buf = io.BytesIO()
+        with zipfile.ZipFile(src) as zsrc:
+            with zipfile.ZipFile(buf, 'w') as zdest, \
+                    mock.patch('webscrapbook.util._zip_can_copy_raw', return_value=False), \
+                    mock.patch('webscrapbook.util._zip_data_offset', side_effect=AssertionError):
+                for info in zsrc.infolist():
+                    util.zip_copy_member(zsrc, info, zdest)
+
+            with zipfile.ZipFile(buf) as zh:
+                self.assertIsNone(zh.testzip())
+                for info in zsrc.infolist():
+                    info2 = zh.getinfo(info.filename)
+                    self.assertEqual(info2.compress_type, info.compress_type)
+                    self.assertEqual(zh.read(info2), data)
+
+    def test_zip_strip_extra(self):
+        extra = struct.pack('<HH', 1, 8) + b'\0' * 8 + struct.pack('<HH', 0x5455, 5) + b'\1' * 5
+        self.assertEqual(util._zip_strip_extra(extra, (1,)), struct.pack('<HH', 0x5455, 5) + b'\1' * 5)
+        self.assertEqual(util._zip_strip_extra(extra, (2,)), extra)
+        self.assertEqual(util._zip_strip_extra(b'', (1,)), b'')
+
+    def test_zip_open_gzip(self):
+        zip_filename = os.path.join(root_dir, 'test_util', 'zipfile.zip')
+        data = b'Hello World! ' * 1000
+        try:
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr(zipfile.ZipInfo('deflated.txt', (1987, 1, 1, 0, 0, 0)), data,
+                    compress_type=zipfile.ZIP_DEFLATED)
+                zh.writestr('stored.txt', data, compress_type=zipfile.ZIP_STORED)
+
+            with zipfile.ZipFile(zip_filename) as zh:
+                info = zh.getinfo('deflated.txt')
+                stream = util.zip_open_gzip(zh, info)
+                gz = b''.join(stream)
+                self.assertEqual(len(gz), len(stream))
+                self.assertEqual(gzip.decompress(gz), data)
+                self.assertTrue(stream.raw.closed)
+                with gzip.GzipFile(fileobj=io.BytesIO(gz)) as fh:
+                    fh.read()
+                    self.assertEqual(fh.mtime, int(util.zip_timestamp(info)))
+
+                self.assertIsNone(util.zip_open_gzip(zh, zh.getinfo('stored.txt')))
+        finally:
+            try:
+                os.remove(zip_filename)
+            except FileNotFoundError:
+                pass
+
+    def test_zip_tombstone(self):
+        zip_filename = os.path.join(root_dir, 'test_util', 'zipfile.zip')
+        try:
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr('file1.txt', '1' * 1000)
+                zh.writestr('file2.txt', '2' * 1000)
+            self.assertEqual(util.zip_garbage_ratio(zip_filename), 0)
+
+            # the old version is kept if writing the new version fails
+            with zipfile.ZipFile(zip_filename, 'a') as zh:
+                with self.assertRaises(OSError):
+                    with util.zip_tombstone(zh, 'file1.txt'):
+                        with zh.open('file1.txt', 'w') as fh:
+                            fh.write(b'partial')
+                            raise OSError
+
+            with zipfile.ZipFile(zip_filename) as zh:
+                self.assertIsNone(zh.testzip())
+                self.assertEqual(zh.namelist(), ['file1.txt', 'file2.txt'])
+                self.assertEqual(zh.read('file1.txt'), b'1' * 1000)
+
+            with zipfile.ZipFile(zip_filename, 'a') as zh:
+                with util.zip_tombstone(zh, 'file1.txt'):
+                    zh.writestr('file1.txt', 'new')
+                with self.assertRaises(KeyError):
+                    with util.zip_tombstone(zh, 'nonexist.txt'):
+                        pass
+
+            with zipfile.ZipFile(zip_filename) as zh:
+                self.assertIsNone(zh.testzip())
+                self.assertEqual(zh.namelist(), ['file2.txt', 'file1.txt'])
+                self.assertEqual(zh.read('file1.txt'), b'new')
+                # calculated from the central directory without reading the
+                # local headers
+                with mock.patch('webscrapbook.util._zip_data_offset', side_effect=AssertionError):
+                    ratio = util.zip_garbage_ratio(zh)
+                self.assertAlmostEqual(ratio, 0.5, delta=0.1)
+        finally:
+            try:
+                os.remove(zip_filename)
+            except FileNotFoundError:
+                pass
+
+    def test_zip_compact(self):
+        zip_filename = os.path.join(root_dir, 'test_util', 'zipfile.zip')
+        try:
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr('file1.txt', '1' * 1000)
+                zh.writestr('file2.txt', '2' * 1000)
+                zh.comment = b'comment'
+
+            self.assertFalse(util.zip_compact(zip_filename, 0))
+
+            with zipfile.ZipFile(zip_filename, 'a') as zh:
+                with util.zip_tombstone(zh, 'file1.txt'):
+                    zh.writestr('file1.txt', 'new')
+            size = os.stat(zip_filename).st_size
+
+            # below threshold
+            self.assertFalse(util.zip_compact(zip_filename, 0.9))
+            self.assertEqual(os.stat(zip_filename).st_size, size)
+
+            self.assertTrue(util.zip_compact(zip_filename, 0))
+            self.assertLess(os.stat(zip_filename).st_size, size)
+            with zipfile.ZipFile(zip_filename) as zh:
+                self.assertIsNone(zh.testzip())
+                self.assertEqual(zh.namelist(), ['file2.txt', 'file1.txt'])
+                self.assertEqual(zh.read('file1.txt'), b'new')
+                self.assertEqual(zh.read('file2.txt'), b'2' * 1000)
+                self.assertEqual(zh.comment, b'comment')
+            self.assertEqual(util.zip_garbage_ratio(zip_filename), 0)
+        finally:
+            try:
+                os.remove(zip_filename)
+            except FileNotFoundError:
+                pass
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'requires os.symlink')
+    def test_zip_compact_symlink(self):
+        root = tempfile.mkdtemp()
+        try:
+            zip_filename = os.path.join(root, 'zipfile.zip')
+            link_filename = os.path.join(root, 'link.zip')
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr('file1.txt', '1' * 1000)
+            try:
+                os.symlink(zip_filename, link_filename)
+            except OSError:
+                self.skipTest('unable to create a symlink')
+
+            self.assertTrue(util.zip_compact(link_filename, -1))
+            self.assertTrue(os.path.islink(link_filename))
+            self.assertEqual(sorted(os.listdir(root)), ['link.zip', 'zipfile.zip'])
+            with zipfile.ZipFile(zip_filename) as zh:
+                self.assertEqual(zh.read('file1.txt'), b'1' * 1000)
+        finally:
+            shutil.rmtree(root)
+
+    def test_disk_cache(self):
+        root = tempfile.mkdtemp()
+        try:
+            cache = util.DiskCache(root, '.dat', max_size=10)
+            file1 = cache.get_file('a')
+            self.assertEqual(os.path.dirname(os.path.dirname(file1)), root)
+            self.assertTrue(file1.endswith('.dat'))
+            self.assertFalse(cache.touch(file1))
+
+            self.assertEqual(cache.write(file1, lambda fh: fh.write(b'12345')), file1)
+            self.assertTrue(cache.touch(file1))
+            with open(file1, 'rb') as fh:
+                self.assertEqual(fh.read(), b'12345')
+
+            # least recently used files are removed
+            os.utime(file1, (0, 0))
+            file2 = cache.get_file('b')
+            self.assertEqual(cache.write(file2, lambda fh: fh.write(b'67890a')), file2)
+            self.assertFalse(os.path.lexists(file1))
+
+            # a file larger than the limit is pruned immediately
+            file3 = cache.get_file('c')
+            self.assertIsNone(cache.write(file3, lambda fh: fh.write(b'x' * 11)))
+            self.assertFalse(os.path.lexists(file3))
+
+            # a failed write leaves no temp file
+            def writer(fh):
+                fh.write(b'123')
+                raise OSError
+
+            with self.assertRaises(OSError):
+                cache.write(cache.get_file('d'), writer)
+            self.assertEqual(
+                [f for _, _, files in os.walk(root) for f in files if f.endswith('.tmp')],
+                [],
+            )
+        finally:
+            shutil.rmtree(root)
+
+    def test_gzip_file_cache(self):
+        root = os.path.join(root_dir, 'test_util', 'temp')
+        cache_dir = os.path.join(root, 'cache')
+        file1 = os.path.join(root, 'file1.txt')
+        file2 = os.path.join(root, 'file2.txt')
+        try:
+            os.makedirs(root)
+            with open(file1, 'wb') as fh:
+                fh.write(b'abc' * 1000)
+            with open(file2, 'wb') as fh:
+                fh.write(b'ab')
+
+            cache = util.GzipFileCache(cache_dir, level=9, min_size=10, max_size=1000)
+            gz = cache.get(file1)
+            with gzip.open(gz) as fh:
+                self.assertEqual(fh.read(), b'abc' * 1000)
+            self.assertEqual(cache.get(file1), gz)
+
+            # too small
+            self.assertIsNone(cache.get(file2))
+
+            # regenerated for a modified file
+            with open(file1, 'wb') as fh:
+                fh.write(b'def' * 1000)
+            os.utime(file1, ns=(0, 0))
+            gz2 = cache.get(file1)
+            self.assertNotEqual(gz2, gz)
+            with gzip.open(gz2) as fh:
+                self.assertEqual(fh.read(), b'def' * 1000)
+
+            # prune least recently used
+            os.utime(gz, (0, 0))
+            cache = util.GzipFileCache(cache_dir, min_size=10, max_size=os.stat(gz2).st_size * 2 + 1)
+            with open(file2, 'wb') as fh:
+                fh.write(b'ghi' * 1000)
+            gz3 = cache.get(file2)
+            self.assertFalse(os.path.lexists(gz))
+            self.assertTrue(os.path.lexists(gz2))
+            self.assertTrue(os.path.lexists(gz3))
+
+            # too large to cache
+            cache = util.GzipFileCache(os.path.join(root, 'cache2'), min_size=10, max_size=1)
+            self.assertIsNone(cache.get(file1))
+        finally:
+            try:
+                shutil.rmtree(root)
+            except FileNotFoundError:
+                pass
+
+    def test_text_cache(self):
+        cache = util.TextCache(max_size=10)
+        cache.set('a', '12345')
+        cache.set('b', '67890')
+        self.assertEqual(cache.get('a'), '12345')
+
+        # least recently used entry is evicted
+        cache.set('c', 'abc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), '12345')
+        self.assertEqual(cache.get('c'), 'abc')
+
+        # an entry that could never fit is skipped
+        cache.set('d', '12345678901')
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual((cache.hits, cache.misses), (3, 2))
+
+    def test_text_cache_disk(self):
+        root = tempfile.mkdtemp()
+        try:
+            cache = util.TextCache(max_size=10, root=root, max_disk_size=16)
+            cache.set('a', '12345')
+            cache.set('b', '67890')
+            cache.set('c', 'abc')
+
+            # entries evicted from memory are loaded from disk
+            self.assertEqual(cache.get('a'), '12345')
+
+            # saved entries persist for a new cache
+            cache2 = util.TextCache(max_size=10, root=root, max_disk_size=16)
+            self.assertEqual(cache2.get('c'), 'abc')
+            self.assertEqual(len(cache2), 1)
+
+            # least recently used saved entries are removed
+            os.utime(cache._disk.get_file('b'), (0, 0))
+            cache.set('d', 'defg')
+            self.assertFalse(os.path.lexists(cache._disk.get_file('b')))
+            self.assertTrue(os.path.lexists(cache._disk.get_file('d')))
+        finally:
+            shutil.rmtree(root)
+
     def test_parse_content_type(self):
         self.assertEqual(
             util.parse_content_type('text/html; charset=UTF-8'),
@@ -1076,6 +1821,49 @@ class TestUtils(unittest.TestCase):
             except FileNotFoundError:
                 pass
 
+    def test_parse_meta_refresh_head_only(self):
+        root = tempfile.mkdtemp()
+        try:
+            file = os.path.join(root, 'refresh.htm')
+            with open(file, 'w', encoding='UTF-8') as fh:
+                fh.write('<html><head></head><body><meta http-equiv="refresh" content="0;url=target.html"></body></html>')
+
+            self.assertEqual(util.parse_meta_refresh(file), (0, 'target.html', None))
+            self.assertEqual(util.parse_meta_refresh(file, head_only=True), (None, None, None))
+        finally:
+            shutil.rmtree(root)
+
+    def test_meta_refresh_cache(self):
+        root = tempfile.mkdtemp()
+        try:
+            file = os.path.join(root, 'refresh.htm')
+            with open(file, 'w', encoding='UTF-8') as fh:
+                fh.write('<meta http-equiv="refresh" content="0;url=target.html">')
+
+            cache = util.MetaRefreshCache()
+            self.assertEqual(cache.parse(file), (0, 'target.html', None))
+            with mock.patch('webscrapbook.util.parse_meta_refresh') as mock_parse:
+                self.assertEqual(cache.parse(file), (0, 'target.html', None))
+                mock_parse.assert_not_called()
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            # a modified file gets a new key
+            with open(file, 'w', encoding='UTF-8') as fh:
+                fh.write('<meta http-equiv="refresh" content="0;url=target2.html">')
+            os.utime(file, ns=(0, 0))
+            self.assertEqual(cache.parse(file), (0, 'target2.html', None))
+
+            zip_filename = os.path.join(root, 'zipfile.zip')
+            with zipfile.ZipFile(zip_filename, 'w') as zh:
+                zh.writestr('refresh.htm', '<meta http-equiv="refresh" content="0;url=target.html">')
+
+            for _ in range(2):
+                with util.CachedZipFile(zip_filename) as zh:
+                    self.assertEqual(cache.parse_zip(zh, zh.getinfo('refresh.htm')), (0, 'target.html', None))
+            self.assertEqual((cache.hits, cache.misses), (2, 3))
+        finally:
+            shutil.rmtree(root)
+
     def test_parse_maff_index_rdf(self):
         maff_filename = os.path.join(root_dir, 'test_util', 'tempfile.maff')
         try:
@@ -56,6 +56,14 @@ class Config():
             'allowed_x_host': '0',
             'allowed_x_port': '0',
             'allowed_x_prefix': '0',
+            'archive_append': 'false',
+            'gzip_level': '6',
+            'gzip_min_size': '1024',
+            'gzip_cache_size': '104857600',
+            'token_backend': 'file',
+            'markdown_cache_size': '16777216',
+            'markdown_disk_cache_size': '0',
+            'server_timing': 'false',
             },
         'server': {
             'port': '8080',
@@ -65,6 +73,11 @@ class Config():
             'ssl_cert': '',
             'ssl_pw': '',
             'browse': 'true',
+            'engine': 'werkzeug',
+            'threads': '16',
+            'processes': '1',
+            'backlog': '128',
+            'keep_alive': '5',
             },
         'browser': {
             'command': '',
@@ -89,11 +102,22 @@ class Config():
             'allowed_x_host': 'getint',
             'allowed_x_port': 'getint',
             'allowed_x_prefix': 'getint',
+            'archive_append': 'getboolean',
+            'gzip_level': 'getint',
+            'gzip_min_size': 'getint',
+            'gzip_cache_size': 'getint',
+            'markdown_cache_size': 'getint',
+            'markdown_disk_cache_size': 'getint',
+            'server_timing': 'getboolean',
             },
         'server': {
             'port': 'getint',
             'ssl_on': 'getboolean',
             'browse': 'getboolean',
+            'threads': 'getint',
+            'processes': 'getint',
+            'backlog': 'getint',
+            'keep_alive': 'getint',
             },
         'browser': {
             'cache_expire': 'getint',
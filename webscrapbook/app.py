@@ -4,21 +4,27 @@ import os
 import traceback
 import shutil
 import io
-import mimetypes
 import re
 import zipfile
 import tempfile
 import time
 import json
 import functools
+import copy
+import hmac
+import hashlib
+import threading
+import heapq
+import bisect
+import sqlite3
 from urllib.parse import urlsplit, urlunsplit, urljoin, quote, unquote
 from zlib import adler32
 from contextlib import contextmanager
-from secrets import token_urlsafe
+from secrets import token_urlsafe, token_bytes
 
 # dependency
 import flask
-from flask import request, Response, redirect, abort, render_template
+from flask import request, Response, redirect, abort
 from flask import current_app
 from werkzeug.local import LocalProxy
 from werkzeug.middleware.proxy_fix import ProxyFix
@@ -28,6 +34,7 @@ from werkzeug.http import is_resource_modified
 from werkzeug.http import http_date
 from werkzeug.http import parse_options_header, dump_options_header
 from werkzeug.utils import cached_property
+from werkzeug.wsgi import wrap_file
 import jinja2
 import commonmark
 
@@ -40,7 +47,6 @@ from .scrapbook import host as wsb_host
 from .scrapbook import cache as wsb_cache
 from .scrapbook import check as wsb_check
 from ._compat.contextlib import nullcontext
-from ._compat import zip_stream
 
 # see: https://url.spec.whatwg.org/#percent-encoded-bytes
 quote_path = functools.partial(quote, safe=":/[]@!$&'()*+,;=")
@@ -50,8 +56,32 @@ bp = flask.Blueprint('default', __name__)
 host = LocalProxy(lambda: current_app.config['WEBSCRAPBOOK_HOST'])
 
 
+@contextmanager
+def timing(name):
+    """Record the time spent in the enclosed code as a phase of the current
+    request.
+
+    Can also be used as a function decorator. Does nothing unless
+    server_timing is enabled.
+    """
+    timings = flask.g.get('timings') if flask.has_request_context() else None
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+
 def static_url(path):
-    return f'{quote_path(request.script_root)}/{quote_path(path)}?a=static'
+    url = f'{quote_path(request.script_root)}/{quote_path(path)}?a=static'
+    digest = host.static_hashes.get(path)
+    if digest:
+        url += f'&v={digest}'
+    return url
 
 
 def static_file(filename, mimetype=None):
@@ -62,7 +92,32 @@ def static_file(filename, mimetype=None):
     """
     if not os.path.isfile(filename):
         abort(404)
-    response = flask.send_file(filename, conditional=True, mimetype=mimetype)
+
+    if mimetype is None:
+        mimetype = util.guess_mimetype(filename)
+
+    response = None
+    compressible = host.gzip_cache is not None and util.is_compressible(mimetype)
+
+    # send a cached gzip variant if the client accepts it
+    if compressible and 'Range' not in request.headers and request.accept_encodings['gzip']:
+        st = os.stat(filename)
+        gzfile = host.gzip_cache.get(filename, st)
+        if gzfile:
+            # the ETag of the gzip file is overwritten
+            response = flask.send_file(gzfile, mimetype=mimetype, last_modified=st.st_mtime)
+            response.set_etag('%s-%s-%s-gzip' % (
+                st.st_mtime, st.st_size,
+                adler32(filename.encode('utf-8', 'surrogatepass')) & 0xFFFFFFFF,
+                ))
+            response.headers.set('Content-Encoding', 'gzip')
+            response.make_conditional(request.environ)
+
+    if response is None:
+        response = flask.send_file(filename, conditional=True, mimetype=mimetype)
+
+    if compressible:
+        response.headers.set('Vary', 'Accept-Encoding')
     response.headers.set('Accept-Ranges', 'bytes')
     response.headers.set('Cache-Control', 'no-cache')
     if host.config['app']['content_security_policy'] == 'strict':
@@ -70,6 +125,7 @@ def static_file(filename, mimetype=None):
     return response
 
 
+@timing('zip-file')
 def zip_static_file(zip, subpath, mimetype=None):
     """Output the specified file in a ZIP to the client.
 
@@ -85,8 +141,6 @@ def zip_static_file(zip, subpath, mimetype=None):
     else:
         info = subpath
 
-    fh = zip.open(info, 'r')
-
     lm = util.zip_timestamp(info)
     last_modified = http_date(lm)
 
@@ -105,21 +159,57 @@ def zip_static_file(zip, subpath, mimetype=None):
     if host.config['app']['content_security_policy'] == 'strict':
         headers['Content-Security-Policy'] = "connect-src 'none'; form-action 'none';"
 
-    response = Response(fh, headers=headers, mimetype=mimetype)
+    if info.compress_type == zipfile.ZIP_DEFLATED:
+        headers['Vary'] = 'Accept-Encoding'
+
+        # send the compressed data as is if the client accepts gzip
+        if 'Range' not in request.headers and request.accept_encodings['gzip']:
+            fh = util.zip_open_gzip(zip, info)
+            if fh is not None:
+                headers['ETag'] = etag + '-gzip'
+                headers['Content-Encoding'] = 'gzip'
+                headers['Content-Length'] = len(fh)
+                response = Response(fh, headers=headers, mimetype=mimetype, direct_passthrough=True)
+                response.make_conditional(request.environ)
+                return response
+
+    # serve a STORED member directly from the ZIP file so that a range
+    # request seeks to the requested slice rather than reading through;
+    # for a large DEFLATED member, resume decompression from a checkpoint
+    fh = util.zip_open_stored(zip, info)
+    if fh is None and 'Range' in request.headers and info.file_size >= util.ZipDeflateIndex.MIN_SIZE:
+        fh = util.zip_open_deflated(zip, info)
+    if fh is not None:
+        headers['Content-Length'] = info.file_size
+        response = Response(wrap_file(request.environ, fh), headers=headers,
+            mimetype=mimetype, direct_passthrough=True)
+    else:
+        fh = zip.open(info, 'r')
+        response = Response(fh, headers=headers, mimetype=mimetype)
+
     response.make_conditional(request.environ, accept_ranges=True, complete_length=info.file_size)
     return response
 
 
+@timing('render')
+def render_template(template_name, **context):
+    return flask.render_template(template_name, **context)
+
+
 def stream_template(template_name, **context):
     current_app.update_template_context(context)
     t = current_app.jinja_env.get_template(template_name)
     return t.stream(context)
 
 
-def http_response(body='', status=None, headers=None, format=None):
+def http_response(body='', status=None, headers=None, format=None, meta=None):
     """Handle formatted response.
 
     ref: https://jsonapi.org
+
+    Args:
+        meta: a JSON-serializable object of extra information for the
+            'json' format
     """
     if not format:
         mimetype = None
@@ -133,6 +223,9 @@ def http_response(body='', status=None, headers=None, format=None):
             'data': body,
             }
 
+        if meta is not None:
+            body['meta'] = meta
+
         body = json.dumps(body, ensure_ascii=False)
 
     # expect body to be a generator of text (mostly JSON) data
@@ -153,12 +246,28 @@ def http_response(body='', status=None, headers=None, format=None):
 
         body = wrapper(body)
 
+    # expect body to be a generator of JSON text data, one for each line
+    elif format == 'ndjson':
+        mimetype = 'application/x-ndjson'
+
+        def wrapper(gen):
+            try:
+                for data in gen:
+                    yield data + "\n"
+            except Exception:
+                traceback.print_exc()
+                err = {'error': {'message': 'Internal Server Error'}}
+                yield json.dumps(err, ensure_ascii=False) + "\n"
+
+        body = wrapper(body)
+
     else:
         abort(400, f'Output format "{format}" is not supported.')
 
     return Response(body, status, headers, mimetype=mimetype)
 
 
+@timing('archive-path')
 def get_archive_path(filepath):
     """Parse archive file path and the sub-archive path.
 
@@ -182,7 +291,7 @@ def get_archive_path(filepath):
         # if parent directory does not exist, FileNotFoundError is raised on
         # Windows, while NotADirectoryError is raised on Linux
         try:
-            zip = zipfile.ZipFile(archivefile, 'r')
+            zip = util.CachedZipFile(archivefile)
         except (zipfile.BadZipFile, FileNotFoundError, NotADirectoryError):
             pass
         else:
@@ -191,15 +300,13 @@ def get_archive_path(filepath):
                     for m in reversed(list(re.finditer(r'!/', filepath, flags=re.I))):
                         archivepath = filepath[:m.start(0)]
                         conflicting = archivepath + '!/'
-                        if any(i.startswith(conflicting) for i in zp.namelist()):
+                        if util.zip_hasdir(zp, conflicting):
                             break
                         try:
-                            with zp.open(archivepath, 'r') as f:
-                                f = zip_stream(f)
-                                with zipfile.ZipFile(f, 'r') as zip:
-                                    rv.append(archivepath)
-                                    get_subpath(zip, filepath[m.end(0):])
-                                    return
+                            with util.nested_zip_cache.open(zp, archivepath) as zip:
+                                rv.append(archivepath)
+                                get_subpath(zip, filepath[m.end(0):])
+                                return
                         except (KeyError, zipfile.BadZipFile):
                             pass
                     rv.append(filepath.rstrip('/'))
@@ -226,22 +333,40 @@ def open_archive_path(paths, mode='r', filters=None):
 
     filtered = False
     stack = []
+    buffers = []
     try:
-        zip = zipfile.ZipFile(paths[0])
-        stack.append(zip)
-        for i in range(1, last):
-            f = zip.open(paths[i])
-            f = zip_stream(f)
-            stack.append(f)
-            zip = zipfile.ZipFile(f)
+        with timing('archive-open'):
+            # the central directory can be shared by readers, but not a writer
+            # which modifies the ZipInfo objects
+            zip = util.CachedZipFile(paths[0]) if mode == 'r' else zipfile.ZipFile(paths[0])
             stack.append(zip)
+            for i in range(1, last):
+                if mode == 'r':
+                    zip = util.nested_zip_cache.open(zip, paths[i])
+                    stack.append(zip)
+                    continue
+
+                # extract to a temp file so that the members can be copied
+                # without seeking through a decompressing stream
+                f = tempfile.TemporaryFile()
+                stack.append(f)
+                with zip.open(paths[i]) as fr:
+                    shutil.copyfileobj(fr, f)
+                f.seek(0)
+                zip = zipfile.ZipFile(f)
+                stack.append(zip)
 
         if mode == 'r':
             yield zip
 
         elif mode == 'w':
-            # create a buffer for writing
-            buffer = io.BytesIO()
+            # replace the real file rather than a symlink to it
+            target = os.path.realpath(paths[0])
+
+            # create a buffer for writing; the buffer for the outermost zip
+            # is a temp file next to it to be renamed atomically
+            buffer = _open_archive_buffer(target if last == 1 else None)
+            buffers.append(buffer)
             with zipfile.ZipFile(buffer, 'w') as zip:
                 yield zip
 
@@ -263,14 +388,7 @@ def open_archive_path(paths, mode='r', filters=None):
                         else:
                             continue
 
-                        try:
-                            zip.writestr(info, zip0.read(info),
-                                    compress_type=info.compress_type,
-                                    compresslevel=None if info.compress_type == zipfile.ZIP_STORED else 9)
-                        except TypeError:
-                            # compresslevel is supported since Python 3.7
-                            zip.writestr(info, zip0.read(info),
-                                    compress_type=info.compress_type)
+                        util.zip_copy_member(zip0, info, zip)
 
                 if filters and not filtered:
                     raise KeyError('paths to filter do not exist')
@@ -279,28 +397,62 @@ def open_archive_path(paths, mode='r', filters=None):
                     break
 
                 # writer to another buffer for the parent zip
-                buffer2 = io.BytesIO()
+                buffer2 = _open_archive_buffer(target if i == 2 else None)
+                buffers.append(buffer2)
+                buffer.seek(0, io.SEEK_END)
+                info = zipfile.ZipInfo(paths[i - 1], time.localtime(time.time())[:6])
+                info.external_attr = 0o600 << 16
+                info.file_size = buffer.tell()
+                buffer.seek(0)
                 with zipfile.ZipFile(buffer2, 'w') as zip:
-                    zip.writestr(paths[i - 1], buffer.getvalue(), compress_type=zipfile.ZIP_STORED)
-                buffer.close()
+                    with zip.open(info, 'w') as fw:
+                        shutil.copyfileobj(buffer, fw)
+                buffers.remove(buffer)
+                _close_archive_buffer(buffer)
                 buffer = buffer2
 
                 # pop a file handler
                 stack.pop()
 
-            # write to the outermost zip
-            # use 'r+b' as 'wb' causes PermissionError for hidden file in Windows
-            buffer.seek(0)
-            with open(paths[0], 'r+b') as fw, buffer as fr:
-                fw.truncate()
-                while True:
-                    chunk = fr.read(8192)
-                    if not chunk: break
-                    fw.write(chunk)
+            # replace the outermost zip
+            buffers.remove(buffer)
+            buffer.close()
+            util.file_replace(buffer.name, target)
     finally:
         for f in reversed(stack):
             f.close()
 
+        for f in buffers:
+            _close_archive_buffer(f)
+
+        if mode == 'w':
+            util.zip_cache_invalidate(paths[0])
+
+
+def _open_archive_buffer(path=None):
+    """Open a temp file for rewriting an archive.
+
+    Args:
+        path: path of the archive file to be replaced by the temp file, or
+            None for an anonymous temp file.
+    """
+    if path is None:
+        return tempfile.TemporaryFile()
+
+    dirname, basename = os.path.split(path)
+    return tempfile.NamedTemporaryFile(
+        prefix=f'.{basename}.', suffix='.tmp', dir=dirname, delete=False)
+
+
+def _close_archive_buffer(buffer):
+    buffer.close()
+    name = getattr(buffer, 'name', None)
+    if isinstance(name, str):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
 
 def is_local_access():
     """Determine if the client is in same device.
@@ -310,28 +462,232 @@ def is_local_access():
     return util.is_localhost(server_host) or util.is_localhost(client_host) or server_host == client_host
 
 
+class AuthTable:
+    """Auth config compiled for credential verification.
+
+    Entries are indexed by user name. A successful verification is cached
+    for a while, keyed by a keyed digest of the credentials rather than the
+    plain password, so that a page with many subresources does not re-hash
+    the password for each request.
+    """
+    CACHE_SIZE = 1024
+    CACHE_TTL = 300  # in seconds
+
+    def __init__(self, auth_config):
+        self.entries = {}
+        for _, entry in auth_config.items():
+            self.entries.setdefault(entry.get('user', ''), []).append((
+                entry.get('pw', ''),
+                entry.get('pw_salt', ''),
+                entry.get('pw_type', ''),
+                entry.get('permission', 'all'),
+                ))
+
+        self._key = token_bytes(32)
+        self._cache = util.LRUCache(max_entries=self.CACHE_SIZE)
+
+    def get_permission(self, user, pw, now=None):
+        entries = self.entries.get(user)
+        if not entries:
+            return ''
+
+        if now is None:
+            now = time.time()
+
+        key = hmac.new(self._key, f'{user}\0{pw}'.encode('UTF-8', 'surrogatepass'), 'sha256').digest()
+        permission = self._cache.get(key, now=now)
+        if permission is not None:
+            return permission
+
+        for entry_pw, entry_pw_salt, entry_pw_type, entry_permission in entries:
+            if util.encrypt(pw, entry_pw_salt, entry_pw_type) != entry_pw:
+                continue
+
+            self._cache.set(key, entry_permission, expire=now + self.CACHE_TTL)
+            return entry_permission
+
+        return ''
+
+
+class ListingCache(util.LRUCache):
+    """Short-lived cache of fingerprints of directory listings.
+
+    A fingerprint covers the names, mtimes, and sizes of the listed entries,
+    and is reused without a rescan while the directory mtime is unchanged and
+    the cache is not expired. A change of a descendant file that does not
+    touch the directory mtime is thus reflected only after TTL.
+    """
+    TTL = 3  # in seconds
+    MAX_ENTRIES = 1024
+
+    def __init__(self):
+        super().__init__(max_entries=self.MAX_ENTRIES)
+
+    def get_fingerprint(self, path, recursive, stats, now=None):
+        """Get the cached fingerprint, or None if not available."""
+        return self.get((path, bool(recursive), stats.st_mtime_ns, stats.st_ino), now=now)
+
+    def set_fingerprint(self, path, recursive, stats, etag, now=None):
+        if now is None:
+            now = time.time()
+
+        self.set((path, bool(recursive), stats.st_mtime_ns, stats.st_ino), etag, expire=now + self.TTL)
+
+    @staticmethod
+    def fingerprint(stats, subentries):
+        """Calculate the fingerprint of a directory from its listed entries."""
+        h = hashlib.md5(f'{stats.st_mtime_ns}'.encode('ASCII'))
+        for entry in subentries:
+            h.update(f'\0{entry.name}\0{entry.type}\0{entry.size}\0{entry.last_modified}'.encode('UTF-8', 'surrogatepass'))
+        return h.hexdigest()
+
+
+class TimingStats:
+    """Histograms of the time spent in each phase of requests, per action.
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # in seconds
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def observe(self, action, phase, seconds):
+        key = (action, phase)
+        i = bisect.bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            try:
+                counts, stat = self._stats[key]
+            except KeyError:
+                counts, stat = self._stats[key] = ([0] * (len(self.BUCKETS) + 1), [0, 0.0])
+            counts[i] += 1
+            stat[0] += 1
+            stat[1] += seconds
+
+    def snapshot(self):
+        """Get a copy of the current histograms.
+
+        Returns:
+            dict: (action, phase) => (counts, count, sum), where counts[i] is
+                the number of observations within (BUCKETS[i - 1], BUCKETS[i]]
+                and the last one is for those beyond the last bucket.
+        """
+        with self._lock:
+            return {key: (list(counts), stat[0], stat[1])
+                    for key, (counts, stat) in self._stats.items()}
+
+
+class Metrics:
+    """Counters and request durations of the server.
+    """
+    def __init__(self):
+        self.durations = TimingStats()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self):
+        """Get a copy of the current counters.
+
+        Returns:
+            dict: (name, ((label, value), ...)) => count
+        """
+        with self._lock:
+            return dict(self._counters)
+
+
+def format_metrics(host):
+    """Format the metrics of a WebHost in Prometheus text format.
+    """
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def sample(name, value, labels=()):
+        if labels:
+            name += '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels) + '}'
+        return f'{name} {value}'
+
+    def header(name, type, help):
+        yield f'# HELP {name} {help}'
+        yield f'# TYPE {name} {type}'
+
+    def histogram(name, help, stats, label_names):
+        yield from header(name, 'histogram', help)
+        for key, (counts, count, sum) in sorted(stats.items()):
+            labels = tuple(zip(label_names, key))
+            cumulative = 0
+            for le, c in zip(TimingStats.BUCKETS + ('+Inf',), counts):
+                cumulative += c
+                yield sample(f'{name}_bucket', cumulative, labels + (('le', le),))
+            yield sample(f'{name}_sum', sum, labels)
+            yield sample(f'{name}_count', count, labels)
+
+    counters = host.metrics.snapshot()
+
+    yield from header('webscrapbook_requests_total', 'counter', 'Number of handled requests.')
+    for (name, labels), value in sorted(counters.items()):
+        if name == 'requests':
+            yield sample('webscrapbook_requests_total', value, labels)
+
+    yield from histogram('webscrapbook_request_duration_seconds', 'Time spent handling requests.',
+        {(action,): v for (action, _), v in host.metrics.durations.snapshot().items()}, ('action',))
+
+    if host.timing_stats is not None:
+        yield from histogram('webscrapbook_request_phase_seconds', 'Time spent in each phase of requests.',
+            host.timing_stats.snapshot(), ('action', 'phase'))
+
+    yield from header('webscrapbook_tokens_total', 'counter', 'Number of token operations.')
+    for (name, labels), value in sorted(counters.items()):
+        if name == 'tokens':
+            yield sample('webscrapbook_tokens_total', value, labels)
+
+    caches = {
+        'listing': host.listing_cache,
+        'markdown': host.markdown_cache,
+        'gzip': host.gzip_cache,
+        'zip_dir': util.zip_dir_cache,
+        'zip_dir_trie': util.zip_dir_trie_cache,
+        'zip_deflate_index': util.zip_deflate_index_cache,
+        'nested_zip': util.nested_zip_cache,
+        'meta_refresh': util.meta_refresh_cache,
+        }
+    caches = {k: v for k, v in caches.items() if v is not None}
+    yield from header('webscrapbook_cache_hits_total', 'counter', 'Number of cache hits.')
+    for name, cache in caches.items():
+        yield sample('webscrapbook_cache_hits_total', cache.hits, (('cache', name),))
+    yield from header('webscrapbook_cache_misses_total', 'counter', 'Number of cache misses.')
+    for name, cache in caches.items():
+        yield sample('webscrapbook_cache_misses_total', cache.misses, (('cache', name),))
+
+    stats = wsb_host.file_lock_stats
+    yield from header('webscrapbook_lock_acquisitions_total', 'counter', 'Number of lock acquisition attempts.')
+    yield sample('webscrapbook_lock_acquisitions_total', stats.acquired, (('result', 'acquired'),))
+    yield sample('webscrapbook_lock_acquisitions_total', stats.timeouts, (('result', 'timeout'),))
+    yield sample('webscrapbook_lock_acquisitions_total', stats.errors, (('result', 'error'),))
+    yield from header('webscrapbook_lock_wait_seconds_total', 'counter', 'Time spent waiting for locks.')
+    yield sample('webscrapbook_lock_wait_seconds_total', stats.wait_seconds)
+
+    yield from header('webscrapbook_zip_open_handles', 'gauge', 'Number of currently opened ZIP files.')
+    yield sample('webscrapbook_zip_open_handles', util.CachedZipFile.open_count)
+
+
+@timing('auth')
 def get_permission(auth_info, auth_config):
     """Calculate effective permission from provided auth info and config.
+
+    Args:
+        auth_config: the auth config, or an AuthTable compiled from it
     """
+    if not isinstance(auth_config, AuthTable):
+        auth_config = AuthTable(auth_config)
+
     auth = auth_info or {}
     user = auth.get('username') or ''
     pw = auth.get('password') or ''
-
-    for _, entry in auth_config.items():
-        entry_user = entry.get('user', '')
-        if user != entry_user:
-            continue
-
-        entry_pw = entry.get('pw', '')
-        entry_pw_salt = entry.get('pw_salt', '')
-        entry_pw_type = entry.get('pw_type', '')
-        if util.encrypt(pw, entry_pw_salt, entry_pw_type) != entry_pw:
-            continue
-
-        entry_permission = entry.get('permission', 'all')
-        return entry_permission
-
-    return ''
+    return auth_config.get_permission(user, pw)
 
 
 def verify_authorization(perm, action):
@@ -349,13 +705,18 @@ def verify_authorization(perm, action):
     return False
 
 
-def handle_directory_listing(paths, zip=None, redirect_slash=True, recursive=False, format=None):
+def handle_directory_listing(paths, zip=None, redirect_slash=True, recursive=False, format=None,
+        cursor=None, limit=None):
     """List contents in a directory.
 
     Args:
         paths: [path-to-zip-file, subpath1, subpath2, ...]
         zip: an opened zipfile.ZipFile object for faster reading
+        cursor: list entries after the entry of this name, in name order
+        limit: max number of entries to list, in name order
     """
+    paged = cursor is not None or limit is not None
+
     # ensure directory has trailing '/'
     if redirect_slash and not request.path.endswith('/'):
         parts = urlsplit(request.url)
@@ -389,20 +750,53 @@ def handle_directory_listing(paths, zip=None, redirect_slash=True, recursive=Fal
             }
 
         with nullcontext(zip) if zip else open_archive_path(paths) as zip:
-            subentries = util.zip_listdir(zip, paths[-1], recursive)
+            if paged:
+                subentries = list(util.zip_listdir_paged(zip, paths[-1], recursive, cursor, limit))
+            else:
+                subentries = util.zip_listdir(zip, paths[-1], recursive)
 
-    else:
-        # disallow cache to reflect any content file change
+    elif paged or recursive or format in ('sse', 'ndjson'):
+        # disallow cache to reflect any content file change, as a fingerprint
+        # would require a scan of all entries rather than those to list
         stats = os.stat(paths[0])
         headers = {
             'Cache-Control': 'no-store',
             'Last-Modified': http_date(stats.st_mtime),
             }
 
-        subentries = util.listdir(paths[0], recursive)
+        if paged:
+            subentries = util.listdir_paged(paths[0], recursive, cursor, limit)
+        else:
+            subentries = util.listdir(paths[0], recursive)
 
-    if format == 'sse':
+    else:
+        # Directory mtime does not reflect changes of content files, so a
+        # fingerprint of the listed entries is used as the validator.
+        stats = os.stat(paths[0])
+        subentries = None
+        etag = host.listing_cache.get_fingerprint(paths[0], recursive, stats)
+        if etag is None:
+            # take the fingerprint from the entries to list to save a rescan
+            subentries = list(util.listdir(paths[0], recursive))
+            etag = host.listing_cache.fingerprint(stats, subentries)
+            host.listing_cache.set_fingerprint(paths[0], recursive, stats, etag)
+
+        if not is_resource_modified(request.environ, etag=etag):
+            return http_response(status=304, format=format)
+
+        headers = {
+            'Cache-Control': 'no-cache',
+            'Last-Modified': http_date(stats.st_mtime),
+            'ETag': etag,
+            }
+
+        if subentries is None:
+            subentries = util.listdir(paths[0], recursive)
+
+    if format in ('sse', 'ndjson'):
         def gen():
+            name = None
+            count = 0
             for entry in subentries:
                 data = {
                     'name': entry.name,
@@ -411,8 +805,15 @@ def handle_directory_listing(paths, zip=None, redirect_slash=True, recursive=Fal
                     'last_modified': entry.last_modified,
                     }
 
+                name = entry.name
+                count += 1
                 yield json.dumps(data, ensure_ascii=False)
 
+            if paged:
+                # end with the cursor for the next page, like the 'json' format
+                next_cursor = name if limit is not None and count >= limit else None
+                yield json.dumps({'meta': {'next_cursor': next_cursor}}, ensure_ascii=False)
+
         return http_response(gen(), headers=headers, format=format)
 
     if format == 'json':
@@ -424,7 +825,14 @@ def handle_directory_listing(paths, zip=None, redirect_slash=True, recursive=Fal
                     'size': entry.size,
                     'last_modified': entry.last_modified,
                     })
-        return http_response(data, headers=headers, format=format)
+
+        meta = None
+        if paged:
+            # the name of the last entry is the cursor for the next page
+            next_cursor = data[-1]['name'] if data and limit is not None and len(data) >= limit else None
+            meta = {'next_cursor': next_cursor}
+
+        return http_response(data, headers=headers, format=format, meta=meta)
 
     body = render_template('index.html',
             sitename=host.name,
@@ -533,12 +941,20 @@ def handle_markdown_output(paths, zip=None):
             headers['Content-Security-Policy'] = "connect-src 'none'; form-action 'none';"
 
         # prepare content
-        if zip:
-            with zip.open(info) as f:
-                body = f.read().decode('UTF-8')
-        else:
-            with open(paths[0], 'r', encoding='UTF-8') as f:
-                body = f.read()
+        cache = host.markdown_cache
+        key = '\0'.join(paths) + '\0' + etag
+        content = cache.get(key) if cache is not None else None
+        if content is None:
+            if zip:
+                with zip.open(info) as f:
+                    body = f.read().decode('UTF-8')
+            else:
+                with open(paths[0], 'r', encoding='UTF-8') as f:
+                    body = f.read()
+
+            content = commonmark.commonmark(body)
+            if cache is not None:
+                cache.set(key, content)
 
     body = render_template('markdown.html',
             sitename=host.name,
@@ -546,7 +962,7 @@ def handle_markdown_output(paths, zip=None):
             base=request.script_root,
             path=request.path,
             pathparts=request.paths,
-            content=commonmark.commonmark(body),
+            content=content,
             )
 
     return http_response(body, headers=headers)
@@ -580,7 +996,7 @@ class Request(flask.Request):
     @cached_property
     def localmimetype(self):
         """Mimetype of the requested path."""
-        mimetype, _ = mimetypes.guess_type(self.localrealpath)
+        mimetype = util.guess_mimetype(self.localrealpath)
         return mimetype
 
     @cached_property
@@ -649,7 +1065,12 @@ def handle_action_writing(func):
         if os.path.abspath(request.localpath) == host.chroot:
             abort(403, "Unable to operate the root directory.")
 
-        return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # a ZIP file may be modified in place, whose mtime may not change
+            # if modified rapidly
+            util.zip_cache_invalidate(request.localpaths[0])
 
     return wrapper
 
@@ -744,8 +1165,7 @@ def action_view():
 
                 # convert meta refresh to 302 redirect
                 if localpaths[-1].lower().endswith('.htm'):
-                    with zip.open(info) as fh:
-                        target = util.parse_meta_refresh(fh).target
+                    target = util.meta_refresh_cache.parse_zip(zip, info).target
 
                     if target is not None:
                         # Keep several chars as javascript encodeURI do,
@@ -781,7 +1201,7 @@ def action_view():
 
             # convert meta refresh to 302 redirect
             if request.localrealpath.lower().endswith('.htm'):
-                target = util.parse_meta_refresh(localpath).target
+                target = util.meta_refresh_cache.parse(localpath).target
 
                 if target is not None:
                     # Keep several chars as javascript encodeURI do,
@@ -890,16 +1310,27 @@ def action_list():
         abort(400, "Action not supported.")
 
     recursive = request.values.get('recursive', type=bool)
+    cursor = request.values.get('cursor')
+    limit = request.values.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            abort(400, "Limit must be a positive integer.")
     localpaths = request.localpaths
 
     if len(localpaths) > 1:
         try:
-            return handle_directory_listing(localpaths, redirect_slash=False, recursive=recursive, format=format)
+            return handle_directory_listing(localpaths, redirect_slash=False, recursive=recursive, format=format,
+                cursor=cursor, limit=limit)
         except util.ZipDirNotFoundError:
             abort(404, "Directory does not exist.")
 
     if os.path.isdir(localpaths[0]):
-        return handle_directory_listing(localpaths, redirect_slash=False, recursive=recursive, format=format)
+        return handle_directory_listing(localpaths, redirect_slash=False, recursive=recursive, format=format,
+            cursor=cursor, limit=limit)
 
     abort(404, "Directory does not exist.")
 
@@ -914,7 +1345,14 @@ def action_static():
     filepath = request.path.strip('/')
     file = host.get_static_file(filepath)
     if file:
-        return static_file(file)
+        response = static_file(file)
+
+        # a versioned URL never changes its content and can be cached forever
+        digest = request.args.get('v')
+        if digest and digest == host.static_hashes.get(filepath):
+            response.headers.set('Cache-Control', 'public, max-age=31536000, immutable')
+
+        return response
 
     abort(404)
 
@@ -1068,6 +1506,19 @@ def action_config():
     return http_response(data, format=format)
 
 
+def action_metrics():
+    """Show server metrics in Prometheus text format."""
+    format = request.format
+
+    if format:
+        abort(400, "Action not supported.")
+
+    body = ''.join(f'{line}\n' for line in format_metrics(host))
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8', headers={
+        'Cache-Control': 'no-store',
+        })
+
+
 def action_token():
     """Acquire a token and return its name."""
     format = request.format
@@ -1268,6 +1719,7 @@ def action_save():
     if len(localpaths) > 1:
         try:
             zip = None
+            appended = False
 
             # append for a nonexistent path in a non-nested zip
             if len(localpaths) == 2:
@@ -1280,12 +1732,19 @@ def action_save():
                     zip0.close()
                     raise
                 else:
-                    zip0.close()
+                    if host.config['app']['archive_append']:
+                        # append the new version and leave the old one as
+                        # dead space, which is reclaimed by compaction
+                        zip = zip0
+                        appended = True
+                    else:
+                        zip0.close()
 
             if zip is None:
                 zip = open_archive_path(localpaths, 'w')
 
-            with zip as zip:
+            with zip as zip, \
+                    util.zip_tombstone(zip, localpaths[-1]) if appended else nullcontext():
                 info = zipfile.ZipInfo(localpaths[-1], time.localtime())
                 file = request.files.get('upload')
                 if file is not None:
@@ -1306,6 +1765,13 @@ def action_save():
             traceback.print_exc()
             abort(500, "Unable to write to this ZIP file.")
 
+        if appended:
+            try:
+                util.zip_compact(localpaths[0])
+            except Exception:
+                # the file has been saved anyway
+                traceback.print_exc()
+
     else:
         localpath = localpaths[0]
 
@@ -1424,7 +1890,7 @@ def action_move(sourcepaths, targetpaths):
                     with open_archive_path(targetpaths, 'w') as zip2:
                         cut = len(sourcepaths[-1])
                         for entry in entries:
-                            info = zip.getinfo(entry)
+                            info = copy.copy(zip.getinfo(entry))
                             info.filename = targetpaths[-1] + entry[cut:]
                             try:
                                 zip2.writestr(info, zip.read(entry),
@@ -1503,7 +1969,7 @@ def action_copy(sourcepaths, targetpaths):
                                 dst = src[base_cut:]
                                 if os.sep != '/': dst = dst.replace(os.sep, '/')
                                 dst = targetpaths[-1] + '/' + dst
-                                compressible = util.is_compressible(mimetypes.guess_type(dst)[0])
+                                compressible = util.mime_info(dst).is_compressible
                                 compress_type = zipfile.ZIP_DEFLATED if compressible else zipfile.ZIP_STORED
                                 compresslevel = 9 if compressible else None
                                 try:
@@ -1571,7 +2037,7 @@ def action_copy(sourcepaths, targetpaths):
                     with open_archive_path(targetpaths, 'w') as zip2:
                         cut = len(sourcepaths[-1])
                         for entry in entries:
-                            info = zip.getinfo(entry)
+                            info = copy.copy(zip.getinfo(entry))
                             info.filename = targetpaths[-1] + entry[cut:]
                             try:
                                 zip2.writestr(info, zip.read(entry),
@@ -1696,6 +2162,10 @@ def action_check():
 
 @bp.before_request
 def handle_before_request():
+    flask.g.request_start = time.perf_counter()
+    if host.timing_stats is not None:
+        flask.g.timings = {}
+
     # replace SCRIPT_NAME with the custom if set
     if host.config['app']['base']:
         # Flask treats SCRIPT_NAME in the same way as PATH_INFO, which is an
@@ -1703,13 +2173,11 @@ def handle_before_request():
         request.environ['SCRIPT_NAME'] = unquote(host.config['app']['base']).encode('UTF-8').decode('ISO-8859-1')
 
     # handle authorization
-    try:
-        auth_config = host.config['auth']
-    except KeyError:
+    if host.auth is None:
         # auth not required
         return
 
-    perm = get_permission(request.authorization, auth_config)
+    perm = get_permission(request.authorization, host.auth)
     if not verify_authorization(perm, request.action):
         auth = WWWAuthenticate()
         auth.set_basic(host.config['app']['name'])
@@ -1730,6 +2198,25 @@ def handle_request(filepath=''):
 
 @bp.after_request
 def handle_after_request(response):
+    # aggregate unknown actions under one label, as the action is provided by
+    # the client
+    action = request.action
+    if f'action_{action}' not in globals():
+        action = 'unknown'
+
+    elapsed = time.perf_counter() - flask.g.request_start
+    host.metrics.inc('requests', action=action, status=str(response.status_code))
+    host.metrics.durations.observe(action, 'total', elapsed)
+
+    # report and aggregate the time spent in each phase
+    timings = flask.g.get('timings')
+    if timings is not None:
+        timings['total'] = elapsed
+        response.headers.set('Server-Timing', ', '.join(
+            f'{phase};dur={seconds * 1000:.3f}' for phase, seconds in timings.items()))
+        for phase, seconds in timings.items():
+            host.timing_stats.observe(action, phase, seconds)
+
     # forbid a privileged page to be framed
     if host.config['app']['content_security_policy'] == 'strict':
         if 'Content-Security-Policy' not in response.headers:
@@ -1757,9 +2244,157 @@ def handle_error(exc):
     return exc
 
 
+class FileTokenStore:
+    """Token store that saves each token as a file under a directory.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def add(self, expire):
+        token = token_urlsafe()
+        token_file = os.path.join(self.root, token)
+        while os.path.lexists(token_file):
+            token = token_urlsafe()
+            token_file = os.path.join(self.root, token)
+
+        os.makedirs(os.path.dirname(token_file), exist_ok=True)
+        with open(token_file, 'w', encoding='UTF-8') as f:
+            f.write(str(expire))
+
+        return token
+
+    def get(self, token):
+        token_file = os.path.join(self.root, token)
+
+        try:
+            with open(token_file, 'r', encoding='UTF-8') as f:
+                return int(f.read())
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+
+    def delete(self, token):
+        token_file = os.path.join(self.root, token)
+
+        try:
+            os.remove(token_file)
+        except OSError:
+            pass
+
+    def delete_expire(self, now):
+        try:
+            token_files = os.scandir(self.root)
+        except FileNotFoundError:
+            pass
+        else:
+            for token_file in token_files:
+                try:
+                    with open(token_file, 'r', encoding='UTF-8') as f:
+                        expire = int(f.read())
+                except (OSError, ValueError):
+                    continue
+                if now >= expire:
+                    os.remove(token_file)
+
+
+class MemoryTokenStore:
+    """Token store that keeps tokens in the memory of the current process.
+
+    Expired tokens are purged from a heap ordered by expire time, so that a
+    purge costs only for the expired ones.
+    """
+    def __init__(self):
+        self._tokens = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def add(self, expire):
+        with self._lock:
+            token = token_urlsafe()
+            while token in self._tokens:
+                token = token_urlsafe()
+
+            self._tokens[token] = expire
+            heapq.heappush(self._heap, (expire, token))
+
+        return token
+
+    def get(self, token):
+        return self._tokens.get(token)
+
+    def delete(self, token):
+        with self._lock:
+            self._tokens.pop(token, None)
+
+    def delete_expire(self, now):
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expire, token = heapq.heappop(self._heap)
+                if self._tokens.get(token) == expire:
+                    del self._tokens[token]
+
+            # rebuild if the heap is mostly filled with deleted tokens
+            if len(self._heap) > 2 * len(self._tokens) + 64:
+                self._heap = [(expire, token) for token, expire in self._tokens.items()]
+                heapq.heapify(self._heap)
+
+
+class SqliteTokenStore:
+    """Token store that saves tokens in an SQLite database.
+
+    The database can be shared by multiple processes. A connection is opened
+    for each thread (and each forked process) on demand.
+    """
+    TIMEOUT = 10  # in seconds
+
+    def __init__(self, file):
+        self.file = file
+        self._local = threading.local()
+
+    def _connect(self):
+        local = self._local
+        pid = os.getpid()
+        if getattr(local, 'pid', None) == pid:
+            return local.conn
+
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        conn = sqlite3.connect(self.file, timeout=self.TIMEOUT, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS tokens (token TEXT PRIMARY KEY, expire INTEGER NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS tokens_expire ON tokens (expire)')
+        local.conn = conn
+        local.pid = pid
+        return conn
+
+    def add(self, expire):
+        conn = self._connect()
+        while True:
+            token = token_urlsafe()
+            try:
+                conn.execute('INSERT INTO tokens (token, expire) VALUES (?, ?)', (token, expire))
+            except sqlite3.IntegrityError:
+                continue
+            return token
+
+    def get(self, token):
+        row = self._connect().execute('SELECT expire FROM tokens WHERE token = ?', (token,)).fetchone()
+        return row[0] if row else None
+
+    def delete(self, token):
+        self._connect().execute('DELETE FROM tokens WHERE token = ?', (token,))
+
+    def delete_expire(self, now):
+        self._connect().execute('DELETE FROM tokens WHERE expire <= ?', (now,))
+
+
 class WebHost(wsb_host.Host):
     """Extended Host class that also handles HTTP server related things.
 
+    - Auth handling: compiled auth config for credential verification.
+    - Listing handling: validators for directory listings.
+    - Markdown handling: cache of rendered markdown files.
+    - Static handling: content hashes for versioned static file URLs.
+    - Timing handling: histograms of the time spent in request phases.
+    - Metrics handling: counters of requests and tokens.
     - Token handling: security token validation to avoid CSRF attack.
     """
     TOKEN_PURGE_INTERVAL = 3600  # in seconds
@@ -1768,71 +2403,103 @@ class WebHost(wsb_host.Host):
     def __init__(self, root, config=None):
         super().__init__(root, config=config)
 
+        # auth handling
+        try:
+            self.auth = AuthTable(self.config['auth'])
+        except KeyError:
+            self.auth = None
+
+        # listing handling
+        self.listing_cache = ListingCache()
+
+        # markdown handling
+        if self.config['app']['markdown_cache_size'] > 0:
+            disk_size = self.config['app']['markdown_disk_cache_size']
+            self.markdown_cache = util.TextCache(
+                max_size=self.config['app']['markdown_cache_size'],
+                root=os.path.join(self.cache, 'markdown') if disk_size > 0 else None,
+                max_disk_size=disk_size,
+                )
+        else:
+            self.markdown_cache = None
+
+        # timing handling
+        self.timing_stats = TimingStats() if self.config['app']['server_timing'] else None
+        self.metrics = Metrics()
+
+        # static handling
+        self.static_hashes = self.hash_static_files()
+
         # token handling
         self.tokens = os.path.join(self.root, WSB_DIR, 'server', 'tokens')
         self.token_last_purge = 0
 
+        backend = self.config['app']['token_backend']
+        if backend == 'file':
+            self.token_store = FileTokenStore(self.tokens)
+        elif backend == 'memory':
+            self.token_store = MemoryTokenStore()
+        elif backend == 'sqlite':
+            self.token_store = SqliteTokenStore(self.tokens + '.sqlite')
+        else:
+            raise ValueError(f'Unsupported token backend: "{backend}"')
+
+    def hash_static_files(self):
+        """Calculate content hashes of the static files of the theme.
+
+        Returns:
+            dict: path => hash, for each file that get_static_file() resolves
+                to.
+        """
+        hashes = {}
+        for static in self.statics:
+            for root, dirs, files in os.walk(static):
+                for name in files:
+                    file = os.path.join(root, name)
+                    path = os.path.relpath(file, static).replace(os.sep, '/')
+                    if path in hashes:
+                        continue
+                    try:
+                        hashes[path] = util.checksum(file)[:16]
+                    except OSError:
+                        hashes[path] = None
+        return hashes
+
     def token_acquire(self, now=None):
         if now is None:
             now = int(time.time())
 
         self.token_check_delete_expire(now)
 
-        token = token_urlsafe()
-        token_file = os.path.join(self.tokens, token)
-        while os.path.lexists(token_file):
-            token = token_urlsafe()
-            token_file = os.path.join(self.tokens, token)
-
-        os.makedirs(os.path.dirname(token_file), exist_ok=True)
-        with open(token_file, 'w', encoding='UTF-8') as f:
-            f.write(str(now + self.TOKEN_DEFAULT_EXPIRY))
-
-        return token
+        self.metrics.inc('tokens', event='acquire')
+        return self.token_store.add(now + self.TOKEN_DEFAULT_EXPIRY)
 
     def token_validate(self, token, now=None):
         if now is None:
             now = int(time.time())
 
-        token_file = os.path.join(self.tokens, token)
-
-        try:
-            with open(token_file, 'r', encoding='UTF-8') as f:
-                expire = int(f.read())
-        except (FileNotFoundError, IsADirectoryError):
+        expire = self.token_store.get(token)
+        if expire is None:
+            self.metrics.inc('tokens', event='invalid')
             return False
 
         if now >= expire:
-            os.remove(token_file)
+            self.token_store.delete(token)
+            self.metrics.inc('tokens', event='expired')
             return False
 
+        self.metrics.inc('tokens', event='valid')
         return True
 
     def token_delete(self, token):
-        token_file = os.path.join(self.tokens, token)
-
-        try:
-            os.remove(token_file)
-        except OSError:
-            pass
+        self.metrics.inc('tokens', event='delete')
+        self.token_store.delete(token)
 
     def token_delete_expire(self, now=None):
         if now is None:
             now = int(time.time())
 
-        try:
-            token_files = os.scandir(self.tokens)
-        except FileNotFoundError:
-            pass
-        else:
-            for token_file in token_files:
-                try:
-                    with open(token_file, 'r', encoding='UTF-8') as f:
-                        expire = int(f.read())
-                except (OSError, ValueError):
-                    continue
-                if now >= expire:
-                    os.remove(token_file)
+        self.token_store.delete_expire(now)
 
     def token_check_delete_expire(self, now=None):
         if now is None:
@@ -1848,6 +2515,7 @@ def make_app(root=".", config=None):
 
     # main app instance
     app = flask.Flask(__name__, instance_path=_host.chroot)
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=_host.template_cache)
     app.register_blueprint(bp)
     app.request_class = Request
     app.config['WEBSCRAPBOOK_HOST'] = _host
@@ -231,6 +231,52 @@ def cmd_convert(args):
             log(f'{info.type.upper()}: {info.msg}')
 
 
+def cmd_compact(args):
+    """Reclaim dead space left in archive files by append-saving.
+
+    (see "archive_append" in "wsb help config")
+    """
+    files = []
+    for path in args['paths']:
+        if os.path.isdir(path):
+            for root, dirs, filenames in os.walk(path):
+                dirs[:] = [d for d in dirs if d != WSB_DIR]
+                files.extend(os.path.join(root, f) for f in filenames if util.is_archive(f))
+        else:
+            files.append(path)
+
+    for file in files:
+        try:
+            size = os.stat(file).st_size
+            if util.zip_compact(file, args['threshold']):
+                reclaimed = size - os.stat(file).st_size
+                log(f'INFO: Compacted "{file}" (reclaimed {util.format_filesize(reclaimed)})')
+            elif args['debug']:
+                ratio = util.zip_garbage_ratio(file)
+                log(f'DEBUG: Skipped "{file}" (about {ratio:.0%} dead space)')
+        except Exception as exc:
+            log(f'ERROR: Unable to compact "{file}": {exc}')
+
+
+def cmd_precompile(args):
+    """Compile the theme templates ahead of time and store the bytecode in
+       the persistent template cache."""
+    from .scrapbook.host import Host
+    host = Host(args['root'])
+    env = host.get_template_env()
+
+    for name in env.list_templates():
+        try:
+            env.get_template(name)
+        except Exception as exc:
+            log(f'ERROR: Unable to compile "{name}": {exc}')
+        else:
+            if args['debug']:
+                log(f'DEBUG: Compiled "{name}"')
+
+    log(f'INFO: Stored compiled templates in "{host.template_cache.directory}"')
+
+
 def cmd_help(args):
     """Show detailed information about certain topics.
     """
@@ -258,7 +304,6 @@ def view_archive_files(files):
     """
     import tempfile
     import zipfile
-    import mimetypes
     import webbrowser
     from urllib.request import pathname2url
 
@@ -271,7 +316,7 @@ def view_archive_files(files):
     urls = []
 
     for file in dict.fromkeys(os.path.normcase(os.path.abspath(file)) for file in files):
-        mime, _ = mimetypes.guess_type(file)
+        mime = util.guess_mimetype(file)
         if mime not in ("application/html+zip", "application/x-maff"):
             continue
 
@@ -408,6 +453,9 @@ inconsistency.""")
         help="""ignore current fulltext cache and generate again""")
     parser_cache.add_argument('--no-recreate', dest='recreate', action='store_false',
         help="""inverse of --recreate (default)""")
+    parser_cache.add_argument('-j', '--jobs', metavar='N', default=1, type=int, action='store',
+        help="""number of worker processes to generate fulltext cache. 0 for the
+number of CPUs. (default: %(default)s)""")
     parser_cache.add_argument('--static-site', default=False, action='store_true',
         help="""generate static site pages""")
     parser_cache.add_argument('--no-static-site', dest='static_site', action='store_false',
@@ -486,6 +534,27 @@ inconsistency.""")
     parser_convert_sb2wsb.add_argument('--debug', default=False, action='store_true',
         help="""include debug output""")
 
+    # subcommand: compact
+    parser_compact = subparsers.add_parser('compact', description=cmd_compact.__doc__,
+        help="""reclaim dead space in archive files""")
+    parser_compact.set_defaults(func=cmd_compact)
+    parser_compact.add_argument('paths', metavar='path', nargs='+', action='store',
+        help="""the archive file(s) to compact, or directory(ies) to search for
+archive files""")
+    parser_compact.add_argument('--threshold', default=0.2, type=float, action='store',
+        help="""compact only if the estimated ratio of dead space exceeds this
+value; the estimate may be slightly above zero for an archive without dead
+space (default: %(default)s)""")
+    parser_compact.add_argument('--debug', default=False, action='store_true',
+        help="""include debug output""")
+
+    # subcommand: precompile
+    parser_precompile = subparsers.add_parser('precompile', description=cmd_precompile.__doc__,
+        help="""compile theme templates ahead of time""")
+    parser_precompile.set_defaults(func=cmd_precompile)
+    parser_precompile.add_argument('--debug', default=False, action='store_true',
+        help="""include debug output""")
+
     # subcommand: help
     parser_help = subparsers.add_parser('help', description=cmd_help.__doc__,
         help="""show detailed information about certain topics""")
@@ -5,18 +5,17 @@ import traceback
 import shutil
 import io
 import zipfile
-import mimetypes
 import time
 import re
 import html
 import copy
 import itertools
 import functools
+from concurrent.futures import ProcessPoolExecutor
 from collections import namedtuple, UserDict
 from urllib.parse import urlsplit, urljoin, quote, unquote
 from datetime import datetime, timezone
 
-import jinja2
 from lxml import etree
 
 from .host import Host
@@ -81,10 +80,7 @@ class StaticSiteGenerator():
 
         self.rss = rss
 
-        self.template_env = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(self.host.templates),
-            autoescape=jinja2.select_autoescape(['html']),
-            )
+        self.template_env = self.host.get_template_env()
 
         book.load_meta_files()
         book.load_toc_files()
@@ -415,10 +411,18 @@ class FulltextCacheGenerator():
         }
     URL_SAMPLE_LENGTH = 256
 
-    def __init__(self, book, *, inclusive_frames=True, recreate=False):
+    WORKER_CHUNK_SIZE = 16
+
+    def __init__(self, book, *, inclusive_frames=True, recreate=False, jobs=1):
+        """
+        Args:
+            jobs: number of worker processes to generate cache for items. 0
+                for the number of CPUs. 1 to generate in this process.
+        """
         self.book = book
         self.inclusive_frames = inclusive_frames
         self.recreate = recreate
+        self.jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
         self.cache_last_modified = 0
 
     def run(self, item_ids=None):
@@ -453,8 +457,11 @@ class FulltextCacheGenerator():
         else:
             id_pool = dict.fromkeys(itertools.chain(book.meta, book.fulltext))
 
-        for id in id_pool:
-            yield from self._cache_item(id)
+        if self.jobs > 1 and len(id_pool) > 1:
+            yield from self._cache_items_parallel(id_pool)
+        else:
+            for id in id_pool:
+                yield from self._cache_item(id)
 
         # update fulltext files
         if book.fulltext != book_fulltext_orig:
@@ -467,6 +474,37 @@ class FulltextCacheGenerator():
             for file in book.iter_fulltext_files():
                 os.utime(file)
 
+    def _cache_items_parallel(self, id_pool):
+        """Generate cache for items in worker processes.
+
+        Each item is handled by a worker with a book holding only the
+        metadata and cache of the item, and the resulted cache is merged
+        back. Results are taken in the order of id_pool so that the info
+        messages are the same as generated in this process, except that the
+        exc of an Info is not passed.
+        """
+        book = self.book
+
+        # pass the context along with each item, as ProcessPoolExecutor does
+        # not support an initializer in Python < 3.7
+        context = (book.host.root, book.host.config, book.id,
+                   self.inclusive_frames, self.cache_last_modified)
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            results = executor.map(
+                _run_fulltext_worker,
+                itertools.repeat(context),
+                id_pool,
+                (book.meta.get(id) for id in id_pool),
+                (book.fulltext.get(id) for id in id_pool),
+                chunksize=self.WORKER_CHUNK_SIZE,
+                )
+            for id, (infos, fulltext) in zip(id_pool, results):
+                yield from infos
+                if fulltext is None:
+                    book.fulltext.pop(id, None)
+                else:
+                    book.fulltext[id] = fulltext
+
     def _cache_item(self, id):
         yield Info('debug', f'Checking item "{id}"')
         book = self.book
@@ -671,7 +709,7 @@ class FulltextCacheGenerator():
 
         fh = zip_stream(fh)
         try:
-            mime, _ = mimetypes.guess_type(path)
+            mime = util.guess_mimetype(path)
             return (yield from self._get_fulltext_cache_for_fh(item, path, fh, mime))
         finally:
             fh.close()
@@ -902,9 +940,34 @@ class FulltextCacheGenerator():
         return self.FULLTEXT_SPACE_REPLACER(text).strip()
 
 
+_fulltext_worker = None
+_fulltext_worker_key = None
+
+
+def _get_fulltext_worker(root, config, book_id, inclusive_frames, cache_last_modified):
+    """Get the generator of the current worker process for the context."""
+    global _fulltext_worker, _fulltext_worker_key
+    key = (root, book_id, inclusive_frames, cache_last_modified)
+    if key != _fulltext_worker_key:
+        book = Host(root, config).books[book_id]
+        _fulltext_worker = FulltextCacheGenerator(book, inclusive_frames=inclusive_frames)
+        _fulltext_worker.cache_last_modified = cache_last_modified
+        _fulltext_worker_key = key
+    return _fulltext_worker
+
+
+def _run_fulltext_worker(context, id, meta, fulltext):
+    generator = _get_fulltext_worker(*context)
+    book = generator.book
+    book.meta = {} if meta is None else {id: meta}
+    book.fulltext = {} if fulltext is None else {id: fulltext}
+    infos = [Info(info.type, info.msg, info.data) for info in generator._cache_item(id)]
+    return infos, book.fulltext.get(id)
+
+
 def generate(root, book_ids=None, item_ids=None, *,
         config=None, no_lock=False, no_backup=False,
-        fulltext=True, inclusive_frames=True, recreate=False,
+        fulltext=True, inclusive_frames=True, recreate=False, jobs=1,
         static_site=False, static_index=False,
         locale=None, rss_root=None):
     start = time.time()
@@ -933,7 +996,8 @@ def generate(root, book_ids=None, item_ids=None, *,
                 continue
 
             yield Info('info', f'Caching book "{book_id}".')
-            lh = nullcontext() if no_lock else book.get_tree_lock().acquire()
+            # fulltext cache is the only pass that modifies the tree files
+            lh = nullcontext() if no_lock else book.get_tree_lock(shared=not fulltext).acquire()
             with lh:
                 if not no_backup:
                     # use same timestamp for all books
@@ -947,6 +1011,7 @@ def generate(root, book_ids=None, item_ids=None, *,
                             book,
                             inclusive_frames=inclusive_frames,
                             recreate=recreate,
+                            jobs=jobs,
                             )
                         yield from generator.run(item_ids)
 
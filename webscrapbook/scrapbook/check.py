@@ -846,7 +846,7 @@ class Indexer:
             return url
 
         subpath = unquote(urlparts.path)
-        mime, _ = mimetypes.guess_type(subpath)
+        mime = util.guess_mimetype(subpath)
         file = os.path.join(self.book.data_dir, index)
 
         if util.is_htz(index):
@@ -998,7 +998,8 @@ def run(root, book_ids=None, *, config=None, no_lock=False, no_backup=False, **k
                 yield Info('info', f'Skipped book "{book_id}" (no_tree).')
                 continue
 
-            lh = nullcontext() if no_lock else book.get_tree_lock().acquire()
+            generator = BookChecker(book, **kwargs)
+            lh = nullcontext() if no_lock else book.get_tree_lock(shared=not generator.resolve).acquire()
             with lh:
                 if not no_backup:
                     # use same timestamp for all books
@@ -1007,7 +1008,6 @@ def run(root, book_ids=None, *, config=None, no_lock=False, no_backup=False, **k
                     yield Info('info', f'Prepared backup at "{book.get_subpath(book.backup_dir)}".')
 
                 try:
-                    generator = BookChecker(book, **kwargs)
                     yield from generator.run()
                 finally:
                     if not no_backup:
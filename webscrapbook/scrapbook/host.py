@@ -2,9 +2,11 @@
 """
 import os
 import time
+import tempfile
 from collections import UserDict
-from threading import Thread
+from threading import Thread, Condition, Lock
 from secrets import token_urlsafe
+import jinja2
 from .. import WSB_USER_DIR, WSB_DIR
 from .. import Config
 from .. import util
@@ -87,19 +89,112 @@ class _FileLockAcquireProxy:
             self.lock.release()
 
 
+class _FileLockEvents:
+    """Registry of in-process events for lock files.
+
+    A waiter of a lock file sleeps on the condition of the file and is woken
+    immediately when the lock is released in the same process. A release in
+    another process is still detected by polling.
+    """
+    def __init__(self):
+        self._events = {}
+        self._lock = Lock()
+
+    def get(self, file):
+        """Get (and reference) the event of a lock file."""
+        with self._lock:
+            try:
+                event = self._events[file]
+            except KeyError:
+                event = self._events[file] = _FileLockEvent()
+            event.refs += 1
+            return event
+
+    def put(self, file):
+        """Dereference the event of a lock file."""
+        with self._lock:
+            event = self._events[file]
+            event.refs -= 1
+            if event.refs <= 0:
+                del self._events[file]
+
+    def notify(self, file):
+        """Wake all waiters of a lock file."""
+        with self._lock:
+            event = self._events.get(file)
+        if event:
+            event.notify()
+
+
+class _FileLockEvent:
+    def __init__(self):
+        self.cond = Condition(Lock())
+        self.gen = 0
+        self.refs = 0
+
+    def wait(self, gen, timeout):
+        """Wait until notified or timeout, unless notified since gen."""
+        with self.cond:
+            if self.gen == gen:
+                self.cond.wait(timeout)
+
+    def notify(self):
+        with self.cond:
+            self.gen += 1
+            self.cond.notify_all()
+
+
+_file_lock_events = _FileLockEvents()
+
+
+class FileLockStats:
+    """Statistics of lock acquisitions in the current process.
+    """
+    def __init__(self):
+        self.acquired = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.wait_seconds = 0.0
+        self._lock = Lock()
+
+    def observe(self, wait_seconds, error=None):
+        with self._lock:
+            if error is None:
+                self.acquired += 1
+            elif isinstance(error, LockTimeoutError):
+                self.timeouts += 1
+            else:
+                self.errors += 1
+            self.wait_seconds += wait_seconds
+
+
+file_lock_stats = FileLockStats()
+
+
 class FileLock:
     """Controller of file lock.
+
+    An exclusive lock is a lock file, which is created atomically by the
+    holder. A shared lock is a file under the shared directory of the lock,
+    one for each holder. An exclusive acquirer creates the lock file first,
+    which blocks new shared acquirers, and then waits for the current shared
+    holders to leave, so that writers are not starved by readers.
     """
     def __init__(self, host, name, *,
-            timeout=5, stale=60, persist=False):
+            timeout=5, stale=60, persist=False, shared=False):
         self.host = host
         self.name = name
         self.timeout = timeout
         self.stale = stale
-        self.file = os.path.join(host.locks, f'{util.encrypt(name, method="md5")}.lock')
+        self.shared = shared
+
+        basename = util.encrypt(name, method="md5")
+        self.xfile = os.path.join(host.locks, f'{basename}.lock')
+        self.sdir = os.path.join(host.locks, f'{basename}.shared')
         self._keeper = None
 
         if persist:
+            self.file = os.path.join(self.sdir, f'{persist}.lock') if shared else self.xfile
             try:
                 with open(self.file, encoding='UTF-8') as fh:
                     assert fh.read() == persist
@@ -114,6 +209,7 @@ class FileLock:
             self._lock = True
         else:
             self.id = token_urlsafe()
+            self.file = os.path.join(self.sdir, f'{self.id}.lock') if shared else self.xfile
             self._lock = False
 
     @property
@@ -142,7 +238,9 @@ class FileLock:
             timeout: float timeout to wait for a lock. < 0 to block until the
                 lock can be acquired. None to use default timeout.
             poll_interval: float interval of seconds to check whether the lock
-                is available.
+                is available. A release in the same process wakes the waiter
+                immediately, and this is only for a release in another
+                process.
 
         Raises:
             LockTimeoutError: if timeout expires
@@ -163,51 +261,157 @@ class FileLock:
         except FileExistsError:
             pass
         except OSError as exc:
-            raise LockGenerateError(f'unable to create lock "{name}"',
+            raise LockGenerateError(f'unable to create lock "{self.name}"',
                 name=self.name, file=self.file) from exc
 
-        while True:
-            try:
-                with open(self.file, 'x', encoding='UTF-8') as fh:
-                    fh.write(self.id)
-            except FileExistsError:
-                t = time.time()
+        start = time.perf_counter()
+        try:
+            if self.shared:
+                self._acquire_shared(timeout_time, poll_interval)
+            else:
+                self._acquire_exclusive(timeout_time, poll_interval)
+        except LockError as exc:
+            file_lock_stats.observe(time.perf_counter() - start, exc)
+            raise
+        file_lock_stats.observe(time.perf_counter() - start)
 
-                if t >= timeout_time:
-                    raise LockTimeoutError(f'timeout when acquiring lock "{self.name}"',
-                        name=self.name, file=self.file)
+        self._lock = True
+        return _FileLockAcquireProxy(self)
 
+    def _acquire_exclusive(self, timeout_time, poll_interval):
+        event = _file_lock_events.get(self.xfile)
+        try:
+            while True:
+                gen = event.gen
                 try:
-                    stale_time = os.stat(self.file).st_mtime + self.stale
-                except FileNotFoundError:
-                    # A rare case that lock file has been removed during the
-                    # short inverval. Try acquire again.
-                    continue
+                    with open(self.file, 'x', encoding='UTF-8') as fh:
+                        fh.write(self.id)
+                except FileExistsError:
+                    t = time.time()
+
+                    if t >= timeout_time:
+                        raise LockTimeoutError(f'timeout when acquiring lock "{self.name}"',
+                            name=self.name, file=self.file)
+
+                    try:
+                        stale_time = os.stat(self.file).st_mtime + self.stale
+                    except FileNotFoundError:
+                        # A rare case that lock file has been removed during the
+                        # short inverval. Try acquire again.
+                        continue
+                    except OSError as exc:
+                        raise LockGenerateError(f'unable to create lock "{self.name}"',
+                            name=self.name, file=self.file) from exc
+
+                    if t >= stale_time:
+                        # Current lock file is stale. Rewrite with current ID.
+                        try:
+                            with open(self.file, 'w', encoding='UTF-8') as fh:
+                                fh.write(self.id)
+                        except OSError as exc:
+                            raise LockRegenerateError(
+                                f'unable to regenerate stale lock "{self.name}"',
+                                name=self.name, file=self.file) from exc
+                        else:
+                            break
+
+                    event.wait(gen, max(min(poll_interval, timeout_time - t, stale_time - t), 0))
                 except OSError as exc:
                     raise LockGenerateError(f'unable to create lock "{self.name}"',
                         name=self.name, file=self.file) from exc
+                else:
+                    break
+        finally:
+            _file_lock_events.put(self.xfile)
 
-                if t >= stale_time:
-                    # Current lock file is stale. Rewrite with current ID.
-                    try:
+        # wait for shared holders to leave
+        event = _file_lock_events.get(self.sdir)
+        try:
+            while True:
+                gen = event.gen
+                t = time.time()
+                try:
+                    if not self._shared_active(t):
+                        break
+
+                    if t >= timeout_time:
+                        os.remove(self.file)
+                        _file_lock_events.notify(self.xfile)
+                        raise LockTimeoutError(f'timeout when acquiring lock "{self.name}"',
+                            name=self.name, file=self.file)
+
+                    # keep the lock file from being taken as stale
+                    os.utime(self.file)
+                except OSError as exc:
+                    raise LockGenerateError(f'unable to create lock "{self.name}"',
+                        name=self.name, file=self.file) from exc
+
+                event.wait(gen, max(min(poll_interval, timeout_time - t), 0))
+        finally:
+            _file_lock_events.put(self.sdir)
+
+    def _acquire_shared(self, timeout_time, poll_interval):
+        event = _file_lock_events.get(self.xfile)
+        try:
+            while True:
+                gen = event.gen
+                t = time.time()
+                try:
+                    stale_time = self._exclusive_active(t)
+                    if stale_time is None:
                         with open(self.file, 'w', encoding='UTF-8') as fh:
                             fh.write(self.id)
-                    except OSError as exc:
-                        raise LockRegenerateError(
-                            f'unable to regenerate stale lock "{self.name}"',
-                            name=self.name, file=self.file) from exc
-                    else:
-                        break
 
-                time.sleep(poll_interval)
-            except OSError as exc:
-                raise LockGenerateError(f'unable to create lock "{self.name}"',
-                    name=self.name, file=self.file) from exc
-            else:
-                break
+                        # An exclusive acquirer came in meanwhile. Leave for it.
+                        stale_time = self._exclusive_active(time.time())
+                        if stale_time is None:
+                            break
 
-        self._lock = True
-        return _FileLockAcquireProxy(self)
+                        os.remove(self.file)
+                        _file_lock_events.notify(self.sdir)
+                except OSError as exc:
+                    raise LockGenerateError(f'unable to create lock "{self.name}"',
+                        name=self.name, file=self.file) from exc
+
+                if t >= timeout_time:
+                    raise LockTimeoutError(f'timeout when acquiring lock "{self.name}"',
+                        name=self.name, file=self.file)
+
+                event.wait(gen, max(min(poll_interval, timeout_time - t, stale_time - t), 0))
+        finally:
+            _file_lock_events.put(self.xfile)
+
+    def _exclusive_active(self, t):
+        """Get stale time of the exclusive lock file, or None if not active.
+        """
+        try:
+            stale_time = os.stat(self.xfile).st_mtime + self.stale
+        except FileNotFoundError:
+            return None
+
+        if t >= stale_time:
+            return None
+
+        return stale_time
+
+    def _shared_active(self, t):
+        """Check for an active shared lock file, and remove stale ones.
+        """
+        try:
+            entries = os.scandir(self.sdir)
+        except FileNotFoundError:
+            return False
+
+        with entries as entries:
+            for entry in entries:
+                try:
+                    if t < entry.stat().st_mtime + self.stale:
+                        return True
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+        return False
 
     def extend(self):
         """Extend duration of the lock.
@@ -242,6 +446,7 @@ class FileLock:
                 name=self.name, file=self.file) from exc
         else:
             self._lock = False
+            _file_lock_events.notify(self.sdir if self.shared else self.xfile)
 
     def keep(self):
         """Spawn a keeper thread to keep the lock fresh until released.
@@ -294,6 +499,32 @@ class BooksProxy(UserDict):
         return rv
 
 
+class TemplateBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """A persistent bytecode cache for compiled templates.
+
+    The cache directory is created on demand and bytecode files are written
+    atomically, so that it can be shared by concurrent processes safely. A
+    broken or unwritable cache is treated as a cache miss.
+    """
+    def load_bytecode(self, bucket):
+        try:
+            super().load_bytecode(bucket)
+        except Exception:
+            bucket.reset()
+
+    def dump_bytecode(self, bucket):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as fh:
+                bucket.write_bytecode(fh)
+            os.replace(fh.name, self._get_cache_filename(bucket))
+        except OSError:
+            try:
+                os.remove(fh.name)
+            except (NameError, OSError):
+                pass
+
+
 class Host:
     """Controller for a scrapbook set defined by a root directory and configs.
     """
@@ -321,6 +552,20 @@ class Host:
         self.templates = [os.path.join(t, 'templates') for t in self.themes]
 
         self.locks = os.path.join(root, WSB_DIR, 'locks')
+        self.cache = os.path.join(root, WSB_DIR, 'cache')
+
+        if config['app']['gzip_cache_size'] > 0:
+            self.gzip_cache = util.GzipFileCache(
+                os.path.join(self.cache, 'gzip'),
+                level=config['app']['gzip_level'],
+                min_size=config['app']['gzip_min_size'],
+                max_size=config['app']['gzip_cache_size'],
+                )
+        else:
+            self.gzip_cache = None
+
+        self.template_cache = TemplateBytecodeCache(os.path.join(self.cache, 'jinja'))
+        self._template_env = None
 
         self.books = BooksProxy(self)
 
@@ -337,6 +582,17 @@ class Host:
                 return file
         return None
 
+    def get_template_env(self):
+        """Get the shared jinja2 environment for the theme templates.
+        """
+        if self._template_env is None:
+            self._template_env = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(self.templates),
+                autoescape=jinja2.select_autoescape(['html']),
+                bytecode_cache=self.template_cache,
+                )
+        return self._template_env
+
     def get_lock(self, name, *args, **kwargs):
         """Get a lock object to control lock.
         """
@@ -1,11 +1,14 @@
 """Server backend of WebScrapBook toolkit.
 """
 import os
+import signal
+import socket
 import webbrowser
-from threading import Thread
+from threading import Thread, BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor
 
 # dependency
-from werkzeug.serving import WSGIRequestHandler, make_server
+from werkzeug.serving import WSGIRequestHandler, BaseWSGIServer, make_server
 
 # this package
 from . import Config
@@ -35,16 +38,32 @@ def serve(root):
     port2 = '' if (not ssl_on and port == 80) or (ssl_on and port == 443) else ':' + str(port)
 
     # prepare server
-    srv = make_server(
-        host=host,
-        port=port,
-        app=make_app(root, config),
-        threaded=True,
-        processes=1,
-        ssl_context=((ssl_cert, ssl_key) if ssl_cert and ssl_key
-                else 'adhoc' if ssl_on else None),
-        request_handler=RequestHandler,
-        )
+    engine = config['server']['engine']
+    ssl_context = ((ssl_cert, ssl_key) if ssl_cert and ssl_key
+            else 'adhoc' if ssl_on else None)
+    if engine == 'production':
+        srv = PoolWSGIServer(
+            host=host,
+            port=port,
+            app=make_app(root, config),
+            threads=config['server']['threads'],
+            backlog=config['server']['backlog'],
+            keep_alive=config['server']['keep_alive'],
+            handler=RequestHandler,
+            ssl_context=ssl_context,
+            )
+    elif engine == 'werkzeug':
+        srv = make_server(
+            host=host,
+            port=port,
+            app=make_app(root, config),
+            threaded=True,
+            processes=1,
+            ssl_context=ssl_context,
+            request_handler=RequestHandler,
+            )
+    else:
+        raise ValueError(f'Unsupported server engine: "{engine}"')
 
     srv.log('info', 'WebScrapBook server starting up...')
     srv.log('info', f'Document Root: {os.path.abspath(root)}')
@@ -63,8 +82,137 @@ def serve(root):
         thread.start()
 
     # start server
-    srv.serve_forever()
+    if engine == 'production':
+        serve_prefork(srv, config['server']['processes'])
+    else:
+        srv.serve_forever()
+
+
+def serve_prefork(srv, processes=1):
+    """Run the server in pre-forked processes sharing the listening socket.
+
+    SIGTERM shuts down the server gracefully, i.e. stop accepting new
+    connections and wait for handling ones to complete.
+    """
+    if processes > 1 and not hasattr(os, 'fork'):
+        srv.log('warning', 'Multiple processes are not supported on this platform.')
+        processes = 1
+
+    children = []
+    is_child = False
+    for _ in range(processes - 1):
+        pid = os.fork()
+        if pid == 0:
+            is_child = True
+            break
+        children.append(pid)
+
+    def shutdown(signum, frame):
+        # shutdown() blocks until serve_forever() returns, and must be
+        # called from another thread
+        Thread(target=srv.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, shutdown)
+
+    try:
+        srv.serve_forever()
+    finally:
+        if is_child:
+            # wait for handling connections to complete before exiting
+            try:
+                srv.server_close()
+            finally:
+                os._exit(0)
+
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        srv.server_close()
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
+
+class PoolWSGIServer(BaseWSGIServer):
+    """A WSGI server handling connections with a bounded worker thread pool.
+
+    A new connection is accepted only when a worker is available, and
+    further ones wait in the listen backlog.
+    """
+    multithread = True
+    SLOT_POLL_INTERVAL = 0.5  # in seconds
+
+    def __init__(self, host, port, app, threads=16, backlog=128, keep_alive=5, **kwargs):
+        """
+        Args:
+            threads: number of worker threads
+            backlog: max number of pending connections
+            keep_alive: seconds to wait for the next request of a persistent
+                connection. 0 for no timeout.
+        """
+        self.request_queue_size = backlog
+        self.keep_alive = keep_alive
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._slots = BoundedSemaphore(threads)
+        self._slot_pending = False
+        super().__init__(host, port, app, **kwargs)
+
+    def _handle_request_noblock(self):
+        # wait for a free worker before accepting the connection, and return
+        # to serve_forever() periodically so that shutdown() is not blocked
+        if not self._slots.acquire(timeout=self.SLOT_POLL_INTERVAL):
+            return
+
+        self._slot_pending = True
+        try:
+            super()._handle_request_noblock()
+        finally:
+            # release the slot if the connection is not passed to a worker
+            if self._slot_pending:
+                self._slot_pending = False
+                self._slots.release()
+
+    def process_request(self, request, client_address):
+        self._slot_pending = False
+        try:
+            self._executor.submit(self.process_request_worker, request, client_address)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        # wait for handling connections to complete
+        self._executor.shutdown(wait=True)
+        super().server_close()
 
 
 class RequestHandler(WSGIRequestHandler):
     protocol_version = "HTTP/1.1"
+
+    def handle_one_request(self):
+        # time out only while waiting for the next request of a persistent
+        # connection, so that a slow upload or download is not dropped
+        keep_alive = getattr(self.server, 'keep_alive', None)
+        if keep_alive:
+            self.connection.settimeout(keep_alive)
+            try:
+                self.rfile.peek(1)
+            except socket.timeout:
+                self.close_connection = True
+                return
+            self.connection.settimeout(None)
+
+        return super().handle_one_request()
@@ -4,16 +4,28 @@ import sys
 import os
 import stat
 import subprocess
+import io
+import copy
+import shutil
+import tempfile
 import collections
 from collections import namedtuple
+from operator import attrgetter
 import zipfile
+import zlib
+import gzip
+import struct
+import bisect
+import heapq
 import math
 import re
 import hashlib
 import time
+import threading
 import mimetypes
 import binascii
 import codecs
+from contextlib import contextmanager
 from base64 import b64decode
 from urllib.parse import unquote_to_bytes
 from urllib.request import pathname2url
@@ -85,6 +97,85 @@ def make_hashable(obj):
     raise TypeError(f"unable to make '{type(obj).__name__}' hashable")
 
 
+class LRUCache:
+    """A thread-safe LRU cache bounded by the entry count and total size.
+
+    Entries are evicted when either the entry count or the total size of the
+    entries exceeds the limit. An entry may also have an expiration time,
+    after which it is treated as missing.
+    """
+    def __init__(self, max_entries=None, max_bytes=None):
+        """
+        Args:
+            max_entries: max number of entries, or None for no limit
+            max_bytes: max total size of the entries, or None for no limit
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None, now=None):
+        """Get the cached value, or default if not cached or expired."""
+        with self._lock:
+            try:
+                value, size, expire = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expire is not None and (time.time() if now is None else now) >= expire:
+                del self._entries[key]
+                self.bytes -= size
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=0, expire=None):
+        """Cache a value.
+
+        Args:
+            size: the estimated size of the value
+            expire: the time after which the entry expires, or None for never
+        """
+        # skip an entry that could never fit
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size, expire)
+            self.bytes += size
+            while self._entries and (
+                    (self.max_entries is not None and len(self._entries) > self.max_entries)
+                    or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                _, (_, size, _) = self._entries.popitem(last=False)
+                self.bytes -= size
+
+    def discard(self, predicate):
+        """Remove all entries whose key satisfies predicate."""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                _, size, _ = self._entries.pop(key)
+                self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
 #########################################################################
 # ScrapBook related path/file/string/etc handling
 #########################################################################
@@ -363,6 +454,40 @@ def checksum(file, method='sha1', chunk_size=4096):
             fh.close()
 
 
+def file_replace(src, dst):
+    """Replace a file with a temp file, keeping its mode and owner.
+
+    A symlink is followed, so that the link is kept and its target is
+    replaced. The temp file should be in the same directory as the target
+    (see os.path.realpath). The temp file is removed anyway.
+
+    Falls back to overwriting the content of the file if it cannot be
+    replaced (e.g. a hidden file in Windows) or its owner cannot be kept.
+    """
+    dst = os.path.realpath(dst)
+    try:
+        try:
+            shutil.copymode(dst, src)
+
+            # preserve the owner; chown raises if not permitted
+            st = os.stat(dst)
+            st2 = os.stat(src)
+            if (st.st_uid, st.st_gid) != (st2.st_uid, st2.st_gid):
+                os.chown(src, st.st_uid, st.st_gid)
+
+            os.replace(src, dst)
+        except OSError:
+            # use 'r+b' as 'wb' causes PermissionError for hidden file in Windows
+            with open(dst, 'r+b') as fw, open(src, 'rb') as fr:
+                fw.truncate()
+                shutil.copyfileobj(fr, fw)
+    finally:
+        try:
+            os.remove(src)
+        except FileNotFoundError:
+            pass
+
+
 def file_is_link(path, st=None):
     """Check if a path is a symlink or Windows directory junction
 
@@ -396,27 +521,39 @@ def file_info(file, base=None):
     except OSError:
         # unexpected error when getting stat info
         statinfo = None
-        size = None
-        last_modified = None
-    else:
-        size = statinfo.st_size
-        last_modified = statinfo.st_mtime
 
-    if not os.path.lexists(file):
-        type = None
-    elif file_is_link(file, statinfo):
+    return _file_info_from_stat(file, name, statinfo)
+
+
+def _file_info_from_stat(file, name, statinfo):
+    """Build FileInfo from a known lstat result (or None if inaccessible).
+    """
+    if statinfo is None:
+        return FileInfo(name=name, type=None, size=None, last_modified=None)
+
+    if file_is_link(file, statinfo):
         type = 'link'
-    elif os.path.isdir(file):
+    elif stat.S_ISDIR(statinfo.st_mode):
         type = 'dir'
-    elif os.path.isfile(file):
+    elif stat.S_ISREG(statinfo.st_mode):
         type = 'file'
     else:
         type = 'unknown'
 
-    if type != 'file':
-        size = None
+    size = statinfo.st_size if type == 'file' else None
+
+    return FileInfo(name=name, type=type, size=size, last_modified=statinfo.st_mtime)
 
-    return FileInfo(name=name, type=type, size=size, last_modified=last_modified)
+
+def _file_info_from_entry(entry, name):
+    """Build FileInfo from an os.DirEntry, reusing the stat it caches.
+    """
+    try:
+        statinfo = entry.stat(follow_symlinks=False)
+    except OSError:
+        statinfo = None
+
+    return _file_info_from_stat(entry.path, name, statinfo)
 
 
 def listdir(base, recursive=False):
@@ -425,22 +562,98 @@ def listdir(base, recursive=False):
     if not recursive:
         with os.scandir(base) as entries:
             for entry in entries:
-                info = file_info(entry.path)
+                info = _file_info_from_entry(entry, entry.name)
                 if info.type is None: continue
                 yield info
 
     else:
-        for root, dirs, files in os.walk(base):
-            for dir in dirs:
-                file = os.path.join(root, dir)
-                info = file_info(file, base)
-                if info.type is None: continue
-                yield info
-            for file in files:
-                file = os.path.join(root, file)
-                info = file_info(file, base)
+        # walk top-down, and do not follow symlinks or junctions
+        stack = [base]
+        while stack:
+            root = stack.pop()
+            infos = []
+            subdirs = []
+            try:
+                with os.scandir(root) as entries:
+                    for entry in entries:
+                        info = _file_info_from_entry(entry, entry.path[len(base)+1:].replace('\\', '/'))
+                        if info.type is None: continue
+                        infos.append(info)
+                        if info.type == 'dir':
+                            subdirs.append(entry.path)
+            except OSError:
+                continue
+
+            yield from infos
+            stack.extend(reversed(subdirs))
+
+
+def listdir_paged(base, recursive=False, cursor=None, limit=None):
+    """Generates FileInfo(s) in name order, starting after a cursor.
+
+    Entries in a directory are ordered by name, and a subdirectory is walked
+    right after its entry, i.e. ordered by path components. For a limited
+    page, at most limit entries of each walked directory are held in memory.
+
+    Args:
+        cursor: name of the last entry of the previous page
+        limit: max number of entries to generate, or None for no limit
+    """
+    remaining = limit
+    key = attrgetter('name')
+
+    def walk(root, after):
+        nonlocal remaining
+
+        # the entry named after[0] is the cursor entry or its ancestor
+        lower = after[0] if after else None
+        inclusive = True
+        while True:
+            try:
+                with os.scandir(root) as entries:
+                    candidates = (e for e in entries if lower is None or e.name > lower
+                        or (inclusive and e.name == lower))
+                    if remaining is None:
+                        selected = sorted(candidates, key=key)
+                    else:
+                        n = remaining + 1
+                        selected = heapq.nsmallest(n, candidates, key=key)
+            except OSError:
+                # skip an unreadable subdirectory, like listdir()
+                if root == base:
+                    raise
+                return
+
+            for entry in selected:
+                if remaining is not None and remaining <= 0:
+                    return
+
+                info = _file_info_from_entry(entry, entry.path[len(base)+1:].replace('\\', '/'))
                 if info.type is None: continue
-                yield info
+
+                if after and entry.name == after[0]:
+                    subafter = after[1:]
+                else:
+                    yield info
+                    if remaining is not None:
+                        remaining -= 1
+                    subafter = None
+
+                if recursive and info.type == 'dir':
+                    yield from walk(entry.path, subafter)
+
+            # continue with next batch if some selected entries are skipped
+            if remaining is None or remaining <= 0 or len(selected) < n:
+                return
+
+            lower = selected[-1].name
+            inclusive = False
+            after = None
+
+    after = cursor.split('/') if cursor else None
+    if after and not recursive:
+        after = after[:1]
+    yield from walk(base, after)
 
 
 def format_filesize(bytes, si=False):
@@ -521,29 +734,78 @@ def mime_is_markdown(mime):
     return mime in {'text/markdown'}
 
 
+MimeInfo = namedtuple('MimeInfo', ['mime', 'is_html', 'is_archive', 'is_htz', 'is_maff', 'is_markdown', 'is_compressible'])
+
+_mime_info_table = {}
+
+def _get_mime_info(mime):
+    return MimeInfo(
+        mime=mime,
+        is_html=mime_is_html(mime),
+        is_archive=mime_is_archive(mime),
+        is_htz=mime_is_htz(mime),
+        is_maff=mime_is_maff(mime),
+        is_markdown=mime_is_markdown(mime),
+        is_compressible=is_compressible(mime),
+        )
+
+
+def mime_info(filename):
+    """Guess the mimetype and its categories of a file.
+
+    Results of mimetypes.guess_type() are memoized by lowercased extension,
+    except for data: URLs and encoding or alias extensions (e.g. ".gz",
+    ".tgz"), which depend on more than the last extension.
+
+    NOTE: A type added by mimetypes.add_type() is not honored for an
+    extension that has been looked up.
+
+    Args:
+        filename: str or path-like
+    """
+    filename = os.fspath(filename)
+    ext = os.path.splitext(filename)[1].lower()
+
+    if filename[:5].lower() != 'data:':
+        try:
+            return _mime_info_table[ext]
+        except KeyError:
+            pass
+
+    if (filename[:5].lower() == 'data:'
+            or ext in mimetypes.encodings_map or ext in mimetypes.suffix_map):
+        mime, _ = mimetypes.guess_type(filename)
+        return _get_mime_info(mime)
+
+    mime, _ = mimetypes.guess_type('_' + ext)
+    info = _mime_info_table[ext] = _get_mime_info(mime)
+    return info
+
+
+def guess_mimetype(filename):
+    """A faster equivalent of mimetypes.guess_type(filename)[0].
+    """
+    return mime_info(filename).mime
+
+
 def is_html(filename):
-    mime, _ = mimetypes.guess_type(filename)
-    return mime_is_html(mime)
+    return mime_info(filename).is_html
 
 
 def is_archive(filename):
-    mime, _ = mimetypes.guess_type(filename)
-    return mime_is_archive(mime)
+    return mime_info(filename).is_archive
 
 
 def is_htz(filename):
-    mime, _ = mimetypes.guess_type(filename)
-    return mime_is_htz(mime)
+    return mime_info(filename).is_htz
 
 
 def is_maff(filename):
-    mime, _ = mimetypes.guess_type(filename)
-    return mime_is_maff(mime)
+    return mime_info(filename).is_maff
 
 
 def is_markdown(filename):
-    mime, _ = mimetypes.guess_type(filename)
-    return mime_is_markdown(mime)
+    return mime_info(filename).is_markdown
 
 
 #########################################################################
@@ -594,11 +856,8 @@ def zip_file_info(zip, subpath, base=None, check_implicit_dir=False):
         else:
             return FileInfo(name=name, type='dir', size=None, last_modified=zip_timestamp(info))
 
-        if check_implicit_dir:
-            base = subpath + '/'
-            for entry in zh.namelist():
-                if entry.startswith(base):
-                    return FileInfo(name=name, type='dir', size=None, last_modified=None)
+        if check_implicit_dir and subpath and zip_dir_trie(zh).is_dir(subpath):
+            return FileInfo(name=name, type='dir', size=None, last_modified=None)
 
     return FileInfo(name=name, type=None, size=None, last_modified=None)
 
@@ -616,35 +875,16 @@ def zip_listdir(zip, subpath, recursive=False):
         zip: path, file-like object, or zipfile.ZipFile
     """
     base = subpath.rstrip('/')
-    if base: base += '/'
-    base_len = len(base)
-    dir_exist = not base
-    entries = {}
 
     with nullcontext(zip) if isinstance(zip, zipfile.ZipFile) else zipfile.ZipFile(zip) as zh:
-        for filename in zh.namelist():
-            if not filename.startswith(base):
-                continue
-
-            if filename == base:
-                dir_exist = True
-                continue
-
-            entry = filename[base_len:]
-            if not recursive:
-                entry, _, _ = entry.partition('/')
-                entries.setdefault(entry, True)
-            else:
-                parts = entry.rstrip('/').split('/')
-                for i in range(0, len(parts)):
-                    entry = '/'.join(parts[0:i + 1])
-                    entries.setdefault(entry, True)
-
-        if not entries and not dir_exist:
+        trie = zip_dir_trie(zh)
+        if not trie.is_dir(base):
             raise ZipDirNotFoundError(f'Directory "{base}/" does not exist in the zip.')
 
+        prefix = base + '/' if base else ''
+        entries = trie.walk(base) if recursive else trie.children(base)
         for entry in entries:
-            info = zip_file_info(zh, base + entry, base)
+            info = zip_file_info(zh, prefix + entry, prefix)
 
             if info.type is None:
                 yield FileInfo(name=entry, type='dir', size=None, last_modified=None)
@@ -652,6 +892,30 @@ def zip_listdir(zip, subpath, recursive=False):
                 yield info
 
 
+def zip_listdir_paged(zip, subpath, recursive=False, cursor=None, limit=None):
+    """Generates FileInfo(s) in name order, starting after a cursor.
+
+    Ordered the same way as listdir_paged().
+
+    Raise ZipDirNotFoundError if subpath does not exist.
+    """
+    def key(info):
+        return info.name.split('/')
+
+    entries = zip_listdir(zip, subpath, recursive)
+
+    if cursor:
+        after = cursor.split('/')
+        if not recursive:
+            after = after[:1]
+        entries = (info for info in entries if key(info) > after)
+
+    if limit is None:
+        yield from sorted(entries, key=key)
+    else:
+        yield from heapq.nsmallest(limit, entries, key=key)
+
+
 def zip_hasdir(zip, subpath):
     """Check if a directory exists in the ZIP.
 
@@ -662,24 +926,921 @@ def zip_hasdir(zip, subpath):
     Args:
         zip: path, file-like object, or zipfile.ZipFile
     """
-    base = subpath.rstrip('/') + '/'
-    if base == '/':
+    base = subpath.rstrip('/')
+    if not base:
         return True
 
     with nullcontext(zip) if isinstance(zip, zipfile.ZipFile) else zipfile.ZipFile(zip) as zh:
-        # if directory entry exists, we are done
+        return zip_dir_trie(zh).is_dir(base)
+
+
+class ZipDirCache(LRUCache):
+    """A thread-safe LRU cache of parsed ZIP central directories.
+
+    An entry is keyed by (path, inode, size, mtime) of the ZIP file, so that
+    a modified or replaced file never hits a stale entry. Entries are evicted
+    when either the entry count or the estimated memory usage exceeds the
+    limit.
+    """
+    MAX_ENTRIES = 128
+    MAX_BYTES = 128 * 1024 * 1024
+    ENTRY_OVERHEAD = 512  # estimated bytes for a ZipInfo object
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        super().__init__(
+            self.MAX_ENTRIES if max_entries is None else max_entries,
+            self.MAX_BYTES if max_bytes is None else max_bytes,
+            )
+
+    @staticmethod
+    def get_key(path, st):
+        """Get the cache key for a ZIP file.
+
+        Args:
+            path: str or path-like of the ZIP file
+            st: stat of the ZIP file
+        """
+        return (os.path.normcase(os.path.abspath(path)), st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def estimate_size(self, filelist):
+        return sum(
+            self.ENTRY_OVERHEAD + len(i.filename) + len(i.extra) + len(i.comment)
+            for i in filelist
+            )
+
+    def get(self, key):
+        """Get the cached (filelist, name_to_info, start_dir, comment) or None.
+        """
+        return super().get(key)
+
+    def set(self, key, value, size=None):
+        if size is None:
+            size = self.estimate_size(value[0])
+        super().set(key, value, size)
+
+    def invalidate(self, path):
+        """Remove all entries for the given path.
+        """
+        path = os.path.normcase(os.path.abspath(path))
+        self.discard(lambda key: key[0] == path)
+
+
+zip_dir_cache = ZipDirCache()
+
+
+class CachedZipFile(zipfile.ZipFile):
+    """A read-only ZipFile that reuses a cached central directory.
+
+    Each instance still has its own file handle and can be closed normally.
+    A file-like object is parsed normally without caching.
+
+    NOTE: ZipInfo objects are shared among instances for the same ZIP file,
+    and should be copied before being modified (e.g. for writing to another
+    ZIP file).
+    """
+    open_count = 0  # number of instances not yet closed
+    _open_count_lock = threading.Lock()
+
+    def __init__(self, file, cache=None, key=None):
+        """
+        Args:
+            cache: the ZipDirCache to use. None for the default one.
+            key: the cache key that identifies the ZIP file. None to generate
+                from the file path.
+        """
+        self._dir_cache = zip_dir_cache if cache is None else cache
+        self.cache_key = key
+        super().__init__(file, 'r')
+
+        with self._open_count_lock:
+            CachedZipFile.open_count += 1
+
+    def close(self):
+        if self.fp is None:
+            return
+
         try:
-            zh.getinfo(base)
-            return True
+            super().close()
+        finally:
+            with self._open_count_lock:
+                CachedZipFile.open_count -= 1
+
+    def _RealGetContents(self):
+        if self.cache_key is None:
+            if self._filePassed:
+                super()._RealGetContents()
+                return
+
+            self.cache_key = self._dir_cache.get_key(self.filename, os.fstat(self.fp.fileno()))
+
+        value = self._dir_cache.get(self.cache_key)
+        if value is None:
+            super()._RealGetContents()
+            value = (self.filelist, self.NameToInfo, self.start_dir, self._comment)
+            self._dir_cache.set(self.cache_key, value)
+
+        self.filelist, self.NameToInfo, self.start_dir, self._comment = value
+
+
+class ZipDirTrie:
+    """Directory tree of the entries in a ZIP file.
+
+    Maps the path of each explicit or implicit directory ('' for the root)
+    to an insertion-ordered dict of its child names, so that a lookup costs
+    in proportion to the result rather than the number of entries.
+    """
+    ENTRY_OVERHEAD = 160  # estimated bytes for a child entry
+
+    def __init__(self, names):
+        self.dirs = {'': {}}
+        for name in names:
+            path = name.rstrip('/')
+            if not path:
+                continue
+
+            parts = path.split('/')
+            last = len(parts) - 1
+            parent = ''
+            for i, part in enumerate(parts):
+                self.dirs[parent][part] = None
+                parent = parent + '/' + part if i else part
+                if i < last or path != name:
+                    self.dirs.setdefault(parent, {})
+
+    def is_dir(self, path):
+        return path.rstrip('/') in self.dirs
+
+    def children(self, path):
+        """Get names of the children of a directory, or None if not exist."""
+        try:
+            return list(self.dirs[path.rstrip('/')])
         except KeyError:
+            return None
+
+    def walk(self, path):
+        """Generate subpaths of the descendants of a directory, top-down."""
+        path = path.rstrip('/')
+        stack = [(path, '')]
+        while stack:
+            path, prefix = stack.pop()
+            subdirs = []
+            for name in self.dirs.get(path, ()):
+                subpath = prefix + name
+                yield subpath
+                subdir = path + '/' + name if path else name
+                if subdir in self.dirs:
+                    subdirs.append((subdir, subpath + '/'))
+            stack.extend(reversed(subdirs))
+
+    def estimate_size(self):
+        return sum(
+            self.ENTRY_OVERHEAD + len(path) + sum(len(name) + self.ENTRY_OVERHEAD for name in children)
+            for path, children in self.dirs.items()
+            )
+
+zip_dir_trie_cache = ZipDirCache(max_entries=128, max_bytes=64 * 1024 * 1024)
+
+
+def zip_dir_trie(zh):
+    """Get the directory trie of an opened zipfile.ZipFile.
+
+    The trie is built lazily, and shared among CachedZipFile instances for
+    the same ZIP file. A ZipFile opened for writing is not cached as its
+    entries may change.
+    """
+    if zh.mode != 'r':
+        return ZipDirTrie(zh.namelist())
+
+    trie = getattr(zh, '_dir_trie', None)
+    if trie is not None:
+        return trie
+
+    key = getattr(zh, 'cache_key', None)
+    if key is not None:
+        trie = zip_dir_trie_cache.get(key)
+
+    if trie is None:
+        trie = ZipDirTrie(zh.namelist())
+        if key is not None:
+            zip_dir_trie_cache.set(key, trie, size=trie.estimate_size())
+
+    zh._dir_trie = trie
+    return trie
+
+
+class NestedZipCache:
+    """A thread-safe LRU cache of ZIP files extracted from a ZIP file.
+
+    A ZipExtFile can only seek backwards by decompressing again from the
+    start, which makes reading an inner ZIP file extremely slow. An inner ZIP
+    file is thus extracted once, in memory or to a temp file if large, and
+    reused until evicted.
+
+    An entry is keyed by the cache key of the outer ZIP file and the name,
+    CRC, and size of the member.
+    """
+    MAX_MEMORY_SIZE = 8 * 1024 * 1024  # larger members are extracted to disk
+    MAX_MEMORY_BYTES = 64 * 1024 * 1024
+    MAX_DISK_BYTES = 1024 * 1024 * 1024
+
+    def __init__(self, dir_cache=None, *,
+            max_memory_size=None, max_memory_bytes=None, max_disk_bytes=None):
+        self.dir_cache = zip_dir_cache if dir_cache is None else dir_cache
+        self.max_memory_size = self.MAX_MEMORY_SIZE if max_memory_size is None else max_memory_size
+        self.max_memory_bytes = self.MAX_MEMORY_BYTES if max_memory_bytes is None else max_memory_bytes
+        self.max_disk_bytes = self.MAX_DISK_BYTES if max_disk_bytes is None else max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._tempdir = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def open(self, zh, name):
+        """Open a member of the ZIP file as a ZIP file.
+
+        Args:
+            zh: the outer zipfile.ZipFile, preferably a CachedZipFile
+            name: str or zipfile.ZipInfo of the member
+
+        Returns:
+            CachedZipFile: the inner ZIP file, which should be closed after
+                being used.
+
+        Raises:
+            KeyError: if the member does not exist
+            zipfile.BadZipFile: if the member is not a ZIP file
+        """
+        info = name if isinstance(name, zipfile.ZipInfo) else zh.getinfo(name)
+        parent_key = getattr(zh, 'cache_key', None)
+
+        # unable to identify the outer ZIP file, read without caching
+        if parent_key is None:
+            return zipfile.ZipFile(io.BytesIO(zh.read(info)))
+
+        key = (parent_key, info.filename, info.CRC, info.file_size)
+
+        with self._lock:
+            try:
+                data, _ = self._entries[key]
+            except KeyError:
+                data = None
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+
+        if data is not None:
+            try:
+                return self._open_data(data, key)
+            except FileNotFoundError:
+                # temp file removed after eviction by another thread
+                pass
+
+        data = self._extract(zh, info)
+        try:
+            zip = self._open_data(data, key)
+        except BaseException:
+            self._remove_data(data)
+            raise
+        self._add(key, data, info.file_size)
+        return zip
+
+    def clear(self):
+        with self._lock:
+            for data, _ in self._entries.values():
+                self._remove_data(data)
+            self._entries.clear()
+            self.memory_bytes = 0
+            self.disk_bytes = 0
+
+    def _open_data(self, data, key):
+        if isinstance(data, bytes):
+            return CachedZipFile(io.BytesIO(data), self.dir_cache, key)
+        return CachedZipFile(data, self.dir_cache, key)
+
+    def _extract(self, zh, info):
+        if info.file_size <= self.max_memory_size:
+            return zh.read(info)
+
+        with self._lock:
+            if self._tempdir is None:
+                self._tempdir = tempfile.TemporaryDirectory(prefix='wsbzip-')
+            tempdir = self._tempdir.name
+
+        fd, file = tempfile.mkstemp(suffix='.zip', dir=tempdir)
+        try:
+            with os.fdopen(fd, 'wb') as fw, zh.open(info) as fr:
+                shutil.copyfileobj(fr, fw)
+        except BaseException:
+            self._remove_data(file)
+            raise
+        return file
+
+    def _add(self, key, data, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._account(*old, -1)
+                self._remove_data(old[0])
+
+            self._entries[key] = (data, size)
+            self._account(data, size, 1)
+
+            # evict least recently used entries of the exceeding storage
+            for k in list(self._entries):
+                memory_exceeded = self.memory_bytes > self.max_memory_bytes
+                disk_exceeded = self.disk_bytes > self.max_disk_bytes
+                if not (memory_exceeded or disk_exceeded):
+                    break
+
+                v, vsize = self._entries[k]
+                if not (memory_exceeded if isinstance(v, bytes) else disk_exceeded):
+                    continue
+
+                del self._entries[k]
+                self._account(v, vsize, -1)
+                self._remove_data(v)
+
+    def _account(self, data, size, sign):
+        if isinstance(data, bytes):
+            self.memory_bytes += sign * size
+        else:
+            self.disk_bytes += sign * size
+
+    @staticmethod
+    def _remove_data(data):
+        if isinstance(data, bytes):
+            return
+
+        # may fail on Windows if the file is still opened, and will be
+        # cleaned up along with the temp directory on exit
+        try:
+            os.remove(data)
+        except OSError:
             pass
 
-        # otherwise, look for an implicit directory
-        for path in zh.namelist():
-            if path.startswith(base):
-                return True
+nested_zip_cache = NestedZipCache()
 
-    return False
+
+class FileSlice(io.RawIOBase):
+    """A read-only seekable file object for a byte span of a file.
+
+    Reads are issued against an own file handle, so that the ZIP file
+    object the span comes from can be closed or used concurrently.
+    """
+    def __init__(self, fh, offset, size):
+        self._fh = fh
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b), self._size - self._pos)
+        if size <= 0:
+            return 0
+        self._fh.seek(self._offset + self._pos)
+        size = self._fh.readinto(memoryview(b)[:size])
+        self._pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f'invalid whence ({whence!r})')
+        if pos < 0:
+            raise ValueError(f'negative seek position {pos!r}')
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._fh.close()
+        super().close()
+
+
+def zip_open_raw(zip, info):
+    """Open the raw (compressed) data of a member as a span of the ZIP file.
+
+    Args:
+        zip: an opened zipfile.ZipFile
+        info: zipfile.ZipInfo of the member
+
+    Returns:
+        FileSlice: or None if the ZIP is not backed by a regular file on disk
+            (e.g. nested).
+    """
+    # a ZipFile opened from a path or a real file object has a
+    # BufferedReader fp, while a nested ZIP has a BytesIO or ZipExtFile
+    if not isinstance(zip.fp, io.BufferedReader):
+        return None
+
+    try:
+        fh = open(zip.fp.name, 'rb')
+    except (OSError, TypeError):
+        return None
+
+    try:
+        # make sure the path still refers to the opened ZIP file, which may
+        # have been replaced in the meantime
+        st = os.fstat(fh.fileno())
+        st0 = os.fstat(zip.fp.fileno())
+        if (st.st_dev, st.st_ino) != (st0.st_dev, st0.st_ino):
+            fh.close()
+            return None
+
+        offset = _zip_data_offset(fh, info)
+    except BaseException:
+        fh.close()
+        raise
+
+    return FileSlice(fh, offset, info.compress_size)
+
+
+def _zip_data_offset(fh, info):
+    """Get the offset of a member's data by reading its local file header."""
+    fh.seek(info.header_offset)
+    header = fh.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader:
+        raise zipfile.BadZipFile('Truncated file header')
+    header = struct.unpack(zipfile.structFileHeader, header)
+    if header[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile('Bad magic number for file header')
+    return (info.header_offset + zipfile.sizeFileHeader
+        + header[zipfile._FH_FILENAME_LENGTH]
+        + header[zipfile._FH_EXTRA_FIELD_LENGTH])
+
+
+def _zip_strip_extra(extra, ids):
+    """Remove the extra fields with the given header IDs."""
+    fields = []
+    i = 0
+    while i + 4 <= len(extra):
+        field_id, size = struct.unpack('<HH', extra[i:i + 4])
+        j = i + 4 + size
+        if field_id not in ids:
+            fields.append(extra[i:j])
+        i = j
+    fields.append(extra[i:])
+    return b''.join(fields)
+
+
+def _zip_can_copy_raw(zsrc, zdest):
+    """Check whether the zipfile internals used for copying raw data exist."""
+    return hasattr(zsrc, '_lock') and all(hasattr(zdest, name) for name in (
+        '_lock', '_writing', '_writecheck', '_didModify', '_seekable'))
+
+
+def zip_copy_member(zsrc, info, zdest, chunk_size=65536):
+    """Copy a member to another ZIP file without recompressing.
+
+    The compressed data is copied verbatim, so that the cost is proportional
+    to the compressed size, and memory usage stays flat. Fallback to
+    decompressing and recompressing if the zipfile internals it relies on
+    are unavailable.
+
+    Args:
+        zsrc: a zipfile.ZipFile opened for reading, with a seekable file
+        info: zipfile.ZipInfo of the member
+        zdest: a zipfile.ZipFile opened for writing or appending
+    """
+    zinfo = copy.copy(info)
+
+    # CRC and sizes are known and written in the local header, so a data
+    # descriptor is not needed
+    zinfo.flag_bits &= ~0x08
+
+    # a ZIP64 extra field will be regenerated if needed
+    zinfo.extra = _zip_strip_extra(zinfo.extra, (1,))
+
+    if not _zip_can_copy_raw(zsrc, zdest):
+        force_zip64 = info.file_size > zipfile.ZIP64_LIMIT
+        with zsrc.open(info) as fr, zdest.open(zinfo, 'w', force_zip64=force_zip64) as fw:
+            shutil.copyfileobj(fr, fw, chunk_size)
+        return
+
+    with zsrc._lock, zdest._lock:
+        if not zdest.fp:
+            raise ValueError('Attempt to write to ZIP archive that was already closed')
+        if zdest._writing:
+            raise ValueError("Can't write to the ZIP file while there is "
+                             "an open writing handle on it.")
+        zdest._writecheck(zinfo)
+        zdest._didModify = True
+
+        offset = _zip_data_offset(zsrc.fp, info)
+
+        if zdest._seekable:
+            zdest.fp.seek(zdest.start_dir)
+        zinfo.header_offset = zdest.fp.tell()
+        zdest.fp.write(zinfo.FileHeader())
+
+        zsrc.fp.seek(offset)
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = zsrc.fp.read(min(remaining, chunk_size))
+            if not chunk:
+                raise zipfile.BadZipFile('Truncated file data')
+            zdest.fp.write(chunk)
+            remaining -= len(chunk)
+
+        zdest.start_dir = zdest.fp.tell()
+        zdest.filelist.append(zinfo)
+        zdest.NameToInfo[zinfo.filename] = zinfo
+
+
+def zip_open_stored(zip, info):
+    """Open a STORED member as a seekable span of the underlying ZIP file.
+
+    Args:
+        zip: an opened zipfile.ZipFile
+        info: zipfile.ZipInfo of the member
+
+    Returns:
+        FileSlice: or None if the member is compressed or encrypted, or the
+            ZIP is not backed by a regular file on disk (e.g. nested).
+    """
+    if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+        return None
+
+    return zip_open_raw(zip, info)
+
+
+class ZipGzipStream:
+    """An iterable of a gzip stream built from the raw data of a DEFLATED member.
+
+    The raw DEFLATE data is wrapped with a gzip header and a trailer built
+    from the CRC and size recorded in the ZIP file, without decompressing.
+    """
+    OVERHEAD = 18  # bytes of the gzip header and trailer
+
+    def __init__(self, raw, info, chunk_size=65536):
+        """
+        Args:
+            raw: a file object of the raw DEFLATE data
+            info: zipfile.ZipInfo of the member
+        """
+        self.raw = raw
+        self.info = info
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self.info.compress_size + self.OVERHEAD
+
+    def __iter__(self):
+        info = self.info
+        try:
+            # magic, method (deflate), flags, mtime, extra flags, OS (unknown)
+            yield b'\x1f\x8b\x08\x00' + struct.pack('<L', int(zip_timestamp(info))) + b'\x00\xff'
+            while True:
+                chunk = self.raw.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            yield struct.pack('<LL', info.CRC, info.file_size & 0xFFFFFFFF)
+        finally:
+            self.close()
+
+    def close(self):
+        self.raw.close()
+
+
+def zip_open_gzip(zip, info):
+    """Open a DEFLATED member as a gzip stream without decompressing it.
+
+    Args:
+        zip: an opened zipfile.ZipFile
+        info: zipfile.ZipInfo of the member
+
+    Returns:
+        ZipGzipStream: or None if the member is not DEFLATED or is encrypted,
+            or the ZIP is not backed by a regular file on disk.
+    """
+    if info.compress_type != zipfile.ZIP_DEFLATED or info.flag_bits & 0x1:
+        return None
+
+    raw = zip_open_raw(zip, info)
+    if raw is None:
+        return None
+
+    return ZipGzipStream(raw, info)
+
+
+@contextmanager
+def zip_tombstone(zip, name):
+    """Replace a member of a ZIP opened for appending with a new version.
+
+    The new version should be written to the ZIP within the context. The old
+    member is dropped from the central directory once the context exits
+    successfully, and its data is left in the file as dead space, so that the
+    whole ZIP file need not be rewritten. Run zip_compact() to reclaim the
+    space.
+
+    If the context raises, any partially written new version is dropped
+    instead, so that closing the ZIP file keeps the old member.
+
+    Raises:
+        KeyError: if the member does not exist
+    """
+    info = zip.NameToInfo.pop(name)
+    try:
+        yield
+    except BaseException:
+        zip.filelist = [i for i in zip.filelist if i is info or i.filename != name]
+        zip.NameToInfo[name] = info
+        raise
+    zip.filelist = [i for i in zip.filelist if i is not info]
+    zip._didModify = True
+
+
+def zip_garbage_ratio(zip):
+    """Get the ratio of dead space in the member data area of a ZIP file.
+
+    Calculated from the central directory only, without reading the local
+    headers: a member takes the estimated size of its local record, capped
+    by the offset of the next member, and the remaining space is dead. As
+    extra fields that exist only in a local header (e.g. those added by
+    Info-ZIP) are not counted, the ratio is an estimate that may be slightly
+    above zero for a ZIP file without dead space.
+
+    Args:
+        zip: path, file-like object, or zipfile.ZipFile
+    """
+    with nullcontext(zip) if isinstance(zip, zipfile.ZipFile) else zipfile.ZipFile(zip) as zh:
+        if not zh.start_dir:
+            return 0
+
+        infos = sorted(zh.infolist(), key=attrgetter('header_offset'))
+        used = 0
+        for i, info in enumerate(infos):
+            end = infos[i + 1].header_offset if i + 1 < len(infos) else zh.start_dir
+            size = (zipfile.sizeFileHeader + len(info._encodeFilenameFlags()[0])
+                    + len(info.extra) + info.compress_size)
+            if info.flag_bits & 0x08:
+                # data descriptor, with an optional signature
+                size += 24 if max(info.file_size, info.compress_size) > zipfile.ZIP64_LIMIT else 16
+            used += min(size, end - info.header_offset)
+
+        return max(zh.start_dir - used, 0) / zh.start_dir
+
+
+ZIP_COMPACT_RATIO = 0.5
+
+
+def zip_compact(file, threshold=None):
+    """Rewrite a ZIP file to reclaim dead space left by zip_tombstone().
+
+    The ZIP file is written to a temp file next to it and renamed to replace
+    it.
+
+    Args:
+        file: path of the ZIP file
+        threshold: compact only if the garbage ratio exceeds this value.
+            None for ZIP_COMPACT_RATIO.
+
+    Returns:
+        bool: whether the ZIP file is compacted
+    """
+    threshold = ZIP_COMPACT_RATIO if threshold is None else threshold
+
+    with zipfile.ZipFile(file) as zsrc:
+        if zip_garbage_ratio(zsrc) <= threshold:
+            return False
+
+        # write next to the target of a symlink so that it can be replaced
+        dirname, basename = os.path.split(os.path.realpath(file))
+        with tempfile.NamedTemporaryFile(
+                prefix=f'.{basename}.', suffix='.tmp', dir=dirname, delete=False) as fh:
+            try:
+                with zipfile.ZipFile(fh, 'w') as zdest:
+                    zdest.comment = zsrc.comment
+                    for info in zsrc.infolist():
+                        zip_copy_member(zsrc, info, zdest)
+            except BaseException:
+                fh.close()
+                os.remove(fh.name)
+                raise
+
+    try:
+        file_replace(fh.name, file)
+    finally:
+        zip_cache_invalidate(file)
+
+    return True
+
+
+class ZipDeflateIndex:
+    """A thread-safe checkpoint index for random access into a DEFLATED member.
+
+    Like zlib's zran example, the decompressor state (including the 32 KiB
+    window) is saved about every SPAN bytes of output, so that reading from
+    an offset can resume from the nearest preceding checkpoint rather than
+    from the start. The index is built lazily while the member is read.
+    """
+    MIN_SIZE = 4 * 1024 * 1024  # smaller members are not worth indexing
+    SPAN = 1024 * 1024
+    CHECKPOINT_SIZE = 48 * 1024  # estimated bytes for a saved decompressor
+
+    def __init__(self, span=None):
+        self.span = self.SPAN if span is None else span
+        self._outs = [0]
+        self._checkpoints = [(0, zlib.decompressobj(-zlib.MAX_WBITS))]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._outs)
+
+    @classmethod
+    def estimate_size(cls, file_size, span=None):
+        span = cls.SPAN if span is None else span
+        return (file_size // span + 1) * cls.CHECKPOINT_SIZE
+
+    def nearest(self, pos):
+        """Get the output offset of the nearest checkpoint at or before pos."""
+        with self._lock:
+            return self._outs[bisect.bisect_right(self._outs, pos) - 1]
+
+    def restore(self, pos):
+        """Get a checkpoint at or before pos.
+
+        Returns:
+            tuple: (input offset, output offset, decompressor), in which the
+                decompressor is a copy that can be used freely.
+        """
+        with self._lock:
+            i = bisect.bisect_right(self._outs, pos) - 1
+            in_pos, decomp = self._checkpoints[i]
+            return in_pos, self._outs[i], decomp.copy()
+
+    def add(self, in_pos, out_pos, decomp):
+        """Save the decompressor state if it extends the index enough."""
+        if out_pos < self._outs[-1] + self.span:
+            return
+        with self._lock:
+            if out_pos < self._outs[-1] + self.span:
+                return
+            self._outs.append(out_pos)
+            self._checkpoints.append((in_pos, decomp.copy()))
+
+
+class ZipDeflateFile(io.RawIOBase):
+    """A read-only seekable file object for a DEFLATED member.
+
+    Seeking is lazy: the next read resumes decompression from the current
+    stream position, or from the nearest checkpoint of the index if it is
+    closer.
+    """
+    CHUNK_SIZE = 64 * 1024
+    MAX_OUTPUT = 256 * 1024
+
+    def __init__(self, raw, size, index):
+        """
+        Args:
+            raw: a seekable file object of the raw DEFLATE stream
+            size: the decompressed size
+            index: a ZipDeflateIndex for the stream
+        """
+        self._raw = raw
+        self._size = size
+        self._index = index
+        self._pos = 0
+        self._decomp = None
+        self._in_pos = 0
+        self._buf = b''
+        self._buf_pos = 0  # output offset of self._buf
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b), self._size - self._pos)
+        if size <= 0:
+            return 0
+
+        if (self._decomp is None or self._pos < self._buf_pos
+                or self._index.nearest(self._pos) > self._buf_pos + len(self._buf)):
+            self._in_pos, self._buf_pos, self._decomp = self._index.restore(self._pos)
+            self._raw.seek(self._in_pos)
+            self._buf = b''
+
+        view = memoryview(b)
+        read = 0
+        while read < size:
+            while self._pos >= self._buf_pos + len(self._buf):
+                self._buf_pos += len(self._buf)
+                self._buf = b''
+                if not self._fill():
+                    raise zipfile.BadZipFile('Unexpected end of compressed data')
+
+            start = self._pos - self._buf_pos
+            data = self._buf[start:start + size - read]
+            view[read:read + len(data)] = data
+            read += len(data)
+            self._pos += len(data)
+        return read
+
+    def _fill(self):
+        if self._decomp.eof:
+            return False
+
+        chunk = self._decomp.unconsumed_tail or self._raw.read(self.CHUNK_SIZE)
+        if not chunk:
+            return False
+
+        self._buf = self._decomp.decompress(chunk, self.MAX_OUTPUT)
+        tail = self._decomp.unconsumed_tail
+        self._in_pos += len(chunk) - len(tail)
+
+        # a saved state must not hold pending input
+        if not tail:
+            self._index.add(self._in_pos, self._buf_pos + len(self._buf), self._decomp)
+
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f'invalid whence ({whence!r})')
+        if pos < 0:
+            raise ValueError(f'negative seek position {pos!r}')
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+        super().close()
+
+
+zip_deflate_index_cache = ZipDirCache(max_entries=64, max_bytes=64 * 1024 * 1024)
+
+
+def zip_cache_invalidate(path):
+    """Remove all cached data of a ZIP file, e.g. after it is modified."""
+    for cache in (zip_dir_cache, zip_dir_trie_cache, zip_deflate_index_cache):
+        cache.invalidate(path)
+
+
+def zip_open_deflated(zip, info, cache=None):
+    """Open a DEFLATED member for random access using a cached index.
+
+    Args:
+        zip: an opened util.CachedZipFile
+        info: zipfile.ZipInfo of the member
+        cache: the ZipDirCache to store indexes. None for the default one.
+
+    Returns:
+        ZipDeflateFile: or None if the member is not DEFLATED or is
+            encrypted, or the ZIP is not backed by a regular file on disk.
+    """
+    if info.compress_type != zipfile.ZIP_DEFLATED or info.flag_bits & 0x1:
+        return None
+
+    parent_key = getattr(zip, 'cache_key', None)
+    if parent_key is None:
+        return None
+
+    raw = zip_open_raw(zip, info)
+    if raw is None:
+        return None
+
+    cache = zip_deflate_index_cache if cache is None else cache
+    key = parent_key + (info.filename, info.CRC, info.compress_size)
+    index = cache.get(key)
+    if index is None:
+        index = ZipDeflateIndex()
+        cache.set(key, index, ZipDeflateIndex.estimate_size(info.file_size))
+
+    return ZipDeflateFile(raw, info.file_size, index)
 
 
 #########################################################################
@@ -782,6 +1943,236 @@ def parse_datauri(datauri):
     return DataUri(bytes_, mime, parameters)
 
 
+class DiskCache:
+    """A size-capped directory of cache files.
+
+    A file is named after the SHA-1 hash of its key, and its mtime records
+    when it was last used. Least recently used files are removed when the
+    total size exceeds the limit.
+    """
+    def __init__(self, root, suffix, max_size):
+        """
+        Args:
+            root: the directory to store the cache files
+            suffix: the file extension of the cache files, e.g. '.gz'
+            max_size: max total size of the cache files
+        """
+        self.root = root
+        self.suffix = suffix
+        self.max_size = max_size
+        self._size = None  # lazily computed total size
+        self._lock = threading.Lock()
+
+    def get_file(self, key):
+        """Get the path of the cache file for a key."""
+        key = hashlib.sha1(key.encode('UTF-8', 'surrogatepass')).hexdigest()
+        return os.path.join(self.root, key[:2], key + self.suffix)
+
+    def touch(self, file):
+        """Mark a cache file as recently used.
+
+        Returns:
+            bool: whether the file exists.
+        """
+        try:
+            os.utime(file)
+        except OSError:
+            return False
+        return True
+
+    def write(self, file, writer):
+        """Atomically write a cache file and prune old files if needed.
+
+        Args:
+            file: the path of the cache file
+            writer: a callable that writes to the passed binary file object
+
+        Returns:
+            str: the file, or None if it has been pruned for being too large.
+
+        Raises:
+            OSError: if the file cannot be written
+        """
+        dirname = os.path.dirname(file)
+        os.makedirs(dirname, exist_ok=True)
+        with tempfile.NamedTemporaryFile(suffix='.tmp', dir=dirname, delete=False) as fh:
+            try:
+                writer(fh)
+                size = fh.tell()
+            except BaseException:
+                fh.close()
+                os.remove(fh.name)
+                raise
+        os.replace(fh.name, file)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(s for _, _, s in self._iter_files())
+            else:
+                self._size += size
+            if self._size > self.max_size:
+                self._prune()
+
+        # may have been pruned if too large
+        if not os.path.lexists(file):
+            return None
+
+        return file
+
+    def _iter_files(self):
+        for root, dirs, files in os.walk(self.root):
+            for file in files:
+                if not file.endswith(self.suffix):
+                    continue
+                file = os.path.join(root, file)
+                try:
+                    st = os.stat(file)
+                except OSError:
+                    continue
+                yield file, st.st_mtime, st.st_size
+
+    def _prune(self):
+        files = sorted(self._iter_files(), key=lambda x: x[1])
+        self._size = sum(s for _, _, s in files)
+        for file, _, size in files:
+            if self._size <= self.max_size:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                continue
+            self._size -= size
+
+
+class GzipFileCache:
+    """A size-capped on-disk cache of gzip variants of files.
+
+    A variant is named after the path, size, and mtime of the source file,
+    so that a modified source file never hits a stale variant.
+    """
+    def __init__(self, root, level=6, min_size=1024, max_size=100 * 1024 * 1024):
+        """
+        Args:
+            root: the directory to store gzip variants
+            level: the compression level
+            min_size: do not compress a file smaller than this size
+            max_size: max total size of the cached variants
+        """
+        self.root = root
+        self.level = level
+        self.min_size = min_size
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._disk = DiskCache(root, '.gz', max_size)
+        self._lock = threading.Lock()
+
+    def get(self, file, st=None):
+        """Get the path of the gzip variant of a file, generating if needed.
+
+        Returns:
+            str: or None if the file is too small or the variant cannot be
+                generated.
+        """
+        if st is None:
+            st = os.stat(file)
+
+        if st.st_size < self.min_size:
+            return None
+
+        dst = self._disk.get_file(
+            f'{os.path.normcase(os.path.abspath(file))}\0{st.st_size}\0{st.st_mtime_ns}')
+
+        if self._disk.touch(dst):
+            with self._lock:
+                self.hits += 1
+            return dst
+
+        with self._lock:
+            self.misses += 1
+
+        try:
+            return self._disk.write(dst, lambda fh: self._compress(file, st, fh))
+        except OSError:
+            return None
+
+    def _compress(self, file, st, fw):
+        with open(file, 'rb') as fr, gzip.GzipFile(filename='', mode='wb', fileobj=fw,
+                compresslevel=self.level, mtime=int(st.st_mtime)) as fh:
+            shutil.copyfileobj(fr, fh)
+
+
+class TextCache:
+    """A thread-safe LRU cache of generated text, e.g. rendered markdown.
+
+    Entries are kept in memory up to a total size, and optionally also
+    saved under a size-capped directory, so that they survive eviction from
+    memory and server restarts.
+
+    A key should identify the source and its version (e.g. an ETag), since
+    entries are never invalidated.
+    """
+    def __init__(self, max_size=16 * 1024 * 1024, root=None, max_disk_size=100 * 1024 * 1024):
+        """
+        Args:
+            max_size: max total size of the entries in memory
+            root: the directory to save entries, or None for memory only
+            max_disk_size: max total size of the saved entries
+        """
+        self.max_size = max_size
+        self.root = root
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.misses = 0
+        self._memory = LRUCache(max_bytes=max_size)
+        self._lock = threading.Lock()
+        self._disk = DiskCache(root, '.txt', max_disk_size) if root is not None else None
+
+    def __len__(self):
+        return len(self._memory)
+
+    @property
+    def size(self):
+        """Total size of the entries in memory."""
+        return self._memory.bytes
+
+    def get(self, key):
+        """Get the cached text, or None if not cached."""
+        text = self._memory.get(key)
+        if text is not None:
+            with self._lock:
+                self.hits += 1
+            return text
+
+        if self._disk is not None:
+            file = self._disk.get_file(key)
+            try:
+                with open(file, 'rb') as fh:
+                    text = fh.read().decode('UTF-8')
+            except (OSError, UnicodeDecodeError):
+                pass
+            else:
+                self._disk.touch(file)
+                with self._lock:
+                    self.hits += 1
+                self._memory.set(key, text, len(text))
+                return text
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, text):
+        self._memory.set(key, text, len(text))
+
+        if self._disk is not None:
+            data = text.encode('UTF-8')
+            try:
+                self._disk.write(self._disk.get_file(key), lambda fh: fh.write(data))
+            except OSError:
+                pass
+
+
 #########################################################################
 # HTML manipulation
 #########################################################################
@@ -862,11 +2253,12 @@ META_REFRESH_FORBID_TAGS = {
     'xmp',
     }
 
-def iter_meta_refresh(file):
+def iter_meta_refresh(file, head_only=False):
     """Iterate through meta refreshes from a file.
 
     Args:
         file: str, path-like, or file-like object
+        head_only: stop parsing at the start of <body>
     """
     try:
         fh = open(file, 'rb')
@@ -882,6 +2274,9 @@ def iter_meta_refresh(file):
         contexts = []
         for event, elem in etree.iterparse(fh, html=True, events=('start', 'end')):
             if event == 'start':
+                if head_only and elem.tag == 'body':
+                    break
+
                 if elem.tag in META_REFRESH_CONTEXT_TAGS:
                     contexts.append(elem.tag)
                     continue
@@ -918,18 +2313,76 @@ def iter_meta_refresh(file):
             fh.close()
 
 
-def parse_meta_refresh(file):
+def parse_meta_refresh(file, head_only=False):
     """Retrieve meta refresh target from a file.
 
     Args:
         file: str, path-like, or file-like object
+        head_only: stop parsing at the start of <body>
     """
-    for info in iter_meta_refresh(file):
+    for info in iter_meta_refresh(file, head_only=head_only):
         if info.time == 0 and info.target is not None and not info.context:
             return info
     return MetaRefreshInfo(time=None, target=None, context=None)
 
 
+class MetaRefreshCache(LRUCache):
+    """A thread-safe LRU cache of parsed meta refreshes of files.
+
+    A file is keyed by its path, inode, size, and mtime, and a ZIP member is
+    keyed by the cache key of the ZIP file and the name, CRC, and size of the
+    member, so that a modified file never hits a stale entry.
+
+    Only the <head> of a file is parsed, as this is for redirect stubs.
+    """
+    MAX_ENTRIES = 4096
+
+    def __init__(self, max_entries=None):
+        super().__init__(self.MAX_ENTRIES if max_entries is None else max_entries)
+
+    def parse(self, file, st=None):
+        """Retrieve meta refresh target from a file.
+
+        Args:
+            file: str or path-like
+            st: known stat of the file
+        """
+        if st is None:
+            st = os.stat(file)
+        key = (os.path.normcase(os.path.abspath(file)), st.st_ino, st.st_size, st.st_mtime_ns)
+        return self._parse(key, lambda: parse_meta_refresh(file, head_only=True))
+
+    def parse_zip(self, zh, info):
+        """Retrieve meta refresh target from a ZIP member.
+
+        Args:
+            zh: zipfile.ZipFile, preferably a CachedZipFile
+            info: zipfile.ZipInfo of the member
+        """
+        def parse():
+            with zh.open(info) as fh:
+                return parse_meta_refresh(fh, head_only=True)
+
+        parent_key = getattr(zh, 'cache_key', None)
+
+        # unable to identify the ZIP file, parse without caching
+        if parent_key is None:
+            return parse()
+
+        key = (parent_key, info.filename, info.CRC, info.file_size)
+        return self._parse(key, parse)
+
+    def _parse(self, key, parse):
+        rv = self.get(key)
+        if rv is None:
+            rv = parse()
+            self.set(key, rv)
+        return rv
+
+
+meta_refresh_cache = MetaRefreshCache()
+
+
 #########################################################################
 # MAFF manipulation
 #########################################################################